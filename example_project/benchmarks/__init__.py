@@ -0,0 +1,107 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmarks for sky_visitor. Run them from the example_project directory, for example:
+
+    python -m benchmarks.auth_backends
+    python -m benchmarks.auth_backends --settings=customuser_tests.settings
+
+Each benchmark runs against a fresh test database created from the chosen settings module.
+"""
+import atexit
+import os
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+# Insert the app that this is an example project for
+PROJ_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if PROJ_DIR not in sys.path:
+    sys.path.insert(0, PROJ_DIR)
+
+
+def get_option_parser(usage=None):
+    parser = OptionParser(usage=usage)
+    parser.add_option('--settings', dest='settings', default='normal_tests.settings',
+                      help="Django settings module to benchmark against.")
+    parser.add_option('--iterations', dest='iterations', type='int', default=200,
+                      help="Number of times each case is run.")
+    return parser
+
+
+def setup(settings_module, shared_database=False):
+    """
+    Configure Django and create a test database with the example project's fixtures loaded.
+
+    SQLite test databases are in memory and private to one connection. Pass `shared_database=True` when other threads
+    (a server, for example) need to see the same data, and a temporary file is used instead.
+    """
+    os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    if shared_database and connection.vendor == 'sqlite':
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        atexit.register(os.remove, path)
+        connection.settings_dict['TEST_NAME'] = path
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+
+class Measurement(object):
+
+    def __init__(self, name, iterations, seconds, queries):
+        self.name = name
+        self.iterations = iterations
+        self.seconds = seconds
+        self.queries = queries
+
+    @property
+    def ms_per_call(self):
+        return self.seconds * 1000.0 / self.iterations
+
+    @property
+    def calls_per_second(self):
+        return self.iterations / max(self.seconds, 1e-9)
+
+    @property
+    def queries_per_call(self):
+        return float(self.queries) / self.iterations
+
+
+def measure(name, func, iterations):
+    """
+    Call `func` `iterations` times and record the wall time and the number of database queries it ran.
+    """
+    from django.db import connection, reset_queries
+    connection.use_debug_cursor = True
+    reset_queries()
+    try:
+        start = time.time()
+        for i in range(iterations):
+            func()
+        seconds = time.time() - start
+        queries = len(connection.queries)
+    finally:
+        connection.use_debug_cursor = None
+        reset_queries()
+    return Measurement(name, iterations, seconds, queries)
+
+
+def report(measurements, stream=sys.stdout):
+    width = max(len(m.name) for m in measurements)
+    stream.write("%s  %10s  %10s  %12s\n" % ('case'.ljust(width), 'ms/call', 'calls/s', 'queries/call'))
+    for m in measurements:
+        stream.write("%s  %10.2f  %10.0f  %12.1f\n" % (m.name.ljust(width), m.ms_per_call, m.calls_per_second, m.queries_per_call))
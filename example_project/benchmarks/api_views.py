@@ -0,0 +1,71 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compare the HTML views with their JSON versions in `sky_visitor.views.api`, one request each through the test client.
+The HTML cases follow their redirect, as a browser would, so they include the page it lands on.
+
+    python -m benchmarks.api_views [--settings=...] [--iterations=...]
+"""
+import itertools
+
+from benchmarks import get_option_parser, measure, report, setup
+
+
+def main():
+    options, args = get_option_parser().parse_args()
+    setup(options.settings)
+
+    from django.contrib.auth import get_user_model
+    from django.core import mail
+    from django.core.urlresolvers import reverse
+    from django.test.client import Client
+
+    UserModel = get_user_model()
+    user = UserModel._default_manager.all()[0]
+    user.set_password('benchmark')
+    user.save()
+    username = getattr(user, UserModel.USERNAME_FIELD)
+    counter = itertools.count()
+
+    def register_data():
+        n = next(counter)
+        return {
+            'username': 'benchmark%d' % n,
+            'email': 'benchmark%d@example.com' % n,
+            'date_of_birth': '1976-11-08',
+            'password1': 'benchmark',
+            'password2': 'benchmark',
+        }
+
+    cases = (
+        ('login, wrong password', 'login', lambda: {'username': username, 'password': 'wrong'}),
+        ('login', 'login', lambda: {'username': username, 'password': 'benchmark'}),
+        ('forgot password', 'forgot_password', lambda: {'email': user.email}),
+        ('register', 'register', register_data),
+    )
+
+    client = Client()
+    measurements = []
+    for label, url_name, get_data in cases:
+        for mode, url, follow in (('html', reverse(url_name), True), ('json', reverse('api_' + url_name), False)):
+            def request():
+                client.post(url, get_data(), follow=follow)
+                client.cookies.clear()
+                mail.outbox = []
+            measurements.append(measure('%s: %s' % (label, mode), request, options.iterations))
+    report(measurements)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compare `EmailOrUsernameBackend` with the common alternative of chaining a username backend and an email backend.
+
+    python -m benchmarks.auth_backends [--settings=...] [--iterations=...]
+"""
+from benchmarks import get_option_parser, measure, report, setup
+
+
+class EmailBackend(object):
+    """
+    What sites typically add after `ModelBackend` to also accept email addresses.
+    """
+
+    def authenticate(self, username=None, password=None, **kwargs):
+        from django.contrib.auth import get_user_model
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.get(email__iexact=username)
+        except (UserModel.DoesNotExist, UserModel.MultipleObjectsReturned):
+            return None
+        if user.check_password(password):
+            return user
+
+    def get_user(self, user_id):
+        from django.contrib.auth import get_user_model
+        UserModel = get_user_model()
+        try:
+            return UserModel._default_manager.get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+
+
+def main():
+    options, args = get_option_parser().parse_args()
+    setup(options.settings)
+
+    from django.contrib.auth import authenticate, get_user_model
+    from django.test.utils import override_settings
+
+    UserModel = get_user_model()
+    user = UserModel._default_manager.all()[0]
+    user.set_password('benchmark')
+    user.save()
+    username = getattr(user, UserModel.USERNAME_FIELD)
+
+    chained = ['django.contrib.auth.backends.ModelBackend', 'benchmarks.auth_backends.EmailBackend']
+    combined = ['sky_visitor.backends.EmailOrUsernameBackend']
+
+    measurements = []
+    for label, backends in (('chained', chained), ('email-or-username', combined)):
+        with override_settings(AUTHENTICATION_BACKENDS=backends):
+            for case, identifier, password in (('username', username, 'benchmark'),
+                                               ('email', user.email, 'benchmark'),
+                                               ('wrong password', user.email, 'wrong'),
+                                               ('unknown', 'nobody@example.com', 'benchmark')):
+                measurements.append(measure('%s: %s' % (label, case),
+                                            lambda: authenticate(username=identifier, password=password),
+                                            options.iterations))
+    report(measurements)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Messages rendered and sent per second for token emails, with and without `SKY_VISITOR_COMPILED_EMAILS`. Mail goes to
+Django's in-memory backend.
+
+    python -m benchmarks.email_rendering [--settings=...] [--iterations=...]
+"""
+from benchmarks import get_option_parser, measure, report, setup
+
+
+def main():
+    options, args = get_option_parser().parse_args()
+    setup(options.settings)
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.tokens import default_token_generator
+    from django.core import mail
+    from django.test.client import RequestFactory
+    from django.test.utils import override_settings
+    from sky_visitor.emails import TokenEmailSender
+    from sky_visitor.rendering import email_renderer
+
+    user = get_user_model()._default_manager.all()[0]
+    request = RequestFactory().get('/')
+    token = default_token_generator.make_token(user)
+
+    measurements = []
+    for label, compiled in (('emailtemplates', False), ('compiled', True)):
+        with override_settings(SKY_VISITOR_COMPILED_EMAILS=compiled):
+            for case, sender in (('request', TokenEmailSender('visitor-forgot-password', 'reset_password', request)),
+                                 ('no request', TokenEmailSender('visitor-forgot-password', 'reset_password'))):
+                mail.outbox = []
+                measurements.append(measure('%s send: %s' % (label, case), lambda: sender.send_email(user), options.iterations))
+    measurements.append(measure('compiled render only', lambda: email_renderer.render(
+        'visitor-forgot-password', user, token, 'reset_password', request=request), options.iterations))
+    report(measurements)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+End-to-end load test of the registration, password reset and invitation flows.
+
+    python -m benchmarks.load [--settings=...] [--users=20] [--iterations=5]
+
+The example project is served by a threaded WSGI server and sends its mail over SMTP to an in-process sink that
+records when each message arrives. Each virtual user registers, logs in, asks for a password reset, follows the
+emailed link and sets a new password, then invites someone and completes that invitation. Latencies are reported from
+form submission to mail delivery and to the emailed link having been used successfully.
+
+SQLite serializes writes, so use a PostgreSQL or MySQL settings module for realistic numbers.
+"""
+import asyncore
+import email
+import re
+import smtpd
+import sys
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from benchmarks import get_option_parser, setup
+
+try:
+    from socketserver import ThreadingMixIn
+    from http.cookiejar import CookieJar
+    from urllib.parse import urlencode, urlparse
+    from urllib.request import build_opener, HTTPCookieProcessor
+except ImportError:
+    from SocketServer import ThreadingMixIn
+    from cookielib import CookieJar
+    from urllib import urlencode
+    from urllib2 import build_opener, HTTPCookieProcessor
+    from urlparse import urlparse
+
+CSRF_RE = re.compile(r"name=['\"]csrfmiddlewaretoken['\"] value=['\"]([^'\"]+)['\"]")
+URL_RE = re.compile(r'https?://\S+')
+
+
+def get_text(message):
+    for part in message.walk():
+        if part.get_content_type() == 'text/plain':
+            return part.get_payload(decode=True).decode(part.get_content_charset() or 'utf-8')
+    raise AssertionError("Email has no text part")
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class SMTPSink(smtpd.SMTPServer):
+    """
+    Accepts every message and keeps it with its arrival time, so callers can wait for the email sent to an address.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        smtpd.SMTPServer.__init__(self, (host, port), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = {}
+        self.condition = threading.Condition()
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        received = time.time()
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        message = email.message_from_string(data)
+        with self.condition:
+            for recipient in rcpttos:
+                self.messages.setdefault(recipient.lower(), []).append((received, message))
+            self.condition.notify_all()
+
+    def wait_for(self, recipient, since, timeout=30):
+        """
+        Return `(received, message)` for the first email to `recipient` that arrived after `since`.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                for received, message in self.messages.get(recipient.lower(), []):
+                    if received >= since:
+                        return received, message
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise AssertionError("No email to %s within %ss" % (recipient, timeout))
+                self.condition.wait(remaining)
+
+    def serve_in_thread(self):
+        thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+        thread.daemon = True
+        thread.start()
+
+
+class Timings(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.errors = []
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.values.setdefault(name, []).append(seconds)
+
+    def error(self, flow, exception):
+        with self.lock:
+            self.errors.append((flow, exception))
+
+    def report(self, stream):
+        width = max([len(name) for name in self.values] + [4])
+        stream.write("%s  %6s  %8s  %8s  %8s\n" % ('step'.ljust(width), 'count', 'p50 ms', 'p95 ms', 'max ms'))
+        for name in sorted(self.values):
+            values = sorted(self.values[name])
+            percentile = lambda p: values[min(len(values) - 1, int(len(values) * p))] * 1000
+            stream.write("%s  %6d  %8.1f  %8.1f  %8.1f\n" % (name.ljust(width), len(values), percentile(0.5),
+                                                              percentile(0.95), values[-1] * 1000))
+        for flow, exception in self.errors:
+            stream.write("error in %s: %r\n" % (flow, exception))
+
+
+class VirtualUser(object):
+
+    def __init__(self, base_url, sink, timings, number):
+        self.base_url = base_url
+        self.sink = sink
+        self.timings = timings
+        self.number = number
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def request(self, path, data=None):
+        url = path if '://' in path else self.base_url + path
+        response = self.opener.open(url, None if data is None else urlencode(data).encode('utf-8'))
+        return urlparse(response.geturl()).path, response.read().decode('utf-8')
+
+    def submit(self, path, data):
+        """
+        Fetch the form at `path` for its CSRF token, then post `data` to it. Returns the path redirected to.
+        """
+        body = self.request(path)[1]
+        data = dict(data, csrfmiddlewaretoken=CSRF_RE.search(body).group(1))
+        return self.request(path, data)[0]
+
+    def expect(self, path, expected):
+        if path != expected:
+            raise AssertionError("Expected to land on %s, got %s" % (expected, path))
+
+    def timed(self, name, func, *args):
+        start = time.time()
+        result = func(*args)
+        self.timings.record(name, time.time() - start)
+        return result
+
+    def follow_emailed_link(self, name, address, submitted, data, expected_path):
+        received, message = self.sink.wait_for(address, submitted)
+        self.timings.record('%s: submit to delivery' % name, received - submitted)
+        link = URL_RE.search(get_text(message)).group(0)
+        self.expect(self.submit(link, data), expected_path)
+        self.timings.record('%s: submit to link used' % name, time.time() - submitted)
+
+    def get_user_data(self, prefix, password):
+        return {
+            'username': '%s%d' % (prefix, self.number),
+            'email': '%s%d@example.com' % (prefix, self.number),
+            'date_of_birth': '1980-01-01',
+            'password1': password,
+            'password2': password,
+        }
+
+    def password_reset_flow(self, iteration, username_field, home):
+        data = self.get_user_data('load%d-' % iteration, 'first-password')
+        self.expect(self.timed('register', self.submit, '/user/register/', data), home)
+        self.request('/user/logout/')
+        login = {'username': data[username_field], 'password': 'first-password'}
+        self.expect(self.timed('login', self.submit, '/user/login/', login), home)
+        self.request('/user/logout/')
+
+        submitted = time.time()
+        self.submit('/user/forgot_password/', {'email': data['email']})
+        self.follow_emailed_link('forgot password', data['email'], submitted,
+                                 {'new_password1': 'second-password', 'new_password2': 'second-password'}, home)
+        self.request('/user/logout/')
+
+    def invitation_flow(self, iteration, home):
+        data = self.get_user_data('invitee%d-' % iteration, 'invited-password')
+        submitted = time.time()
+        self.submit('/user/invitation/', {'email': data['email']})
+        self.follow_emailed_link('invitation', data['email'], submitted, data, home)
+        self.request('/user/logout/')
+
+    def run(self, iterations, username_field, home):
+        for iteration in range(iterations):
+            for name, flow, args in (('password reset', self.password_reset_flow, (iteration, username_field, home)),
+                                     ('invitation', self.invitation_flow, (iteration, home))):
+                try:
+                    flow(*args)
+                except Exception as e:
+                    self.timings.error(name, e)
+
+
+def main():
+    parser = get_option_parser()
+    parser.add_option('--users', dest='users', type='int', default=20, help="Concurrent virtual users.")
+    parser.set_defaults(iterations=5)
+    options, args = parser.parse_args()
+    setup(options.settings, shared_database=True)
+
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.core.handlers.wsgi import WSGIHandler
+
+    sink = SMTPSink()
+    sink.serve_in_thread()
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    settings.EMAIL_HOST = '127.0.0.1'
+    settings.EMAIL_PORT = sink.port
+    settings.ALLOWED_HOSTS = ['*']
+
+    server = make_server('127.0.0.1', 0, WSGIHandler(), server_class=ThreadingWSGIServer,
+                         handler_class=QuietWSGIRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base_url = 'http://127.0.0.1:%d' % server.server_port
+
+    timings = Timings()
+    virtual_users = [VirtualUser(base_url, sink, timings, i) for i in range(options.users)]
+    threads = [threading.Thread(target=u.run, args=(options.iterations, get_user_model().USERNAME_FIELD,
+                                                    settings.LOGIN_REDIRECT_URL)) for u in virtual_users]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    server.shutdown()
+    sys.stdout.write("%d virtual users x %d iterations in %.1fs\n" % (options.users, options.iterations, elapsed))
+    timings.report(sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
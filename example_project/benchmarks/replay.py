@@ -0,0 +1,244 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Replay traffic recorded by `sky_visitor.middleware.TrafficRecorderMiddleware` against a fresh test database, to compare
+two builds on a realistic mix of requests.
+
+    python -m benchmarks.replay traffic.log --save=before.json      # on the old build
+    python -m benchmarks.replay traffic.log --compare=before.json   # on the new build
+
+Each recorded request is rebuilt with the same URL, method and fields. Values are chosen to get the same outcome: a
+failed login gets a wrong password, a stale reset link gets an invalid token, a duplicate invitation reuses an
+invited email. Requests are sent in order through Django's test client. Latency and queries are reported per route,
+along with how many replayed requests didn't get the recorded outcome.
+"""
+import itertools
+import json
+import sys
+
+from benchmarks import get_option_parser, measure, setup
+
+TOKEN_ROUTES = frozenset(['reset_password', 'magic_link_login', 'invitation_complete'])
+INVALID_TOKEN = {'uidb36': '0', 'token': '0-0'}
+
+
+def read_records(f):
+    """
+    Yield the recorded requests in a log file. Anything before the JSON on each line (timestamps, for example) is ignored.
+    """
+    for line in f:
+        start = line.find('{')
+        if start != -1:
+            yield json.loads(line[start:])
+
+
+def get_base_route(route):
+    return route[len('api_'):] if route.startswith('api_') else route
+
+
+def is_success(route, method, status):
+    if route.startswith('api_') or method != 'POST':
+        return status < 400
+    # HTML forms redirect on success and show the form again on errors
+    return status in (301, 302)
+
+
+class TrafficGenerator(object):
+    password = 'quartz-lamp-7941'
+
+    def __init__(self):
+        from django.contrib.auth import get_user_model
+        from django.test.client import Client
+        from sky_visitor.models import InvitedUser
+
+        self.UserModel = get_user_model()
+        self.counter = itertools.count()
+        self.client = Client()
+        self.user = self.create_user()
+        self.invited_email = 'replay-invited@example.com'
+        InvitedUser.objects.create(email=self.invited_email)
+
+    def get_user_data(self, prefix='replay'):
+        n = next(self.counter)
+        return {
+            'username': '%s%d' % (prefix, n),
+            'email': '%s%d@example.com' % (prefix, n),
+            'date_of_birth': '1980-01-01',
+        }
+
+    def create_user(self):
+        data = self.get_user_data()
+        field_names = [self.UserModel.USERNAME_FIELD] + list(self.UserModel.REQUIRED_FIELDS)
+        user = self.UserModel(**dict((name, data[name]) for name in field_names))
+        user.set_password(self.password)
+        user.save()
+        return user
+
+    def get_values(self, base_route, success):
+        """
+        Values for the fields of a request to `base_route` that make it succeed or fail.
+        """
+        password = self.password
+        if base_route == 'login':
+            return {'username': getattr(self.user, self.UserModel.USERNAME_FIELD),
+                    'password': password if success else 'wrong-password'}
+        if base_route in ('register', 'invitation_complete'):
+            data = self.get_user_data('replay-new')
+            data.update({'password1': password, 'password2': password if success else 'mismatch'})
+            return data
+        if base_route in ('forgot_password', 'magic_link_start'):
+            return {'email': self.user.email if success else 'not-an-email'}
+        if base_route == 'reset_password':
+            return {'new_password1': password, 'new_password2': password if success else 'mismatch'}
+        if base_route == 'change_password':
+            return {'old_password': password if success else 'wrong-password', 'new_password1': password,
+                    'new_password2': password}
+        if base_route == 'invitation_start':
+            return {'email': self.get_user_data('replay-invite')['email'] if success else self.invited_email}
+        if base_route == 'availability':
+            return {'username': 'replay-available', 'email': 'replay-available@example.com'}
+        return {}
+
+    def get_token_kwargs(self, base_route, token_valid, values):
+        from django.contrib.auth.tokens import default_token_generator
+        from django.utils.http import int_to_base36
+        from sky_visitor.models import InvitedUser
+        from sky_visitor.tokens import magic_link_token_generator
+
+        if not token_valid:
+            return dict(INVALID_TOKEN)
+        if base_route == 'invitation_complete':
+            user = InvitedUser.objects.create(email=values.get('email') or self.get_user_data('replay-new')['email'])
+            token_generator = default_token_generator
+        elif base_route == 'magic_link_login':
+            user = self.user = self.UserModel._default_manager.get(pk=self.user.pk)  # Fresh last_login
+            token_generator = magic_link_token_generator
+        else:
+            user = self.user = self.UserModel._default_manager.get(pk=self.user.pk)  # Fresh password hash
+            token_generator = default_token_generator
+        return {'uidb36': int_to_base36(user.pk), 'token': token_generator.make_token(user)}
+
+    def prepare(self, record):
+        """
+        Put the client in the recorded state and return `(path, data)` for the request.
+        """
+        from django.core.urlresolvers import reverse
+
+        route = record['route']
+        base_route = get_base_route(route)
+        success = is_success(route, record['method'], record['status'])
+        values = self.get_values(base_route, success)
+        fields = record['post'] if record['method'] == 'POST' else record['get']
+        data = dict((name, values.get(name, 'x')) for name in fields)
+
+        kwargs = None
+        if base_route in TOKEN_ROUTES:
+            kwargs = self.get_token_kwargs(base_route, record.get('token_valid'), data)
+        if record.get('authenticated'):
+            self.client.login(username=getattr(self.user, self.UserModel.USERNAME_FIELD), password=self.password)
+        else:
+            self.client.logout()
+        return reverse(route, kwargs=kwargs), data
+
+    def replay(self, record, results):
+        path, data = self.prepare(record)
+        method = getattr(self.client, record['method'].lower())
+        responses = []
+        measurement = measure(record['route'], lambda: responses.append(method(path, data)), 1)
+        results.add(record, measurement, responses[0].status_code)
+
+
+class ReplayResults(object):
+
+    def __init__(self):
+        self.routes = {}
+
+    def add(self, record, measurement, status):
+        key = '%s %s' % (record['method'], record['route'])
+        route = self.routes.setdefault(key, {'ms': [], 'queries': 0, 'mismatched': 0})
+        route['ms'].append(measurement.ms_per_call)
+        route['queries'] += measurement.queries
+        expected = is_success(record['route'], record['method'], record['status'])
+        if is_success(record['route'], record['method'], status) != expected:
+            route['mismatched'] += 1
+
+    def summary(self):
+        summary = {}
+        for key, route in self.routes.items():
+            ms = sorted(route['ms'])
+            summary[key] = {
+                'requests': len(ms),
+                'ms_mean': sum(ms) / len(ms),
+                'ms_p95': ms[min(len(ms) - 1, int(len(ms) * 0.95))],
+                'queries': float(route['queries']) / len(ms),
+                'mismatched': route['mismatched'],
+            }
+        return summary
+
+
+def report(summary, stream=sys.stdout):
+    width = max([len('route')] + [len(key) for key in summary])
+    stream.write("%s  %8s  %9s  %9s  %8s  %10s\n" % ('route'.ljust(width), 'requests', 'ms mean', 'ms p95', 'queries', 'mismatched'))
+    for key in sorted(summary):
+        s = summary[key]
+        stream.write("%s  %8d  %9.2f  %9.2f  %8.1f  %10d\n" % (key.ljust(width), s['requests'], s['ms_mean'], s['ms_p95'],
+                                                              s['queries'], s['mismatched']))
+
+
+def report_comparison(before, after, stream=sys.stdout):
+    width = max([len('route')] + [len(key) for key in after])
+    stream.write("%s  %9s  %9s  %8s  %9s  %9s\n" % ('route'.ljust(width), 'ms before', 'ms after', 'change', 'q before', 'q after'))
+    for key in sorted(set(before) | set(after)):
+        if key not in before or key not in after:
+            stream.write("%s  only %s\n" % (key.ljust(width), 'before' if key in before else 'after'))
+            continue
+        b, a = before[key], after[key]
+        change = (a['ms_mean'] - b['ms_mean']) * 100.0 / b['ms_mean'] if b['ms_mean'] else 0.0
+        stream.write("%s  %9.2f  %9.2f  %+7.1f%%  %9.1f  %9.1f\n" % (key.ljust(width), b['ms_mean'], a['ms_mean'], change,
+                                                                    b['queries'], a['queries']))
+
+
+def main():
+    parser = get_option_parser(usage="%prog <traffic_log> [options]")
+    parser.add_option('--save', dest='save', default=None, help="Write the results to this JSON file.")
+    parser.add_option('--compare', dest='compare', default=None, help="Compare with results saved by --save.")
+    parser.set_defaults(iterations=1)
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Give the path of a traffic log.")
+    with open(args[0]) as f:
+        records = list(read_records(f))
+    setup(options.settings)
+
+    from django.core import mail
+    generator = TrafficGenerator()
+    results = ReplayResults()
+    for i in range(options.iterations):
+        for record in records:
+            generator.replay(record, results)
+            mail.outbox = []
+    summary = results.summary()
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as f:
+            report_comparison(json.load(f), summary)
+    else:
+        report(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -38,11 +38,28 @@ INSTALLED_APPS = [
 TESTS_TO_RUN = [
     'sky_visitor',
     'customuser_tests.RegisterViewTest',
+    'customuser_tests.AvailabilityViewTest',
     'customuser_tests.LoginViewTest',
+    'customuser_tests.DeferredRehashTest',
+    'customuser_tests.EmailOrUsernameBackendTest',
     'customuser_tests.LogoutViewTest',
     'customuser_tests.ForgotPasswordProcessTest',
+    'customuser_tests.CompiledEmailTest',
+    'customuser_tests.MagicLinkLoginTest',
+    'customuser_tests.EmailCoalescingTest',
+    'customuser_tests.EmailDeliveryPoolTest',
     'customuser_tests.ChangePasswordViewTest',
+    'customuser_tests.SignedSessionTest',
     'customuser_tests.InvitationProcessTest',
+    'customuser_tests.InvitationLinkTest',
+    'customuser_tests.InvitationLinkTransactionTest',
+    'customuser_tests.APIViewsTest',
+    'customuser_tests.InvitationCampaignTest',
+    'customuser_tests.LoadTestDataTest',
+    'customuser_tests.ProvisioningTest',
+    'customuser_tests.InvitationExportTest',
+    'customuser_tests.ForcedPasswordResetTest',
+    'customuser_tests.IndexAdvisorTest',
 ]
 
 DATABASES = {
@@ -52,10 +52,22 @@ class RegisterViewTest(RegisterUserMixin, normaltests.RegisterViewTest):
         self.assertEqual(UserModel._default_manager.filter(**{UserModel.USERNAME_FIELD: testuser_email}).count(), 1)
 
 
+class AvailabilityViewTest(normaltests.AvailabilityViewTest):
+    pass
+
+
 class LoginViewTest(normaltests.LoginViewTest):
     pass
 
 
+class DeferredRehashTest(normaltests.DeferredRehashTest):
+    pass
+
+
+class EmailOrUsernameBackendTest(normaltests.EmailOrUsernameBackendTest):
+    pass
+
+
 class LogoutViewTest(normaltests.LogoutViewTest):
     pass
 
@@ -64,9 +76,65 @@ class ForgotPasswordProcessTest(normaltests.ForgotPasswordProcessTest):
     pass
 
 
+class CompiledEmailTest(normaltests.CompiledEmailTest):
+    pass
+
+
+class MagicLinkLoginTest(normaltests.MagicLinkLoginTest):
+    pass
+
+
+class EmailCoalescingTest(normaltests.EmailCoalescingTest):
+    pass
+
+
+class EmailDeliveryPoolTest(normaltests.EmailDeliveryPoolTest):
+    pass
+
+
+class SignedSessionTest(normaltests.SignedSessionTest):
+    pass
+
+
 class ChangePasswordViewTest(normaltests.ChangePasswordViewTest):
     pass
 
 
 class InvitationProcessTest(RegisterUserMixin, normaltests.InvitationProcessTest):
-    pass
\ No newline at end of file
+    pass
+
+
+class InvitationLinkTest(RegisterUserMixin, normaltests.InvitationLinkTest):
+    pass
+
+
+class InvitationLinkTransactionTest(RegisterUserMixin, normaltests.InvitationLinkTransactionTest):
+    pass
+
+
+class APIViewsTest(RegisterUserMixin, normaltests.APIViewsTest):
+    pass
+
+
+class InvitationCampaignTest(normaltests.InvitationCampaignTest):
+    pass
+
+
+class LoadTestDataTest(normaltests.LoadTestDataTest):
+    pass
+
+
+class ProvisioningTest(normaltests.ProvisioningTest):
+    pass
+
+
+class InvitationExportTest(normaltests.InvitationExportTest):
+    pass
+
+
+class ForcedPasswordResetTest(normaltests.ForcedPasswordResetTest):
+    pass
+
+
+class IndexAdvisorTest(normaltests.IndexAdvisorTest):
+    pass
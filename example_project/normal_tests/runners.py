@@ -1,10 +1,157 @@
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.db import connections
 from django.test.simple import DjangoTestSuiteRunner
+from django.test.utils import override_settings
+from django.utils import unittest
+
+
+class FastPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's default hasher with a single iteration. Because the algorithm name is the same, the fixture users' hashes
+    still verify (with their own iteration count) and aren't re-hashed and saved on every login.
+    """
+    iterations = 1
+
+    def must_update(self, encoded):
+        return False
+
+
+FAST_PASSWORD_HASHERS = (
+    'normal_tests.runners.FastPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+    'django.contrib.auth.hashers.SHA1PasswordHasher',
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+    'django.contrib.auth.hashers.UnsaltedMD5PasswordHasher',
+    'django.contrib.auth.hashers.CryptPasswordHasher',
+)
 
 
 class DefaultTestRunner(DjangoTestSuiteRunner):
+    """
+    Runs `settings.TESTS_TO_RUN` when no labels are given. New passwords are hashed with single-iteration PBKDF2 during
+    tests, which is much faster than the default; hashes made with the other hashers still verify.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(DefaultTestRunner, self).setup_test_environment(**kwargs)
+        self.hashers_override = override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
+        self.hashers_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.hashers_override.disable()
+        super(DefaultTestRunner, self).teardown_test_environment(**kwargs)
 
     def run_tests(self, test_labels, extra_tests=None, **kwargs):
         if not test_labels:
             test_labels = settings.TESTS_TO_RUN
         return super(DefaultTestRunner, self).run_tests(test_labels, extra_tests, **kwargs)
+
+
+def _flatten(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for t in _flatten(test):
+                yield t
+        else:
+            yield test
+
+
+def partition_suite(suite, processes):
+    """
+    Split `suite` into at most `processes` suites of about the same number of tests. Tests of the same TestCase class
+    stay together and in their original order.
+    """
+    classes = []
+    by_class = {}
+    for test in _flatten(suite):
+        if test.__class__ not in by_class:
+            by_class[test.__class__] = []
+            classes.append(test.__class__)
+        by_class[test.__class__].append(test)
+    buckets = [[] for i in range(min(processes, len(classes)))]
+    for cls in sorted(classes, key=lambda cls: -len(by_class[cls])):
+        min(buckets, key=lambda bucket: sum(len(tests) for tests in bucket)).append(by_class[cls])
+    # Keep the original class order within each bucket
+    return [unittest.TestSuite(t for tests in sorted(bucket, key=lambda tests: classes.index(tests[0].__class__)) for t in tests)
+            for bucket in buckets if bucket]
+
+
+# Set by ParallelTestRunner before forking, so the workers inherit the suites instead of unpickling them
+_worker_suites = []
+
+
+def _run_worker(args):
+    index, verbosity, failfast = args
+    for connection in connections.all():
+        settings_dict = connection.settings_dict
+        # SQLite test databases default to in-memory, which is already private to the process
+        if connection.vendor != 'sqlite' or settings_dict.get('TEST_NAME'):
+            base = settings_dict.get('TEST_NAME') or 'test_' + settings_dict['NAME']
+            settings_dict['TEST_NAME'] = '%s_%d' % (base, index)
+    runner = DjangoTestSuiteRunner(verbosity=0, interactive=False, failfast=failfast)
+    old_config = runner.setup_databases()
+    stream = StringIO()
+    start = time.time()
+    try:
+        result = unittest.TextTestRunner(stream=stream, verbosity=verbosity, failfast=failfast).run(_worker_suites[index])
+    finally:
+        runner.teardown_databases(old_config)
+    return result.testsRun, len(result.failures) + len(result.errors), time.time() - start, stream.getvalue()
+
+
+class ParallelTestRunner(DefaultTestRunner):
+    """
+    Splits the tests across worker processes, each with its own test database. The number of processes is
+    `$SKY_VISITOR_TEST_PROCESSES`, `settings.TEST_PROCESSES` or the number of CPUs; with 1 the tests run serially.
+    """
+
+    def get_processes(self):
+        processes = os.environ.get('SKY_VISITOR_TEST_PROCESSES') or getattr(settings, 'TEST_PROCESSES', None)
+        return int(processes) if processes else multiprocessing.cpu_count()
+
+    def run_tests(self, test_labels, extra_tests=None, **kwargs):
+        if not test_labels:
+            test_labels = settings.TESTS_TO_RUN
+        processes = self.get_processes()
+        if processes <= 1:
+            return super(ParallelTestRunner, self).run_tests(test_labels, extra_tests, **kwargs)
+
+        global _worker_suites
+        self.setup_test_environment()
+        _worker_suites = partition_suite(self.build_suite(test_labels, extra_tests), processes)
+        # Forked workers must not share the parent's database sockets
+        for connection in connections.all():
+            connection.close()
+
+        start = time.time()
+        pool = multiprocessing.Pool(len(_worker_suites))
+        try:
+            results = pool.map(_run_worker, [(i, self.verbosity, self.failfast) for i in range(len(_worker_suites))])
+        finally:
+            pool.close()
+            pool.join()
+        self.teardown_test_environment()
+
+        tests = failed = 0
+        for index, (tests_run, failures, seconds, output) in enumerate(results):
+            tests += tests_run
+            failed += failures
+            if failures or self.verbosity > 1:
+                sys.stderr.write(output)
+            if self.verbosity > 0:
+                sys.stderr.write("worker %d: %d tests in %.2fs\n" % (index, tests_run, seconds))
+        sys.stderr.write("Ran %d tests in %d processes in %.2fs: %s\n" % (
+            tests, len(results), time.time() - start, 'FAILED' if failed else 'OK'))
+        return failed
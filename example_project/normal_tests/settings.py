@@ -42,11 +42,35 @@ INSTALLED_APPS = [
 TESTS_TO_RUN = [
     'sky_visitor',
     'normal_tests.RegisterViewTest',
+    'normal_tests.AvailabilityViewTest',
     'normal_tests.LoginViewTest',
+    'normal_tests.DeferredRehashTest',
+    'normal_tests.EmailOrUsernameBackendTest',
     'normal_tests.LogoutViewTest',
     'normal_tests.ForgotPasswordProcessTest',
+    'normal_tests.CompiledEmailTest',
+    'normal_tests.MagicLinkLoginTest',
+    'normal_tests.EmailCoalescingTest',
+    'normal_tests.EmailDeliveryPoolTest',
     'normal_tests.ChangePasswordViewTest',
+    'normal_tests.SignedSessionTest',
     'normal_tests.InvitationProcessTest',
+    'normal_tests.InvitationLinkTest',
+    'normal_tests.InvitationLinkTransactionTest',
+    'normal_tests.APIViewsTest',
+    'normal_tests.InvitationCampaignTest',
+    'normal_tests.LoadTestDataTest',
+    'normal_tests.HashingPoolTest',
+    'normal_tests.ProvisioningTest',
+    'normal_tests.InvitationExportTest',
+    'normal_tests.ForcedPasswordResetTest',
+    'normal_tests.IndexAdvisorTest',
+    'normal_tests.BreachedPasswordIndexTest',
+    'normal_tests.PasswordRulePipelineTest',
+    'normal_tests.InvitedUserAdminTest',
+    'normal_tests.SiteCacheTest',
+    'normal_tests.TrafficRecorderTest',
+    'normal_tests.ReplicaRoutingTest',
 ]
 
 DATABASES = {
@@ -66,7 +90,7 @@ import os.path
 PROJECT_DIR = os.path.dirname(os.path.dirname(__file__))
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
-TEST_RUNNER = 'normal_tests.runners.DefaultTestRunner'
+TEST_RUNNER = 'normal_tests.runners.ParallelTestRunner'
 
 ADMINS = (
     # ('Your Name', 'your_email@example.com'),
@@ -11,17 +11,65 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import csv
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+import zlib
 from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth import get_user_model, SESSION_KEY
 from django.contrib.auth.forms import SetPasswordForm
 from django.contrib.auth.tokens import default_token_generator
+from django.contrib.sessions.models import Session
+from django.contrib.sites.models import Site
 from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.mail.backends import locmem
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+from django.test import TransactionTestCase
+from django.test.client import Client, RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
 from django.utils.http import int_to_base36
+from django.utils.six import StringIO
 from django.utils.text import capfirst
-from sky_visitor.models import InvitedUser
-from sky_visitor.forms import InvitationCompleteForm
+from sky_visitor import admin as sky_visitor_admin  # Registers InvitedUserAdmin
+from sky_visitor import db as sky_visitor_db
+from sky_visitor import signed_sessions
+from sky_visitor.campaigns import CampaignScheduler, create_campaign, RateLimiter
+from sky_visitor.backends import DeferredRehashBackend, EmailOrUsernameBackend
+from sky_visitor.coalescing import claim_email_send, get_email_counters
+from sky_visitor.delivery import EmailDeliveryPool, get_delivery_metrics, get_delivery_pool
+from sky_visitor.emails import TokenEmailSender
+from sky_visitor.export import export_invitations
+from sky_visitor.availability import AvailabilityIndex, availability_index
+from sky_visitor.middleware import ReplicaPinningMiddleware
+from sky_visitor.models import InvitedUser, CampaignInvitation, InvitationCounter, InvitationLink
+from sky_visitor.provisioning import provision_users
+from sky_visitor.rendering import email_renderer
+from sky_visitor.sites import site_cache
+from sky_visitor.stats import get_invitation_stats, get_daily_invitation_stats, reconcile_invitation_stats, record_expired
+from sky_visitor.rehash import run_pending_rehashes
+from sky_visitor.tokens import magic_link_token_generator
+from sky_visitor.utils import get_hashing_pool, hash_passwords
+from sky_visitor.forms import InvitationCompleteForm, InvitationStartForm, MagicLinkForm, PasswordResetForm, RegisterForm
+from sky_visitor.forms.fields import PasswordRulesField
+from sky_visitor.validators import BreachedPasswordIndex, build_breached_password_index, PasswordRule, PasswordRulePipeline, CharacterClassesRule, UserAttributeSimilarityRule
 from sky_visitor.tests import SkyVisitorTestCase
+from sky_visitor.views import InvitationLinkView, InvitationStartView
 
 
 FIXTURE_USER_DATA = {
@@ -91,6 +139,53 @@ class RegisterViewTest(RegisterUserMixin, SkyVisitorViewsTestCase):
         self.assertIn('password2', form.errors)
 
 
+class AvailabilityViewTest(SkyVisitorViewsTestCase):
+    view_url = '/user/availability/'
+
+    def setUp(self):
+        availability_index.rebuild()
+
+    def get_availability(self, **params):
+        response = self.client.get(self.view_url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_taken_values_should_be_unavailable(self):
+        UserModel = get_user_model()
+        data = self.get_availability(username=FIXTURE_USER_DATA[UserModel.USERNAME_FIELD], email=FIXTURE_USER_DATA['email'].upper())
+        self.assertFalse(data['username']['available'])
+        self.assertFalse(data['email']['available'])
+
+    def test_free_values_should_be_answered_without_queries(self):
+        with self.assertNumQueries(0):
+            data = self.get_availability(username='nobody-has-this-name@example.com', email='nobody@example.com')
+        self.assertTrue(data['username']['available'])
+        self.assertTrue(data['email']['available'])
+
+    def test_new_users_should_become_unavailable(self):
+        UserModel = get_user_model()
+        user = UserModel._default_manager.get(email=FIXTURE_USER_DATA['email'])
+        user.pk = None
+        setattr(user, UserModel.USERNAME_FIELD, 'newuser@example.com')
+        user.email = 'newuser@example.com'
+        user.save()
+        data = self.get_availability(username='newuser@example.com', email='newuser@example.com')
+        self.assertFalse(data['username']['available'])
+        self.assertFalse(data['email']['available'])
+
+    def test_missing_parameters_should_fail(self):
+        response = self.client.get(self.view_url)
+        self.assertEqual(response.status_code, 400)
+
+    def test_should_query_until_first_build_finishes(self):
+        index = AvailabilityIndex()
+        index._started_at = time.time()  # As if a rebuild were running on another thread
+        with self.assertNumQueries(2):
+            self.assertFalse(index.is_email_available(FIXTURE_USER_DATA['email']))
+            self.assertTrue(index.is_email_available('nobody@example.com'))
+        self.assertEqual(index.get_filter(), None)
+
+
 class LoginViewTest(SkyVisitorViewsTestCase):
     view_url = '/user/login/'
 
@@ -122,6 +217,68 @@ class LoginViewTest(SkyVisitorViewsTestCase):
         self.assertEqual(form.fields['username'].label, capfirst(username_field.verbose_name))
 
 
+@override_settings(PASSWORD_HASHERS=('django.contrib.auth.hashers.SHA1PasswordHasher', 'django.contrib.auth.hashers.PBKDF2PasswordHasher'))
+class DeferredRehashTest(SkyVisitorViewsTestCase):
+
+    def get_stored_password(self):
+        UserModel = get_user_model()
+        return UserModel._default_manager.filter(pk=self.default_user.pk).values_list('password', flat=True)[0]
+
+    def test_rehash_should_wait_until_request_finishes(self):
+        UserModel = get_user_model()
+        user = DeferredRehashBackend().authenticate(FIXTURE_USER_DATA[UserModel.USERNAME_FIELD], FIXTURE_USER_DATA['password'])
+        self.assertEqual(user.pk, self.default_user.pk)
+        self.assertTrue(self.get_stored_password().startswith('pbkdf2_sha256$'))
+        run_pending_rehashes()
+        self.assertTrue(self.get_stored_password().startswith('sha1$'))
+        self.assertTrue(UserModel._default_manager.get(pk=user.pk).check_password(FIXTURE_USER_DATA['password']))
+
+    def test_rehash_should_not_overwrite_changed_password(self):
+        UserModel = get_user_model()
+        DeferredRehashBackend().authenticate(FIXTURE_USER_DATA[UserModel.USERNAME_FIELD], FIXTURE_USER_DATA['password'])
+        user = UserModel._default_manager.get(pk=self.default_user.pk)
+        user.set_password('changed-in-between')
+        user.save()
+        run_pending_rehashes()
+        self.assertTrue(UserModel._default_manager.get(pk=user.pk).check_password('changed-in-between'))
+
+    def test_login_should_rehash_after_response(self):
+        with self.settings(AUTHENTICATION_BACKENDS=['sky_visitor.backends.DeferredRehashBackend']):
+            self.login()
+        self.assertTrue(self.get_stored_password().startswith('sha1$'))
+
+
+class EmailOrUsernameBackendTest(SkyVisitorViewsTestCase):
+
+    def authenticate(self, identifier, password=FIXTURE_USER_DATA['password']):
+        with self.assertNumQueries(1):
+            return EmailOrUsernameBackend().authenticate(identifier, password)
+
+    def test_authenticate_with_username(self):
+        UserModel = get_user_model()
+        user = self.authenticate(FIXTURE_USER_DATA[UserModel.USERNAME_FIELD])
+        self.assertEqual(user.pk, self.default_user.pk)
+
+    def test_authenticate_with_email(self):
+        user = self.authenticate(FIXTURE_USER_DATA['email'].upper())
+        self.assertEqual(user.pk, self.default_user.pk)
+
+    def test_wrong_password(self):
+        self.assertEqual(self.authenticate(FIXTURE_USER_DATA['email'], 'wrong-password'), None)
+
+    def test_unknown_identifier(self):
+        self.assertEqual(self.authenticate('nobody@example.com'), None)
+
+    def test_login_view(self):
+        with self.settings(AUTHENTICATION_BACKENDS=['sky_visitor.backends.EmailOrUsernameBackend']):
+            response = self.client.post('/user/login/', {
+                'username': FIXTURE_USER_DATA['email'],
+                'password': FIXTURE_USER_DATA['password'],
+            })
+        self.assertRedirected(response, settings.LOGIN_REDIRECT_URL)
+        self.assertTrue(SESSION_KEY in self.client.session)
+
+
 class LogoutViewTest(SkyVisitorViewsTestCase):
 
     def confirm_logged_out(self):
@@ -210,11 +367,301 @@ class ForgotPasswordProcessTest(SkyVisitorViewsTestCase):
         response = self.client.get(self._get_password_reset_url())
         self.assertEqual(response.status_code, 200)
         # User ID of this token is modified
-        response = self.client.get('/user/forgot_password/2-35t-d4e092280eb134000672/', follow=True)
+        response = self.client.get('/user/reset_password/2-35t-d4e092280eb134000672/', follow=True)
         self.assertRedirects(response, '/user/login/')
         # Token modified
-        response = self.client.get('/user/forgot_password/1-35t-d4e092280eb134000671/', follow=True)
+        response = self.client.get('/user/reset_password/1-35t-d4e092280eb134000671/', follow=True)
+        self.assertRedirects(response, '/user/login/')
+
+
+class MagicLinkLoginTest(SkyVisitorViewsTestCase):
+
+    def _get_magic_link_url(self, user=None):
+        if user is None:
+            user = self.default_user
+        return reverse('magic_link_login', kwargs={'uidb36': int_to_base36(user.id), 'token': magic_link_token_generator.make_token(user)})
+
+    def test_start_view_should_exist(self):
+        response = self.client.get(reverse('magic_link_start'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('email', response.context_data['form'].fields)
+
+    def test_get_should_only_confirm(self):
+        url = self._get_magic_link_url()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(SESSION_KEY not in self.client.session)
+        # A prefetched link still works when the user submits it
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_link_should_log_in_once(self):
+        url = self._get_magic_link_url()
+        response = self.client.post(url)
+        self.assertRedirected(response, '/')
+        self.assertLoggedIn(self.default_user, backend='sky_visitor.backends.BaseBackend')
+
+        # Logging in updated last_login, so the same link shouldn't work again
+        self.client.logout()
+        response = self.client.post(url, follow=True)
+        self.assertRedirects(response, '/user/login/')
+        self.assertTrue(SESSION_KEY not in self.client.session)
+
+    def test_link_should_respect_next(self):
+        response = self.client.post(self._get_magic_link_url() + '?next=/user/change_password/')
+        self.assertRedirected(response, '/user/change_password/')
+
+    def test_expired_link_should_fail(self):
+        url = self._get_magic_link_url()
+        with self.settings(SKY_VISITOR_MAGIC_LINK_TIMEOUT=-1):
+            response = self.client.get(url, follow=True)
         self.assertRedirects(response, '/user/login/')
+        self.assertTrue(SESSION_KEY not in self.client.session)
+
+    def test_password_reset_token_should_not_work(self):
+        url = reverse('magic_link_login', kwargs={'uidb36': int_to_base36(self.default_user.id), 'token': default_token_generator.make_token(self.default_user)})
+        response = self.client.get(url, follow=True)
+        self.assertRedirects(response, '/user/login/')
+
+
+class FailingEmailBackend(locmem.EmailBackend):
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+
+@override_settings(SKY_VISITOR_EMAIL_COALESCE_SECONDS=60)
+class EmailCoalescingTest(SkyVisitorViewsTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeated_forgot_password_should_send_one_email(self):
+        data = {'email': FIXTURE_USER_DATA['email']}
+        for i in range(3):
+            response = self.client.post('/user/forgot_password/', data)
+            # Every submit still gets the same redirect
+            self.assertRedirected(response, '/user/forgot_password/check_email/')
+        self.assertEqual(len(mail.outbox), 1)
+        counters = get_email_counters(['visitor-forgot-password'])['visitor-forgot-password']
+        self.assertEqual(counters, {'sent': 1, 'suppressed': 2})
+
+    def test_window_should_be_per_recipient(self):
+        self.client.post('/user/forgot_password/', {'email': FIXTURE_USER_DATA['email']})
+        self.client.post('/user/forgot_password/', {'email': 'admin@example.com'})
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_window_should_be_per_account(self):
+        UserModel = get_user_model()
+        if UserModel._meta.get_field('email').unique:
+            return  # Addresses can't be shared
+        user = UserModel._default_manager.get(email=FIXTURE_USER_DATA['email'])
+        user.pk = None
+        setattr(user, UserModel.USERNAME_FIELD, 'sharedaddress')
+        user.save()
+        self.client.post('/user/forgot_password/', {'email': FIXTURE_USER_DATA['email']})
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(get_email_counters(['visitor-forgot-password'])['visitor-forgot-password']['suppressed'], 0)
+
+    def test_failed_send_should_not_count(self):
+        data = {'email': FIXTURE_USER_DATA['email']}
+        with override_settings(EMAIL_BACKEND='normal_tests.tests.FailingEmailBackend'):
+            self.assertRaises(smtplib.SMTPServerDisconnected, self.client.post, '/user/forgot_password/', data)
+        self.client.post('/user/forgot_password/', data)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(SKY_VISITOR_COMPILED_EMAILS=True)
+class CompiledEmailTest(ForgotPasswordProcessTest):
+    # Runs the forgot password tests again with compiled emails
+
+    def test_second_render_should_not_query(self):
+        token = default_token_generator.make_token(self.default_user)
+        email_renderer.render('visitor-forgot-password', self.default_user, token, 'reset_password')
+        with self.assertNumQueries(0):
+            subject, body = email_renderer.render('visitor-forgot-password', self.default_user, token, 'reset_password')
+        self.assertIn(reverse('reset_password', kwargs={'uidb36': int_to_base36(self.default_user.id), 'token': token}), body)
+
+
+class BlockingEmailBackend(locmem.EmailBackend):
+    started = threading.Event()
+    release = threading.Event()
+    opened = 0
+
+    def open(self):
+        BlockingEmailBackend.opened += 1
+        return super(BlockingEmailBackend, self).open()
+
+    def send_messages(self, messages):
+        self.started.set()
+        self.release.wait(5)
+        return super(BlockingEmailBackend, self).send_messages(messages)
+
+
+@override_settings(SKY_VISITOR_EMAIL_DELIVERY='background', SKY_VISITOR_COMPILED_EMAILS=True)
+class EmailDeliveryPoolTest(SkyVisitorViewsTestCase):
+
+    def setUp(self):
+        BlockingEmailBackend.started.clear()
+        BlockingEmailBackend.release.clear()
+        BlockingEmailBackend.opened = 0
+
+    def test_forgot_password_should_send_in_background(self):
+        self.client.post('/user/forgot_password/', {'email': FIXTURE_USER_DATA['email']})
+        get_delivery_pool().flush()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(get_delivery_metrics()['sent'], 1)
+
+    @override_settings(SKY_VISITOR_EMAIL_COALESCE_SECONDS=60)
+    def test_failed_send_should_release_claim_and_not_count(self):
+        cache.clear()
+        data = {'email': FIXTURE_USER_DATA['email']}
+        with override_settings(EMAIL_BACKEND='normal_tests.tests.FailingEmailBackend'):
+            self.client.post('/user/forgot_password/', data)
+            get_delivery_pool().flush()
+            self.assertEqual(get_delivery_metrics()['failed'], 1)
+        self.assertEqual(get_email_counters(['visitor-forgot-password'])['visitor-forgot-password']['sent'], 0)
+
+        self.client.post('/user/forgot_password/', data)
+        get_delivery_pool().flush()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(get_email_counters(['visitor-forgot-password'])['visitor-forgot-password'],
+                         {'sent': 1, 'suppressed': 0})
+
+    def test_full_queue_should_send_synchronously(self):
+        pool = EmailDeliveryPool(threads=1, queue_size=1, connection_factory=BlockingEmailBackend)
+        try:
+            self.assertTrue(pool.submit(mail.EmailMessage('first', '', to=['a@example.com'])))
+            self.assertTrue(BlockingEmailBackend.started.wait(5))  # The thread is busy with the first message
+            self.assertTrue(pool.submit(mail.EmailMessage('second', '', to=['b@example.com'])))
+            self.assertEqual(pool.submit(mail.EmailMessage('third', '', to=['c@example.com'])), 1)
+            self.assertEqual([m.subject for m in mail.outbox], ['third'])
+            self.assertEqual(pool.get_metrics()['queue_depth'], 1)
+
+            BlockingEmailBackend.release.set()
+            pool.flush()
+            self.assertEqual([m.subject for m in mail.outbox], ['third', 'first', 'second'])
+            metrics = pool.get_metrics()
+            self.assertEqual((metrics['queued'], metrics['sent'], metrics['sent_synchronously']), (2, 2, 1))
+            # One connection, kept open for both messages
+            self.assertEqual(BlockingEmailBackend.opened, 1)
+        finally:
+            BlockingEmailBackend.release.set()
+            pool.shutdown(timeout=5)
+
+    def test_should_only_retry_dropped_connections(self):
+        BlockingEmailBackend.release.set()
+        pool = EmailDeliveryPool(threads=1, queue_size=10, connection_factory=BlockingEmailBackend)
+        calls = []
+
+        def fail(error):
+            def func(connection):
+                calls.append(error)
+                raise error
+            return func
+
+        try:
+            pool.submit_call(fail(ValueError()))
+            pool.submit_call(fail(smtplib.SMTPServerDisconnected()))
+            pool.submit_call(lambda connection: calls.append(connection), needs_connection=False)
+            pool.flush()
+        finally:
+            pool.shutdown(timeout=5)
+        self.assertEqual([type(c) for c in calls], [ValueError, smtplib.SMTPServerDisconnected, smtplib.SMTPServerDisconnected, type(None)])
+        self.assertEqual(pool.get_metrics()['failed'], 2)
+        # A new connection for each attempt, since a failure closes the connection
+        self.assertEqual(BlockingEmailBackend.opened, 3)
+
+    def test_shutdown_should_flush(self):
+        BlockingEmailBackend.release.set()
+        pool = EmailDeliveryPool(threads=2, queue_size=10, connection_factory=BlockingEmailBackend)
+        for i in range(5):
+            pool.submit(mail.EmailMessage('message %d' % i, '', to=['a@example.com']))
+        pool.shutdown(timeout=5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(any(thread.is_alive() for thread in pool.threads))
+
+
+SIGNED_SESSION_MIDDLEWARE = ['sky_visitor.middleware.SignedSessionMiddleware' if m == 'django.contrib.auth.middleware.AuthenticationMiddleware' else m
+                             for m in settings.MIDDLEWARE_CLASSES]
+
+
+@override_settings(SKY_VISITOR_SIGNED_SESSIONS=True, MIDDLEWARE_CLASSES=SIGNED_SESSION_MIDDLEWARE)
+class SignedSessionTest(SkyVisitorViewsTestCase):
+    change_password_url = '/user/change_password/'
+
+    def setUp(self):
+        cache.clear()
+        signed_sessions.clear_version_cache()
+
+    def signed_login(self, client=None):
+        client = client or self.client
+        UserModel = get_user_model()
+        response = client.post('/user/login/', {
+            'username': FIXTURE_USER_DATA[UserModel.USERNAME_FIELD],
+            'password': FIXTURE_USER_DATA['password'],
+        })
+        self.assertRedirected(response, settings.LOGIN_REDIRECT_URL)
+        return client.cookies[signed_sessions.get_cookie_name()].value
+
+    def assertAuthenticated(self, client=None, authenticated=True):
+        response = (client or self.client).get(self.change_password_url)
+        self.assertEqual(response.status_code, 200 if authenticated else 302)
+
+    def test_login_should_not_use_session_store(self):
+        self.signed_login()
+        self.assertAuthenticated()
+        self.assertFalse(SESSION_KEY in self.client.session)
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_logout_should_revoke_cookie(self):
+        cookie = self.signed_login()
+        self.client.get('/user/logout/')
+        self.assertAuthenticated(authenticated=False)
+        # A copy of the cookie doesn't work either
+        self.client.cookies[signed_sessions.get_cookie_name()] = cookie
+        self.assertAuthenticated(authenticated=False)
+
+    def test_password_change_should_revoke_other_sessions(self):
+        other_client = Client()
+        self.signed_login(other_client)
+        self.signed_login()
+        response = self.client.post(self.change_password_url, {
+            'old_password': FIXTURE_USER_DATA['password'],
+            'new_password1': 'asdfasdf',
+            'new_password2': 'asdfasdf',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertAuthenticated()
+        self.assertAuthenticated(other_client, authenticated=False)
+
+    def test_tampered_cookie_should_be_anonymous(self):
+        cookie = self.signed_login()
+        self.client.cookies[signed_sessions.get_cookie_name()] = cookie[:-1] + ('A' if cookie[-1] != 'A' else 'B')
+        self.assertAuthenticated(authenticated=False)
+
+    def test_login_should_rotate_csrf_token(self):
+        self.client.get('/user/login/')
+        token = self.client.cookies[settings.CSRF_COOKIE_NAME].value
+        self.signed_login()
+        self.assertNotEqual(self.client.cookies[settings.CSRF_COOKIE_NAME].value, token)
+
+    def test_removed_backend_should_be_anonymous(self):
+        self.signed_login()
+        with self.settings(AUTHENTICATION_BACKENDS=['sky_visitor.backends.EmailOrUsernameBackend']):
+            self.assertAuthenticated(authenticated=False)
+        self.assertAuthenticated()
+
+    def test_version_should_be_cached(self):
+        user_id = self.default_user.pk
+        self.assertEqual(signed_sessions.get_session_version(user_id), 0)
+        with self.assertNumQueries(0):
+            signed_sessions.get_session_version(user_id)
+        signed_sessions.revoke_sessions([user_id])
+        signed_sessions.clear_version_cache()
+        with self.assertNumQueries(0):
+            # From Django's cache
+            self.assertEqual(signed_sessions.get_session_version(user_id), 1)
 
 
 class ChangePasswordViewTest(SkyVisitorViewsTestCase):
@@ -354,3 +801,810 @@ class InvitationProcessTest(RegisterUserMixin, SkyVisitorViewsTestCase):
         invited_user_updated = InvitedUser.objects.get(email=invited_user.email)
         self.assertEqual(invited_user_updated.created_user.id, user.id)
         self.assertEqual(invited_user_updated.status, InvitedUser.STATUS_REGISTERED)
+
+    def test_should_count_invitations(self):
+        self.test_should_complete_invitation_registration_from()
+        InvitedUser.objects.create(email='pending@example.com')  # Not counted, so reconcile has something to fix
+        self.assertEqual(get_invitation_stats(), {'sent': 1, 'accepted': 1, 'expired': 0, 'pending': 0})
+        today = timezone.localtime(timezone.now()).date() if settings.USE_TZ else datetime.date.today()
+        self.assertEqual(get_daily_invitation_stats(today, today), [(today, {'sent': 1, 'accepted': 1})])
+
+        with self.assertNumQueries(1):
+            get_invitation_stats()
+        self.assertEqual(reconcile_invitation_stats(chunk_size=1), {'sent': 2, 'accepted': 1, 'expired': 0, 'pending': 1})
+
+    def test_expirations_should_only_be_counted_all_time(self):
+        get_counts = lambda: list(InvitationCounter.objects.filter(name='expired').values_list('period', 'value'))
+        record_expired(2)
+        self.assertEqual(get_counts(), [('', 2)])
+        InvitedUser.objects.create(email='expired@example.com', status=InvitedUser.STATUS_EXPIRED)
+        reconcile_invitation_stats()
+        self.assertEqual(get_counts(), [('', 1)])
+
+
+class InvitationLinkTest(RegisterUserMixin, SkyVisitorViewsTestCase):
+
+    def setUp(self):
+        super(InvitationLinkTest, self).setUp()
+        self.link = InvitationLink.objects.create(name="Acme", seats=2)
+        self.view_url = self.link.get_absolute_url()
+
+    def _register(self, n):
+        UserModel = get_user_model()
+        data = self.get_register_user_data()
+        data[UserModel.USERNAME_FIELD] = 'linkuser%d@example.com' % n
+        self.client.logout()
+        return self.client.post(self.view_url, data=data)
+
+    def _user_count(self):
+        return get_user_model()._default_manager.count()
+
+    def test_view_should_exist(self):
+        response = self.client.get(self.view_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context_data['invitation_link'], self.link)
+
+    def test_should_register_until_seats_are_used(self):
+        user_count = self._user_count()
+        for n in range(2):
+            response = self._register(n)
+            self.assertRedirected(response, '/')
+        self.assertEqual(self._user_count(), user_count + 2)
+        self.assertEqual(InvitationLink.objects.get(pk=self.link.pk).used, 2)
+
+        # Every seat is taken, so the link no longer works
+        response = self._register(2)
+        self.assertRedirected(response, '/user/login/')
+        self.assertEqual(self._user_count(), user_count + 2)
+
+    def test_should_not_register_when_last_seat_is_taken_meanwhile(self):
+        view = InvitationLinkView()
+        view.request = RequestFactory().post(self.view_url)
+        view.kwargs = {'code': self.link.code}
+        view.object = None
+        view.link = self.link
+        # Someone else takes the last seats between this visitor loading and submitting the form
+        InvitationLink.objects.filter(pk=self.link.pk).update(used=2)
+        form = RegisterForm(data=self.get_register_user_data())
+        self.assertTrue(form.is_valid())
+        user_count = self._user_count()
+        response = view.form_valid(form)
+        self.assertEqual(response.context_data['form'].non_field_errors(), [InvitationLinkView.no_seats_message])
+        self.assertEqual(self._user_count(), user_count)
+
+    def test_claim_seat_should_not_oversell(self):
+        self.assertTrue(self.link.claim_seat())
+        self.assertTrue(self.link.claim_seat())
+        with self.assertNumQueries(1):
+            self.assertFalse(self.link.claim_seat())
+        self.assertEqual(InvitationLink.objects.get(pk=self.link.pk).used, 2)
+
+        self.link.release_seat()
+        self.assertEqual(InvitationLink.objects.get(pk=self.link.pk).used, 1)
+
+    def test_should_reject_inactive_or_expired_links(self):
+        InvitationLink.objects.filter(pk=self.link.pk).update(is_active=False)
+        self.assertRedirected(self.client.get(self.view_url), '/user/login/')
+        self.assertFalse(InvitationLink.objects.get(pk=self.link.pk).claim_seat())
+
+        InvitationLink.objects.filter(pk=self.link.pk).update(is_active=True, expires_at=timezone.now() - datetime.timedelta(days=1))
+        self.assertRedirected(self.client.get(self.view_url), '/user/login/')
+        self.assertFalse(InvitationLink.objects.get(pk=self.link.pk).claim_seat())
+
+        self.assertRedirected(self.client.get('/user/invitation_link/unknown/'), '/user/login/')
+
+
+def in_transaction(using=DEFAULT_DB_ALIAS):
+    if hasattr(transaction, 'atomic'):
+        return connections[using].in_atomic_block
+    return transaction.is_managed(using=using)
+
+
+class InvitationLinkTransactionTest(RegisterUserMixin, TransactionTestCase):
+
+    def test_seat_should_be_claimed_outside_request_transaction(self):
+        link = InvitationLink.objects.create(name="Acme", seats=2)
+        middleware = list(settings.MIDDLEWARE_CLASSES)
+        if not hasattr(transaction, 'atomic'):
+            middleware.append('django.middleware.transaction.TransactionMiddleware')
+        settings_dict = connections[DEFAULT_DB_ALIAS].settings_dict
+        claim_seat = InvitationLink.claim_seat
+        in_transaction_states = []
+
+        def recording_claim_seat(link):
+            in_transaction_states.append(in_transaction())
+            return claim_seat(link)
+        InvitationLink.claim_seat = recording_claim_seat
+        settings_dict['ATOMIC_REQUESTS'] = True
+        try:
+            with self.settings(MIDDLEWARE_CLASSES=middleware):
+                response = self.client.post(link.get_absolute_url(), data=self.get_register_user_data())
+        finally:
+            InvitationLink.claim_seat = claim_seat
+            del settings_dict['ATOMIC_REQUESTS']
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(in_transaction_states, [False])
+        self.assertEqual(InvitationLink.objects.get(pk=link.pk).used, 1)
+
+
+class APIViewsTest(RegisterUserMixin, SkyVisitorViewsTestCase):
+    invited_user_email = 'invited@example.com'
+
+    def post_json(self, url_name, data=None, status=200, **kwargs):
+        response = self.client.post(reverse(url_name, kwargs=kwargs or None), data or {})
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(response.content.decode('utf-8'))
+
+    def token_kwargs(self, user, token_generator=default_token_generator):
+        return {'uidb36': int_to_base36(user.id), 'token': token_generator.make_token(user)}
+
+    def test_get_should_not_be_allowed(self):
+        self.assertEqual(self.client.get(reverse('api_login')).status_code, 405)
+
+    def test_login_and_logout(self):
+        UserModel = get_user_model()
+        data = self.post_json('api_login', {'username': FIXTURE_USER_DATA[UserModel.USERNAME_FIELD], 'password': 'wrong'}, status=400)
+        self.assertEqual(list(data['errors']), ['__all__'])
+        self.assertFalse(SESSION_KEY in self.client.session)
+
+        data = self.post_json('api_login', {'username': FIXTURE_USER_DATA[UserModel.USERNAME_FIELD], 'password': FIXTURE_USER_DATA['password']})
+        self.assertEqual(data, {'ok': True, 'user': {'id': self.default_user.pk, UserModel.USERNAME_FIELD: FIXTURE_USER_DATA[UserModel.USERNAME_FIELD]}})
+        self.assertTrue(SESSION_KEY in self.client.session)
+
+        self.assertEqual(self.post_json('api_logout'), {'ok': True})
+        self.assertFalse(SESSION_KEY in self.client.session)
+
+    def test_register(self):
+        UserModel = get_user_model()
+        data = self.get_register_user_data()
+        data['password2'] = 'mismatch'
+        self.assertIn('password2', self.post_json('api_register', data, status=400)['errors'])
+
+        data = self.get_register_user_data()
+        response_data = self.post_json('api_register', data)
+        user = UserModel._default_manager.get(**{UserModel.USERNAME_FIELD: data[UserModel.USERNAME_FIELD]})
+        self.assertEqual(response_data['user']['id'], user.pk)
+        self.assertLoggedIn(user, backend='sky_visitor.backends.BaseBackend')
+
+    def test_forgot_and_reset_password(self):
+        self.assertEqual(self.post_json('api_forgot_password', {'email': FIXTURE_USER_DATA['email']}), {'ok': True})
+        self.assertEqual(len(mail.outbox), 1)
+
+        kwargs = self.token_kwargs(self.default_user)
+        data = {'new_password1': 'asdfasdf', 'new_password2': 'asdfasdf'}
+        self.assertEqual(self.post_json('api_reset_password', data, **kwargs), {'ok': True})
+        user = get_user_model()._default_manager.get(pk=self.default_user.pk)
+        self.assertTrue(user.check_password('asdfasdf'))
+        self.assertLoggedIn(user, backend='sky_visitor.backends.BaseBackend')
+
+        # The password changed, so the token doesn't work anymore
+        self.assertIn('token', self.post_json('api_reset_password', data, status=400, **kwargs)['errors'])
+
+    def test_change_password_should_require_login(self):
+        data = {'old_password': FIXTURE_USER_DATA['password'], 'new_password1': 'asdfasdf', 'new_password2': 'asdfasdf'}
+        self.post_json('api_change_password', data, status=401)
+        self.login()
+        self.assertEqual(self.post_json('api_change_password', data), {'ok': True})
+
+    def test_magic_link(self):
+        self.assertEqual(self.post_json('api_magic_link_start', {'email': FIXTURE_USER_DATA['email']}), {'ok': True})
+        self.assertEqual(len(mail.outbox), 1)
+        kwargs = self.token_kwargs(self.default_user, magic_link_token_generator)
+        self.assertEqual(self.post_json('api_magic_link_login', **kwargs)['user']['id'], self.default_user.pk)
+        self.post_json('api_magic_link_login', status=400, **kwargs)
+
+    def test_invitation(self):
+        self.assertEqual(self.post_json('api_invitation_start', {'email': self.invited_user_email}), {'ok': True})
+        self.assertIn('email', self.post_json('api_invitation_start', {'email': self.invited_user_email}, status=400)['errors'])
+        self.assertEqual(len(mail.outbox), 1)
+
+        invited_user = InvitedUser.objects.get(email=self.invited_user_email)
+        kwargs = self.token_kwargs(invited_user)
+        data = self.get_register_user_data()
+        data['email'] = self.invited_user_email
+        user_id = self.post_json('api_invitation_complete', data, **kwargs)['user']['id']
+        self.assertEqual(InvitedUser.objects.get(pk=invited_user.pk).created_user_id, user_id)
+        self.post_json('api_invitation_complete', data, status=400, **kwargs)
+
+
+class ForcedPasswordResetTest(SkyVisitorViewsTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.temp_dir, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def force_reset(self, *args, **options):
+        out, err = StringIO(), StringIO()
+        call_command('force_password_reset', *args, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def get_reset_path(self, email):
+        message = [m for m in mail.outbox if email in m.to][0]
+        return re.search(r'https?://[^/\s]+(/user/reset_password/[^\s"<]+/)', message.body).group(1)
+
+    def test_should_reset_and_email_every_active_user(self):
+        self.force_reset(all=True, chunk_size=1, checkpoint=self.checkpoint)
+        UserModel = get_user_model()
+        for user in UserModel._default_manager.all():
+            self.assertFalse(user.has_usable_password())
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['admin@example.com', FIXTURE_USER_DATA['email']])
+
+        # The emailed link sets a new password
+        data = {'new_password1': 'asdfasdf', 'new_password2': 'asdfasdf'}
+        response = self.client.post(self.get_reset_path(FIXTURE_USER_DATA['email']), data)
+        self.assertRedirected(response, '/')
+        self.assertTrue(UserModel._default_manager.get(pk=self.default_user.pk).check_password('asdfasdf'))
+
+    def test_forgot_password_should_still_work(self):
+        self.force_reset(all=True, send_email=False)
+        self.assertEqual(len(mail.outbox), 0)
+        self.client.post('/user/forgot_password/', {'email': FIXTURE_USER_DATA['email']})
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_should_end_existing_sessions(self):
+        self.login()
+        out, err = self.force_reset(all=True, send_email=False)
+        self.assertIn("1 sessions ended", out)
+        response = self.client.get('/user/change_password/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_should_warn_when_sessions_cant_be_ended(self):
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies'):
+            out, err = self.force_reset(all=True, send_email=False)
+        self.assertIn("Existing logins can't be ended", err)
+
+    def test_should_resume_from_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'last_pk': self.default_user.pk}, f)
+        out, err = self.force_reset(all=True, checkpoint=self.checkpoint)
+        self.assertIn("Resuming after user %s" % self.default_user.pk, out)
+        self.assertEqual([m.to[0] for m in mail.outbox], ['admin@example.com'])
+        self.assertTrue(get_user_model()._default_manager.get(pk=self.default_user.pk).has_usable_password())
+
+        out, err = self.force_reset(all=True, checkpoint=self.checkpoint)
+        self.assertIn("No users to reset", out)
+
+    def test_should_reset_listed_users(self):
+        UserModel = get_user_model()
+        path = os.path.join(self.temp_dir, 'users.txt')
+        with open(path, 'w') as f:
+            f.write('%s\nnobody\n' % FIXTURE_USER_DATA[UserModel.USERNAME_FIELD])
+        out, err = self.force_reset(path)
+        self.assertIn("1 of 2 users not found", err)
+        self.assertEqual([m.to[0] for m in mail.outbox], [FIXTURE_USER_DATA['email']])
+        self.assertTrue(UserModel._default_manager.get(email='admin@example.com').has_usable_password())
+
+
+class BreachedPasswordIndexTest(SkyVisitorTestCase):
+    breached_passwords = [b'password', b'letmein1', b'correcthorse']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.tmp_dir, 'breached.idx')
+        lines = [p + b'\n' for p in self.breached_passwords * 2]
+        self.count = build_breached_password_index(lines, self.index_path, input_format='plain', chunk_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_index_should_contain_each_password_once(self):
+        index = BreachedPasswordIndex(self.index_path)
+        self.assertEqual(self.count, len(self.breached_passwords))
+        self.assertEqual(len(index), len(self.breached_passwords))
+        for password in self.breached_passwords:
+            self.assertIn(password, index)
+        self.assertNotIn('not-in-the-list', index)
+        index.close()
+
+    def test_sha1_input_should_skip_malformed_hashes(self):
+        digest = hashlib.sha1(b'hunter22').hexdigest().upper().encode('ascii')
+        lines = [b'abcd\n', digest + b':42\n', b'not-hex\n', digest[:38] + b'\n']
+        self.assertEqual(build_breached_password_index(lines, self.index_path), 1)
+        index = BreachedPasswordIndex(self.index_path)
+        self.assertEqual(len(index), 1)
+        self.assertIn(b'hunter22', index)
+        index.close()
+
+    def test_rebuilt_index_should_be_picked_up(self):
+        index = BreachedPasswordIndex(self.index_path, check_interval=0)
+        self.assertIn(b'letmein1', index)
+        build_breached_password_index([b'hunter22\n'], self.index_path, input_format='plain')
+        self.assertNotIn(b'letmein1', index)
+        self.assertIn(b'hunter22', index)
+        self.assertEqual(len(index), 1)
+        index.close()
+
+    def test_password_field_should_reject_breached_password(self):
+        field = PasswordRulesField()
+        with override_settings(SKY_VISITOR_BREACHED_PASSWORD_INDEX=self.index_path):
+            self.assertRaises(ValidationError, field.clean, 'letmein1')
+            self.assertEqual(field.clean('a-fine-password'), 'a-fine-password')
+
+
+class PasswordRulePipelineTest(SkyVisitorTestCase):
+
+    class RecordingRule(PasswordRule):
+
+        def __init__(self, name, cost, log, fail=False):
+            self.name = name
+            self.cost = cost
+            self.log = log
+            self.fail = fail
+
+        def __call__(self, password, user=None):
+            self.log.append(self.name)
+            if self.fail:
+                raise ValidationError(self.name)
+
+    def test_rules_should_run_cheapest_first(self):
+        log = []
+        pipeline = PasswordRulePipeline([
+            self.RecordingRule('expensive', 100, log),
+            self.RecordingRule('cheap', 1, log),
+            self.RecordingRule('medium', 10, log),
+        ])
+        pipeline.validate('whatever')
+        self.assertEqual(log, ['cheap', 'medium', 'expensive'])
+
+    def test_pipeline_should_stop_at_first_failure_and_report_timing(self):
+        log = []
+        timings = []
+        pipeline = PasswordRulePipeline([
+            self.RecordingRule('expensive', 100, log),
+            self.RecordingRule('failing', 5, log, fail=True),
+            self.RecordingRule('cheap', 1, log),
+        ], timing_hook=lambda rule, seconds, passed: timings.append((rule.name, passed)))
+        self.assertRaises(ValidationError, pipeline.validate, 'whatever')
+        self.assertEqual(log, ['cheap', 'failing'])
+        self.assertEqual(timings, [('cheap', True), ('failing', False)])
+
+    def test_builtin_rules(self):
+        self.assertRaises(ValidationError, CharacterClassesRule(min_classes=2), 'alllowercase')
+        CharacterClassesRule(min_classes=2)('lower and 1 digit')
+        user = get_user_model()(email='jane.doe@example.com')
+        self.assertRaises(ValidationError, UserAttributeSimilarityRule(attributes=['email']), 'jane.doe@example', user)
+        UserAttributeSimilarityRule(attributes=['email'])('correct horse battery', user)
+
+    @override_settings(SKY_VISITOR_PASSWORD_RULES=[('sky_visitor.validators.CharacterClassesRule', {'min_classes': 3})])
+    def test_password_field_should_use_configured_rules(self):
+        field = PasswordRulesField()
+        self.assertRaises(ValidationError, field.clean, 'short')
+        self.assertRaises(ValidationError, field.clean, 'onlylowercase')
+        self.assertEqual(field.clean('Mixed-Case-1'), 'Mixed-Case-1')
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1400000000.0):
+        self.now = now
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class InvitationCampaignTest(SkyVisitorTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.emails = ['campaign%d@example.com' % i for i in range(4)]
+
+    def get_scheduler(self, **kwargs):
+        return CampaignScheduler(rate_per_minute=60, jitter=0, clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_create_campaign_should_skip_existing_users(self):
+        campaign = create_campaign("Test", self.emails + [FIXTURE_USER_DATA['email'], self.emails[0]], chunk_size=2)
+        self.assertEqual(sorted(i.invited_user.email for i in campaign.invitations.all()), self.emails)
+
+    def test_should_send_at_configured_rate(self):
+        create_campaign("Test", self.emails)
+        self.assertEqual(self.get_scheduler().run(), 4)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(self.clock.slept, [1.0, 1.0, 1.0])
+        # Everything has been sent, so there is nothing left to do
+        self.assertEqual(self.get_scheduler().run(), 0)
+
+    def test_should_resume_after_stopping(self):
+        create_campaign("Test", self.emails)
+        self.assertEqual(self.get_scheduler().run(limit=3), 3)
+        self.assertEqual(self.get_scheduler().run(), 1)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), self.emails)
+
+    def test_reminders_should_share_rate_and_skip_registered(self):
+        create_campaign("Test", self.emails, reminder_delay=3600, max_reminders=1)
+        scheduler = self.get_scheduler()
+        scheduler.run()
+        InvitedUser.objects.filter(email=self.emails[0]).update(status=InvitedUser.STATUS_REGISTERED)
+
+        self.assertEqual(scheduler.run(), 0)  # Not due yet
+        self.clock.now += 3600
+        self.clock.slept = []
+        self.assertEqual(scheduler.run(), 3)
+        self.assertEqual(self.clock.slept, [1.0, 1.0])
+        self.assertEqual(sorted(CampaignInvitation.objects.values_list('send_count', flat=True)), [1, 2, 2, 2])
+
+        self.clock.now += 3600
+        self.assertEqual(scheduler.run(), 0)  # max_reminders reached
+
+    def test_unsent_emails_should_not_count(self):
+        cache.clear()
+        campaign = create_campaign("Test", self.emails)
+        invited_user = InvitedUser.objects.get(email=self.emails[0])
+        with override_settings(SKY_VISITOR_EMAIL_COALESCE_SECONDS=60):
+            # As if the invitation had just been sent from the invitation form
+            claim_email_send(InvitationStartView.email_template, invited_user.email, user_pk=invited_user.pk)
+            self.assertEqual(self.get_scheduler().run(), 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(self.clock.slept, [1.0, 1.0])
+        self.assertEqual(campaign.invitations.get(invited_user=invited_user).send_count, 0)
+
+    def test_rate_limiter_jitter(self):
+        limiter = RateLimiter(60, jitter=0.5, clock=self.clock, sleep=self.clock.sleep, random=lambda: 1.0)
+        limiter.wait()
+        limiter.wait()
+        self.assertEqual(self.clock.slept, [1.5])
+
+
+class InvitationExportTest(SkyVisitorViewsTestCase):
+
+    def setUp(self):
+        InvitedUser.objects.create(email='pending@example.com')
+        InvitedUser.objects.create(email='registered@example.com', status=InvitedUser.STATUS_REGISTERED,
+                                   created_user=self.default_user)
+        InvitedUser.objects.create(email='expired@example.com', status=InvitedUser.STATUS_EXPIRED)
+
+    def parse(self, content):
+        return list(csv.reader(content.decode('utf-8').splitlines()))
+
+    def test_export_should_include_every_invitation(self):
+        rows = self.parse(b''.join(export_invitations(chunk_size=2)))
+        UserModel = get_user_model()
+        self.assertEqual(rows[0][-1], 'created_user_%s' % UserModel.USERNAME_FIELD)
+        self.assertEqual([row[1] for row in rows[1:]], ['pending@example.com', 'registered@example.com', 'expired@example.com'])
+        self.assertEqual(rows[2][-1], getattr(self.default_user, UserModel.USERNAME_FIELD))
+        self.assertEqual(rows[1][-1], '')
+
+    def test_gzipped_export(self):
+        content = zlib.decompress(b''.join(export_invitations(compress=True)), 16 + zlib.MAX_WBITS)
+        self.assertEqual(len(self.parse(content)), 4)
+
+    def test_view_should_be_staff_only(self):
+        url = reverse('invitation_export')
+        self.login()
+        self.assertNotEqual(self.client.get(url).get('Content-Type'), 'text/csv')
+
+        UserModel = get_user_model()
+        staff_field = 'is_staff' if 'is_staff' in [f.name for f in UserModel._meta.fields] else 'is_admin'
+        UserModel._default_manager.filter(pk=self.default_user.pk).update(**{staff_field: True})
+        response = self.client.get(url, {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        content = zlib.decompress(b''.join(response.streaming_content), 16 + zlib.MAX_WBITS)
+        self.assertEqual(len(self.parse(content)), 4)
+
+
+class IndexAdvisorTest(SkyVisitorTestCase):
+
+    def test_should_flag_scans_and_suggest_indexes(self):
+        out = StringIO()
+        call_command('index_advisor', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('ok   TokenValidateMixin: id', lines)
+        self.assertIn('ok   InvitedUserAdmin: InvitedUser status', lines)
+        self.assertIn('SCAN ForgotPasswordView, MagicLinkForm, EmailOrUsernameBackend: email__iexact', lines)
+        # The tests run on SQLite, where no index serves iexact
+        self.assertIn('    ForgotPasswordView, MagicLinkForm, EmailOrUsernameBackend: email__iexact', lines)
+        self.assertFalse([line for line in lines if 'NOCASE' in line])
+        if 'SCAN InvitationStartForm.clean_email: email' in lines:
+            # auth.User's email isn't indexed
+            self.assertIn('    CREATE INDEX "auth_user_email_idx" ON "auth_user" ("email");', lines)
+
+
+class InvitedUserAdminTest(SkyVisitorTestCase):
+    changelist_url = '/admin/sky_visitor/inviteduser/'
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        User.objects.create_superuser('invitationadmin', 'invitationadmin@example.com', 'adminadmin')
+        self.client.login(username='invitationadmin', password='adminadmin')
+        self.invitations = [InvitedUser.objects.create(email='invited%d@example.com' % i) for i in range(5)]
+        self.model_admin = admin.site._registry[InvitedUser]
+        self.list_per_page = self.model_admin.list_per_page
+        self.model_admin.list_per_page = 2
+
+    def tearDown(self):
+        self.model_admin.list_per_page = self.list_per_page
+
+    def test_changelist_should_page_by_primary_key(self):
+        response = self.client.get(self.changelist_url)
+        cl = response.context['cl']
+        self.assertEqual(cl.result_count, 5)
+        self.assertEqual([i.pk for i in cl.result_list], [self.invitations[4].pk, self.invitations[3].pk])
+
+        response = self.client.get(self.changelist_url + cl.next_page_url)
+        cl = response.context['cl']
+        self.assertEqual([i.pk for i in cl.result_list], [self.invitations[2].pk, self.invitations[1].pk])
+
+        response = self.client.get(self.changelist_url + cl.next_page_url)
+        cl = response.context['cl']
+        self.assertEqual([i.pk for i in cl.result_list], [self.invitations[0].pk])
+        self.assertEqual(cl.next_page_url, None)
+
+    def test_search_should_match_email_prefix(self):
+        response = self.client.get(self.changelist_url, {'q': 'Invited3'})
+        self.assertEqual([i.pk for i in response.context['cl'].result_list], [self.invitations[3].pk])
+        response = self.client.get(self.changelist_url, {'q': 'example.com'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_expire_action(self):
+        selected = [self.invitations[0].pk, self.invitations[1].pk]
+        response = self.client.post(self.changelist_url, {'action': 'expire_invitations', '_selected_action': selected})
+        self.assertEqual(response.status_code, 302)
+        expired = InvitedUser.objects.filter(status=InvitedUser.STATUS_EXPIRED)
+        self.assertEqual(sorted(expired.values_list('pk', flat=True)), selected)
+
+        # An expired invitation can't be completed
+        url = reverse('invitation_complete', kwargs={'uidb36': int_to_base36(selected[0]), 'token': default_token_generator.make_token(self.invitations[0])})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_resend_action(self):
+        self.model_admin.action_chunk_size = 2
+        try:
+            self.client.post(self.changelist_url, {'action': 'resend_invitations', 'select_across': '1',
+                                                   '_selected_action': [self.invitations[0].pk]})
+        finally:
+            self.model_admin.action_chunk_size = 500
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), sorted(i.email for i in self.invitations))
+
+
+class SiteCacheTest(SkyVisitorTestCase):
+
+    def setUp(self):
+        site_cache.clear()
+        self.factory = RequestFactory()
+        self.other_site = Site.objects.create(domain='other.example.com', name="Other")
+
+    def test_site_should_match_request_host(self):
+        request = self.factory.get('/', HTTP_HOST='other.example.com:8000')
+        context = site_cache.get_site_context(request)
+        self.assertEqual(context['site'], self.other_site)
+        self.assertEqual(context['url_prefix'], 'http://other.example.com')
+        self.assertEqual(context['static_url'], 'http://other.example.com' + settings.STATIC_URL)
+        with self.assertNumQueries(0):
+            self.assertEqual(site_cache.get_site_context(request), context)
+
+    def test_unknown_host_should_use_current_site(self):
+        context = site_cache.get_site_context(self.factory.get('/', HTTP_HOST='unknown.example.com'))
+        self.assertEqual(context['site'], Site.objects.get_current())
+        self.assertEqual(context['domain'], Site.objects.get_current().domain)
+
+    def test_forged_host_should_not_be_used_in_links(self):
+        request = self.factory.post('/user/forgot_password/', HTTP_HOST='attacker.example.com')
+        user = get_user_model()._default_manager.all()[0]
+        context = TokenEmailSender('visitor-forgot-password', 'reset_password', request=request).get_email_context_data(user)
+        self.assertNotIn('attacker.example.com', context['token_url'])
+        self.assertTrue(context['token_url'].startswith('http://%s/' % Site.objects.get_current().domain))
+
+    def test_saving_site_should_clear_cache(self):
+        request = self.factory.get('/', HTTP_HOST='other.example.com')
+        site_cache.get_site_context(request)
+        self.other_site.name = "Renamed"
+        self.other_site.save()
+        self.assertEqual(site_cache.get_site_context(request)['site_name'], "Renamed")
+
+    def test_email_context_should_not_query(self):
+        request = self.factory.get('/', HTTP_HOST='other.example.com', **{'wsgi.url_scheme': 'https'})
+        user = get_user_model()._default_manager.all()[0]
+        sender = TokenEmailSender('visitor-forgot-password', 'reset_password', request=request)
+        sender.get_email_context_data(user)
+        with self.assertNumQueries(0):
+            context = sender.get_email_context_data(user)
+        self.assertEqual(context['site'], self.other_site)
+        self.assertTrue(context['token_url'].startswith('https://other.example.com/user/reset_password/'))
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(json.loads(record.getMessage()))
+
+
+@override_settings(MIDDLEWARE_CLASSES=['sky_visitor.middleware.TrafficRecorderMiddleware'] + list(settings.MIDDLEWARE_CLASSES))
+class TrafficRecorderTest(SkyVisitorViewsTestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('sky_visitor.traffic')
+        self.old_level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.old_level)
+
+    def test_should_record_request_shape_without_values(self):
+        self.client.post('/user/login/', {'username': 'nobody', 'password': 'secret-value'})
+        record, = self.handler.records
+        self.assertEqual(record['route'], 'login')
+        self.assertEqual(record['method'], 'POST')
+        self.assertEqual(record['post'], ['password', 'username'])
+        self.assertEqual(record['status'], 200)
+        self.assertFalse(record['authenticated'])
+        self.assertIsNone(record['token_valid'])
+        self.assertNotIn('secret-value', json.dumps(record))
+
+    def test_should_record_token_validity(self):
+        self.client.get('/user/reset_password/1-35t-d4e092280eb134000671/')
+        self.assertEqual(self.handler.records[0]['token_valid'], False)
+
+    def test_should_record_whether_logged_in_before_the_view(self):
+        UserModel = get_user_model()
+        self.client.post('/user/login/', {
+            'username': FIXTURE_USER_DATA[UserModel.USERNAME_FIELD],
+            'password': FIXTURE_USER_DATA['password'],
+        })
+        self.client.get('/user/logout/')
+        login_record, logout_record = self.handler.records
+        self.assertFalse(login_record['authenticated'])
+        self.assertTrue(logout_record['authenticated'])
+
+    def test_should_ignore_other_urls(self):
+        self.client.get('/')
+        self.assertEqual(self.handler.records, [])
+
+
+@override_settings(SKY_VISITOR_READ_REPLICAS=['replica'])
+class ReplicaRoutingTest(SkyVisitorTestCase):
+
+    def setUp(self):
+        sky_visitor_db.reset_pinning()
+        self.factory = RequestFactory()
+        self.router = sky_visitor_db.ReplicaRouter()
+        self.UserModel = get_user_model()
+
+    def tearDown(self):
+        sky_visitor_db.reset_pinning()
+
+    def test_reads_should_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(self.UserModel), 'replica')
+        self.assertEqual(sky_visitor_db.get_read_database(self.UserModel, self.factory.get('/')), 'replica')
+
+    def test_unsafe_request_reads_should_go_to_primary(self):
+        self.assertEqual(sky_visitor_db.get_read_database(self.UserModel, self.factory.post('/')), 'default')
+
+    def test_write_should_pin_reads_to_primary(self):
+        self.assertEqual(self.router.db_for_write(self.UserModel), 'default')
+        self.assertEqual(self.router.db_for_read(self.UserModel), 'default')
+        self.assertEqual(sky_visitor_db.get_read_database(self.UserModel), 'default')
+
+    def test_middleware_should_pin_following_requests_after_write(self):
+        middleware = ReplicaPinningMiddleware()
+        request = self.factory.post('/')
+        middleware.process_request(request)
+        self.router.db_for_write(self.UserModel)
+        response = middleware.process_response(request, HttpResponse())
+        self.assertIn(middleware.cookie_name, response.cookies)
+        self.assertEqual(self.router.db_for_read(self.UserModel), 'replica')
+
+        request = self.factory.get('/')
+        request.COOKIES[middleware.cookie_name] = '1'
+        middleware.process_request(request)
+        self.assertEqual(self.router.db_for_read(self.UserModel), 'default')
+        response = middleware.process_response(request, HttpResponse())
+        # Reads alone shouldn't extend the pinning window
+        self.assertNotIn(middleware.cookie_name, response.cookies)
+
+    def test_form_lookups_should_use_primary(self):
+        # 'replica' isn't a configured database, so reading from it would raise
+        email = FIXTURE_USER_DATA['email']
+        form = InvitationStartForm(data={'email': email})
+        self.assertFalse(form.is_valid())
+        self.assertIn('email', form.errors)
+        for form_class in (PasswordResetForm, MagicLinkForm):
+            form = form_class(data={'email': email})
+            self.assertTrue(form.is_valid())
+            self.assertEqual([user.email for user in form.get_users()], [email])
+        if self.UserModel.USERNAME_FIELD == 'username':
+            form = RegisterForm(data={'username': FIXTURE_USER_DATA['username']})
+            self.assertFalse(form.is_valid())
+            self.assertIn('username', form.errors)
+
+
+class LoadTestDataTest(SkyVisitorTestCase):
+
+    def test_should_create_users_and_invitations(self):
+        UserModel = get_user_model()
+        user_count = UserModel._default_manager.count()
+        call_command('generate_load_test_data', users=5, invitations=4, prefix='loadtest', chunk_size=2, password_pool=2,
+                     processes=1, seed=1, stdout=StringIO())
+        self.assertEqual(UserModel._default_manager.count(), user_count + 5)
+        self.assertEqual(InvitedUser.objects.count(), 4)
+        self.assertEqual(get_invitation_stats()['sent'], 4)
+
+        users = UserModel._default_manager.filter(email__startswith='loadtest').order_by('pk')
+        self.assertEqual(len(users), 5)
+        for i, user in enumerate(users):
+            self.assertTrue(user.has_usable_password())
+            self.assertTrue(user.check_password('loadtest-password-%d' % (i % 2)))
+
+
+def is_connection_detached():
+    return connections[DEFAULT_DB_ALIAS].connection is None
+
+
+class HashingPoolTest(SkyVisitorTestCase):
+
+    def test_workers_should_detach_connections_and_leave_the_parents_alone(self):
+        connection = connections[DEFAULT_DB_ALIAS]
+        get_user_model()._default_manager.count()  # Make sure the parent is connected
+        parent_connection = connection.connection
+        pool = get_hashing_pool(1)
+        try:
+            self.assertTrue(pool.apply(is_connection_detached))
+            self.assertEqual(len(hash_passwords(['password'], pool)), 1)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertIs(connection.connection, parent_connection)
+
+
+class ProvisioningTest(SkyVisitorTestCase):
+
+    def get_row(self, i, **extra):
+        UserModel = get_user_model()
+        row = {
+            UserModel.USERNAME_FIELD: 'provisioned%d@example.com' % i,
+            'email': 'provisioned%d@example.com' % i,
+            'password': 'provisioned-password',
+        }
+        if 'date_of_birth' in UserModel.REQUIRED_FIELDS:
+            row['date_of_birth'] = '1980-01-01'
+        row.update(extra)
+        return row
+
+    def test_should_create_valid_rows_and_report_invalid_ones(self):
+        UserModel = get_user_model()
+        rows = [
+            self.get_row(1),
+            self.get_row(2, password=''),
+            self.get_row(1),  # Duplicate of the first row
+            self.get_row(3, password='short'),
+            self.get_row(4, **{UserModel.USERNAME_FIELD: FIXTURE_USER_DATA[UserModel.USERNAME_FIELD]}),
+        ]
+        results = list(provision_users(rows, chunk_size=2))
+        self.assertEqual([r.row_number for r in results], [1, 2, 3, 4, 5])
+        self.assertEqual([r.ok for r in results], [True, True, False, False, False])
+        self.assertIn('password', results[3].errors)
+
+        lookup = lambda i: UserModel._default_manager.get(**{UserModel.USERNAME_FIELD: self.get_row(i)[UserModel.USERNAME_FIELD]})
+        self.assertTrue(lookup(1).check_password('provisioned-password'))
+        self.assertFalse(lookup(2).has_usable_password())
+        self.assertRaises(UserModel.DoesNotExist, lookup, 3)
+
+    def test_should_email_each_chunk_on_one_connection(self):
+        connections = []
+
+        def connection_factory():
+            connections.append(mail.get_connection())
+            return connections[-1]
+
+        sender = TokenEmailSender('visitor-forgot-password', 'reset_password')
+        with override_settings(SKY_VISITOR_COMPILED_EMAILS=True):
+            results = list(provision_users([self.get_row(i) for i in range(3)], chunk_size=2, email_sender=sender,
+                                           connection_factory=connection_factory))
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(len(connections), 2)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['provisioned%d@example.com' % i for i in range(3)])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Run the "normal user" and "custom user" test suites at the same time, sharing the CPUs between them, and print a
+combined summary. Exits non-zero if either suite fails.
+
+    ./runtests.py [--processes=N]
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+EXAMPLE_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_MODULES = ['normal_tests.settings', 'customuser_tests.settings']
+
+
+def run_suite(settings_module, processes, results):
+    env = dict(os.environ, SKY_VISITOR_TEST_PROCESSES=str(processes))
+    start = time.time()
+    process = subprocess.Popen([sys.executable, 'manage.py', 'test', '--noinput', '--settings=%s' % settings_module],
+                               cwd=EXAMPLE_PROJECT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    results[settings_module] = (process.returncode, time.time() - start, output.decode('utf-8', 'replace'))
+
+
+def main():
+    parser = OptionParser(usage="%prog [--processes=N]")
+    parser.add_option('--processes', dest='processes', type='int', default=multiprocessing.cpu_count(),
+                      help="Total worker processes, split between the settings modules.")
+    options, args = parser.parse_args()
+    per_suite = max(1, options.processes // len(SETTINGS_MODULES))
+
+    start = time.time()
+    results = {}
+    threads = [threading.Thread(target=run_suite, args=(s, per_suite, results)) for s in SETTINGS_MODULES]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = False
+    for settings_module in SETTINGS_MODULES:
+        returncode, seconds, output = results[settings_module]
+        failed = failed or returncode != 0
+        sys.stdout.write("==== %s ====\n%s\n" % (settings_module, output))
+    for settings_module in SETTINGS_MODULES:
+        returncode, seconds, output = results[settings_module]
+        sys.stdout.write("%-28s %-6s %.2fs\n" % (settings_module, 'FAILED' if returncode else 'OK', seconds))
+    sys.stdout.write("%-28s %-6s %.2fs wall, %d processes per suite\n" % ('total', 'FAILED' if failed else 'OK', time.time() - start, per_suite))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.datastructures import SortedDict
+from sky_visitor import stats
+from sky_visitor.emails import TokenEmailSender
+from sky_visitor.models import InvitedUser, InvitationCampaign, InvitationLink
+from sky_visitor.utils import approximate_count, queryset_chunks
+from sky_visitor.views import InvitationStartView
+
+AFTER_VAR = 'after'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Reports the database's row estimate instead of running `COUNT(*)` once a table has at least `estimate_threshold`
+    rows. See `sky_visitor.utils.estimate_count`.
+    """
+    estimate_threshold = 10000
+
+    def _get_count(self):
+        if self._count is None:
+            self._count = approximate_count(self.object_list, self.estimate_threshold)
+        return self._count
+    count = property(_get_count)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    A changelist that pages with `?after=<pk>` (newest first) instead of page numbers, and searches with
+    case-sensitive prefix matches that can use the index on each search field.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = None
+        if AFTER_VAR in request.GET:
+            request.GET = request.GET.copy()
+            after = request.GET.pop(AFTER_VAR)[-1]
+            try:
+                self.after = args[0]._meta.pk.to_python(after)
+            except ValidationError:
+                pass
+        super(KeysetChangeList, self).__init__(request, *args, **kwargs)
+
+    def get_query_set(self, request):
+        # Keep ChangeList from applying its own case-insensitive search, which can't use an index
+        query, self.query = self.query, ''
+        try:
+            queryset = super(KeysetChangeList, self).get_query_set(request)
+        finally:
+            self.query = query
+        query = query.strip()
+        if query:
+            lookup = Q()
+            for field_name in self.search_fields:
+                field_name = field_name.lstrip('^')
+                lookup |= Q(**{'%s__startswith' % field_name: query})
+                lookup |= Q(**{'%s__startswith' % field_name: query.lower()})
+            queryset = queryset.filter(lookup)
+        return queryset
+
+    def get_ordering(self, request, queryset):
+        return ['-pk']
+
+    def get_ordering_field_columns(self):
+        return SortedDict()
+
+    def get_results(self, request):
+        queryset = self.query_set
+        if self.after is not None:
+            queryset = queryset.filter(pk__lt=self.after)
+        results = list(queryset[:self.list_per_page + 1])
+        self.result_list = results[:self.list_per_page]
+        self.next_after = self.result_list[-1].pk if len(results) > self.list_per_page else None
+
+        self.paginator = self.model_admin.get_paginator(request, self.query_set, self.list_per_page)
+        self.result_count = self.paginator.count
+        if not self.query_set.query.where:
+            self.full_result_count = self.result_count
+        else:
+            self.full_result_count = self.model_admin.get_paginator(request, self.root_query_set, self.list_per_page).count
+        self.can_show_all = False
+        self.multi_page = False
+
+    @property
+    def next_page_url(self):
+        if self.next_after is None:
+            return None
+        return self.get_query_string({AFTER_VAR: self.next_after})
+
+    @property
+    def first_page_url(self):
+        if self.after is None:
+            return None
+        return self.get_query_string()
+
+
+def resend_invitations(modeladmin, request, queryset):
+    sender = TokenEmailSender(InvitationStartView.email_template, InvitationStartView.token_view_name, request=request)
+    sent = 0
+    for chunk in queryset_chunks(queryset.filter(status=InvitedUser.STATUS_INVITED), modeladmin.action_chunk_size):
+        for invited_user in chunk:
+            if sender.send_email(invited_user) is not False:
+                sent += 1
+    modeladmin.message_user(request, "Resent %d invitations." % sent)
+resend_invitations.short_description = "Resend selected invitations"
+
+
+def expire_invitations(modeladmin, request, queryset):
+    queryset = queryset.filter(status=InvitedUser.STATUS_INVITED).only('pk')
+    expired = 0
+    for chunk in queryset_chunks(queryset, modeladmin.action_chunk_size):
+        count = InvitedUser._default_manager.filter(pk__in=[i.pk for i in chunk], status=InvitedUser.STATUS_INVITED).update(status=InvitedUser.STATUS_EXPIRED)
+        stats.record_expired(count)
+        expired += count
+    modeladmin.message_user(request, "Expired %d invitations." % expired)
+expire_invitations.short_description = "Expire selected invitations"
+
+
+class InvitedUserAdmin(admin.ModelAdmin):
+    """
+    Usable on tables with millions of invitations: counts are estimated above
+    `EstimatedCountPaginator.estimate_threshold` rows, pages are fetched with keyset pagination, search is an indexed
+    prefix match on email and bulk actions work through the selection `action_chunk_size` rows at a time.
+    """
+    list_display = ('email', 'status', 'date_invited')
+    list_filter = ('status',)
+    search_fields = ('^email',)
+    paginator = EstimatedCountPaginator
+    actions = [resend_invitations, expire_invitations]
+    action_chunk_size = 500
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+admin.site.register(InvitedUser, InvitedUserAdmin)
+
+
+class InvitationCampaignAdmin(admin.ModelAdmin):
+    list_display = ('name', 'is_active', 'reminder_delay', 'max_reminders', 'created')
+    list_filter = ('is_active',)
+
+admin.site.register(InvitationCampaign, InvitationCampaignAdmin)
+
+
+class InvitationLinkAdmin(admin.ModelAdmin):
+    list_display = ('name', 'code', 'seats', 'used', 'is_active', 'expires_at', 'created')
+    list_filter = ('is_active',)
+    readonly_fields = ('used',)
+
+admin.site.register(InvitationLink, InvitationLinkAdmin)
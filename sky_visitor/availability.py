@@ -0,0 +1,163 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models.signals import post_save
+from sky_visitor.bloom import BloomFilter
+from sky_visitor.db import get_read_database
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+class AvailabilityIndex(object):
+    """
+    Per-process Bloom filter of taken usernames and normalized emails.
+
+    A miss in the filter means the value is definitely not taken (as of the last rebuild), so it is answered without a
+    query. A hit may be a false positive and falls through to an indexed lookup. The filter is rebuilt from the
+    database on a background thread every `SKY_VISITOR_AVAILABILITY_REBUILD_SECONDS`; until the first build finishes,
+    every check is a query. It is also updated as users are saved in this process. Users created by other processes
+    are picked up at the next rebuild, so answers are advisory: registration still does its own uniqueness checks.
+    """
+    chunk_size = 5000
+
+    def __init__(self):
+        self._filter = None
+        self._building = None
+        self._started_at = 0
+        self._rebuild_lock = threading.Lock()
+
+    @property
+    def rebuild_interval(self):
+        return getattr(settings, 'SKY_VISITOR_AVAILABILITY_REBUILD_SECONDS', 3600)
+
+    @property
+    def error_rate(self):
+        return getattr(settings, 'SKY_VISITOR_AVAILABILITY_ERROR_RATE', 0.01)
+
+    def _keys(self, username=None, email=None):
+        if username:
+            yield 'u:%s' % username
+        if email:
+            yield 'e:%s' % normalize_email(email)
+
+    def rebuild(self):
+        """
+        Stream every user's username and email into a new filter, in primary key order, without loading whole model
+        instances. The old filter keeps answering until the new one is swapped in.
+        """
+        UserModel = get_user_model()
+        username_field = UserModel.USERNAME_FIELD
+        has_email = 'email' in [f.name for f in UserModel._meta.fields]
+        fields = ['pk', username_field] + (['email'] if has_email and username_field != 'email' else [])
+        queryset = UserModel._default_manager.using(get_read_database(UserModel)).order_by('pk')
+
+        started_at = time.time()
+        bloom = BloomFilter(queryset.count() * 1.25 + 1000, self.error_rate)
+        self._building = bloom
+        try:
+            last_pk = None
+            while True:
+                chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+                rows = list(chunk.values_list(*fields)[:self.chunk_size])
+                if not rows:
+                    break
+                for row in rows:
+                    username = row[1]
+                    email = row[2] if len(row) > 2 else (username if username_field == 'email' else None)
+                    for key in self._keys(username, email):
+                        bloom.add(key)
+                last_pk = rows[-1][0]
+        finally:
+            self._building = None
+        self._filter = bloom
+        self._started_at = max(self._started_at, started_at)
+        return bloom
+
+    def get_filter(self):
+        """
+        Return the current filter, or None if the first one hasn't been built yet. Starts a rebuild when the filter is
+        missing or stale, but never waits for it.
+        """
+        if time.time() - self._started_at > self.rebuild_interval:
+            self.start_rebuild()
+        return self._filter
+
+    def start_rebuild(self):
+        """
+        Rebuild on a background thread, unless a rebuild is already running. Call this at startup to warm the filter
+        before the first request.
+        """
+        if not self._rebuild_lock.acquire(False):
+            return
+        self._started_at = time.time()
+        thread = threading.Thread(target=self._run_rebuild, name='sky_visitor-availability')
+        thread.daemon = True
+        thread.start()
+
+    def _run_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Rebuilding the availability index failed")
+        finally:
+            self._rebuild_lock.release()
+            for connection in connections.all():
+                connection.close()
+
+    def add_user(self, user):
+        UserModel = type(user)
+        username = getattr(user, UserModel.USERNAME_FIELD, None)
+        email = getattr(user, 'email', None)
+        for bloom in (self._filter, self._building):
+            if bloom is not None:
+                for key in self._keys(username, email):
+                    bloom.add(key)
+
+    def is_username_available(self, username):
+        bloom = self.get_filter()
+        if bloom is not None and 'u:%s' % username not in bloom:
+            return True
+        UserModel = get_user_model()
+        queryset = UserModel._default_manager.using(get_read_database(UserModel))
+        return not queryset.filter(**{UserModel.USERNAME_FIELD: username}).exists()
+
+    def is_email_available(self, email):
+        email = normalize_email(email)
+        bloom = self.get_filter()
+        if bloom is not None and 'e:%s' % email not in bloom:
+            return True
+        UserModel = get_user_model()
+        queryset = UserModel._default_manager.using(get_read_database(UserModel))
+        return not queryset.filter(email__iexact=email).exists()
+
+
+availability_index = AvailabilityIndex()
+
+
+def update_availability_index(sender, instance, **kwargs):
+    if availability_index._filter is None and availability_index._building is None:
+        return
+    if sender is get_user_model():
+        availability_index.add_user(instance)
+post_save.connect(update_availability_index, dispatch_uid='sky_visitor.availability')
@@ -11,7 +11,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from django.contrib.auth import login, backends
+from django.contrib.auth import get_user_model, backends
+from django.contrib.auth.hashers import check_password, make_password
+from django.db.models import Q
+from sky_visitor.rehash import schedule_rehash
+from sky_visitor.signed_sessions import AUTO_LOGIN_BACKEND, login
 
 
 # Reference: http://groups.google.com/group/django-users/browse_thread/thread/39488db1864c595f
@@ -19,9 +23,88 @@ def auto_login(request, user):
     """
     Allows you to fake a login in your code
     """
-    user.backend = 'sky_visitor.backends.BaseBackend'
+    user.backend = AUTO_LOGIN_BACKEND
     login(request, user)
 
 
 class BaseBackend(backends.ModelBackend):
     pass
+
+
+class DeferredRehashBackend(BaseBackend):
+    """
+    Same as `ModelBackend`, but when a correct password is stored with an outdated hasher, the upgrade is done after
+    the response instead of inside the login request. Login latency stays flat while hashers are migrated.
+
+    Usage:
+        AUTHENTICATION_BACKENDS = ['sky_visitor.backends.DeferredRehashBackend']
+    """
+
+    def authenticate(self, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            return None
+        if check_password(password, user.password, lambda raw_password: schedule_rehash(user, raw_password)):
+            return user
+
+
+class EmailOrUsernameBackend(BaseBackend):
+    """
+    Accepts either the username (`USERNAME_FIELD`) or the email address in the login form's username field, resolved
+    with a single query. If the identifier matches a username, that user wins. Otherwise it must match exactly one
+    email address.
+
+    Email addresses are compared with `email_lookup`. The default, 'iexact', works with mixed-case stored addresses,
+    but an ordinary index on the email column can't serve it: it requires an index on `UPPER(email)` on PostgreSQL
+    (`./manage.py index_advisor` prints one), and no index can serve it on SQLite. If you store addresses lowercased,
+    set `email_lookup` to 'exact' so the lookup can use a plain index.
+
+    When no user matches, a throwaway password hash is still computed, so response times don't reveal which
+    identifiers exist.
+    """
+    email_lookup = 'iexact'
+
+    def normalize_identifier(self, identifier):
+        return identifier.strip()
+
+    def get_users(self, identifier):
+        UserModel = get_user_model()
+        username_field = UserModel.USERNAME_FIELD
+        email = identifier.lower() if self.email_lookup == 'exact' else identifier
+        email_lookup = Q(**{'email__%s' % self.email_lookup: email})
+        if username_field == 'email':
+            lookup = email_lookup
+        elif '@' in identifier:
+            lookup = Q(**{username_field: identifier}) | email_lookup
+        else:
+            lookup = Q(**{username_field: identifier})
+        return list(UserModel._default_manager.filter(lookup))
+
+    def authenticate(self, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if not username:
+            return None
+        identifier = self.normalize_identifier(username)
+
+        user = None
+        users = self.get_users(identifier)
+        for candidate in users:
+            if getattr(candidate, UserModel.USERNAME_FIELD) == identifier:
+                user = candidate
+                break
+        else:
+            if len(users) == 1:
+                user = users[0]
+
+        if user is None:
+            # Take as long as a real password check would
+            make_password(password or '')
+            return None
+        if user.check_password(password):
+            return user
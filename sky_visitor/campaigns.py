@@ -0,0 +1,168 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Invitation campaigns: invite a large list of people without exceeding the mail provider's sending rate.
+
+    from sky_visitor.campaigns import create_campaign
+    create_campaign("Acme onboarding", emails, reminder_delay=3 * 24 * 60 * 60, max_reminders=1)
+
+Then run `./manage.py run_invitation_campaigns` (from cron, or with `--forever`). Sends are released at
+`SKY_VISITOR_CAMPAIGN_RATE_PER_MINUTE` with some random jitter, and reminders share the same budget. Each invitation's
+progress is saved as soon as its email is sent, so a stopped run picks up where it left off. An invitation that was
+being sent when the process died may be sent twice.
+"""
+import datetime
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.utils import timezone
+from sky_visitor import stats
+from sky_visitor.emails import TokenEmailSender
+from sky_visitor.models import InvitedUser, InvitationCampaign, CampaignInvitation
+from sky_visitor.utils import chunked, queryset_chunks
+from sky_visitor.views import InvitationStartView
+
+
+def get_campaign_rate():
+    return getattr(settings, 'SKY_VISITOR_CAMPAIGN_RATE_PER_MINUTE', 300)
+
+
+def get_campaign_jitter():
+    return getattr(settings, 'SKY_VISITOR_CAMPAIGN_JITTER', 0.2)
+
+
+def create_campaign(name, emails, chunk_size=500, **kwargs):
+    """
+    Create a campaign inviting `emails`. Addresses that already belong to a user are skipped, and addresses that were
+    already invited reuse their existing `InvitedUser`.
+    """
+    UserModel = get_user_model()
+    campaign = InvitationCampaign._default_manager.create(name=name, **kwargs)
+    seen = set()
+    for chunk in chunked(emails, chunk_size):
+        chunk = set(email.strip() for email in chunk) - seen - set([''])
+        seen.update(chunk)
+        chunk = list(chunk)
+        registered = set(UserModel._default_manager.filter(email__in=chunk).values_list('email', flat=True))
+        existing = dict(InvitedUser._default_manager.filter(email__in=chunk).values_list('email', 'pk'))
+        new = [email for email in chunk if email not in registered and email not in existing]
+        InvitedUser._default_manager.bulk_create([InvitedUser(email=email) for email in new])
+        stats.record_sent(len(new))
+        if new:
+            existing.update(InvitedUser._default_manager.filter(email__in=new).values_list('email', 'pk'))
+        CampaignInvitation._default_manager.bulk_create([
+            CampaignInvitation(campaign=campaign, invited_user_id=pk) for email, pk in existing.items()
+            if email not in registered
+        ])
+    return campaign
+
+
+class RateLimiter(object):
+    """
+    Releases one event every `60 / rate_per_minute` seconds, each interval randomly stretched or shrunk by up to
+    `jitter` (a fraction of the interval) so sends don't arrive in a perfectly regular stream.
+    """
+
+    def __init__(self, rate_per_minute, jitter=0.0, clock=time.time, sleep=time.sleep, random=random.random):
+        self.interval = 60.0 / rate_per_minute
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+        self.random = random
+        self.next_at = None
+        self.released_at = None
+
+    def wait(self):
+        now = self.clock()
+        if self.next_at is not None and self.next_at > now:
+            self.sleep(self.next_at - now)
+            now = self.next_at
+        self.released_at = now
+        self.next_at = now + self.interval * (1 + self.jitter * (2 * self.random() - 1))
+
+    def cancel(self):
+        """
+        Hand the slot released by the last `wait()` to the next one, because it wasn't used.
+        """
+        self.next_at = self.released_at
+
+
+class CampaignScheduler(object):
+    """
+    Sends the due emails of every active campaign through one `RateLimiter`: first invitations that haven't been sent
+    yet, then reminders for invitations that are still pending `reminder_delay` seconds after their last send.
+
+    `clock` and `sleep` can be replaced, which the tests use to run a campaign without waiting.
+    """
+    chunk_size = 100
+
+    def __init__(self, rate_per_minute=None, jitter=None, clock=time.time, sleep=time.sleep, email_sender=None):
+        self.clock = clock
+        self.limiter = RateLimiter(rate_per_minute or get_campaign_rate(),
+                                   get_campaign_jitter() if jitter is None else jitter, clock=clock, sleep=sleep)
+        self.email_sender = email_sender or TokenEmailSender(InvitationStartView.email_template,
+                                                             InvitationStartView.token_view_name)
+
+    def now(self):
+        timestamp = self.clock()
+        if settings.USE_TZ:
+            return datetime.datetime.utcfromtimestamp(timestamp).replace(tzinfo=timezone.utc)
+        return datetime.datetime.fromtimestamp(timestamp)
+
+    def get_campaigns(self):
+        return InvitationCampaign._default_manager.filter(is_active=True).order_by('pk')
+
+    def get_pending(self, campaign):
+        return campaign.invitations.filter(invited_user__status=InvitedUser.STATUS_INVITED).select_related('invited_user')
+
+    def get_due_invitations(self, campaign):
+        return self.get_pending(campaign).filter(send_count=0)
+
+    def get_due_reminders(self, campaign):
+        if not campaign.reminder_delay or not campaign.max_reminders:
+            return self.get_pending(campaign).none()
+        cutoff = self.now() - datetime.timedelta(seconds=campaign.reminder_delay)
+        return self.get_pending(campaign).filter(send_count__gte=1, send_count__lte=campaign.max_reminders,
+                                                 last_sent_at__lte=cutoff)
+
+    def send(self, invitation):
+        """
+        Returns False if the email wasn't sent (because a recent one was coalesced, for example). The invitation then
+        stays due and the slot goes to the next email.
+        """
+        self.limiter.wait()
+        if self.email_sender.send_email(invitation.invited_user) is False:
+            self.limiter.cancel()
+            return False
+        CampaignInvitation._default_manager.filter(pk=invitation.pk).update(
+            send_count=F('send_count') + 1, last_sent_at=self.now())
+        return True
+
+    def run(self, limit=None):
+        """
+        Send everything that is due now, or at most `limit` emails. Returns the number sent.
+        """
+        sent = 0
+        for campaign in self.get_campaigns():
+            for queryset in (self.get_due_invitations(campaign), self.get_due_reminders(campaign)):
+                for chunk in queryset_chunks(queryset, self.chunk_size):
+                    for invitation in chunk:
+                        if limit is not None and sent >= limit:
+                            return sent
+                        if self.send(invitation):
+                            sent += 1
+        return sent
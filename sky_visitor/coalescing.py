@@ -0,0 +1,85 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Coalescing of repeated token emails.
+
+With `SKY_VISITOR_EMAIL_COALESCE_SECONDS` set, only the first token email per recipient, account and email template is
+sent in each window; repeats (users mashing "forgot password", for example) are suppressed before a token is generated or
+anything is rendered. The recipient still has the first email, whose link is still valid.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+COUNTER_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def get_coalesce_seconds():
+    return getattr(settings, 'SKY_VISITOR_EMAIL_COALESCE_SECONDS', 0)
+
+
+def _counter_key(flow, name):
+    return 'sky_visitor:emails:%s:%s' % (flow, name)
+
+
+def increment_counter(flow, name):
+    key = _counter_key(flow, name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not set yet. If another process sets it first, add() fails and we count again
+        if not cache.add(key, 1, COUNTER_TIMEOUT):
+            cache.incr(key)
+
+
+def get_email_counters(flows):
+    """
+    Return `{flow: {'sent': n, 'suppressed': n}}` for the given email template names.
+    """
+    keys = dict((_counter_key(flow, name), (flow, name)) for flow in flows for name in ('sent', 'suppressed'))
+    values = cache.get_many(keys.keys())
+    counters = dict((flow, {'sent': 0, 'suppressed': 0}) for flow in flows)
+    for key, value in values.items():
+        flow, name = keys[key]
+        counters[flow][name] = value
+    return counters
+
+
+def _claim_key(flow, recipient, user_pk):
+    digest = hashlib.sha1(('%s:%s' % (user_pk, recipient.strip().lower())).encode('utf-8')).hexdigest()
+    return 'sky_visitor:coalesce:%s:%s' % (flow, digest)
+
+
+def claim_email_send(flow, recipient, seconds=None, user_pk=None):
+    """
+    Return True if an email for `flow` should be sent to `recipient` now, or False if one was already sent within the
+    coalescing window. The claim is a single atomic `cache.add()`, so concurrent requests can't both send. Claims are
+    per account as well as per address, so accounts that share an address each get their own email.
+    """
+    if seconds is None:
+        seconds = get_coalesce_seconds()
+    if not seconds:
+        return True
+    if cache.add(_claim_key(flow, recipient, user_pk), 1, seconds):
+        return True
+    increment_counter(flow, 'suppressed')
+    return False
+
+
+def release_email_send(flow, recipient, user_pk=None):
+    """
+    Give back a claim whose email couldn't be sent, so that a retry isn't suppressed.
+    """
+    cache.delete(_claim_key(flow, recipient, user_pk))
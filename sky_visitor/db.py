@@ -0,0 +1,87 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Read replica support.
+
+List your replica aliases in `settings.SKY_VISITOR_READ_REPLICAS` and Sky Visitor's read-only lookups will be sent to
+them. Add `ReplicaRouter` to `DATABASE_ROUTERS` to route every other read too, and add
+`sky_visitor.middleware.ReplicaPinningMiddleware` so that once a request writes, the rest of that request (and the
+same client's requests for `SKY_VISITOR_REPLICA_PIN_SECONDS` afterwards) reads from the primary.
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_state = threading.local()
+
+
+def get_read_replicas():
+    return getattr(settings, 'SKY_VISITOR_READ_REPLICAS', ())
+
+
+def pin_to_primary():
+    _state.pinned = True
+
+
+def reset_pinning():
+    _state.pinned = False
+    _state.written = False
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+def has_written():
+    return getattr(_state, 'written', False)
+
+
+def get_read_database(model=None, request=None):
+    """
+    Return the database alias a read-only query should use.
+
+    This is the primary if no replicas are configured, if this thread has been pinned to the primary, or if `request`
+    is given and is not a safe method. Pass `request` when the rows read are going to be written in the same request.
+    """
+    replicas = get_read_replicas()
+    if not replicas or is_pinned():
+        return DEFAULT_DB_ALIAS
+    if request is not None and request.method not in SAFE_METHODS:
+        return DEFAULT_DB_ALIAS
+    return random.choice(replicas)
+
+
+class ReplicaRouter(object):
+    """
+    Sends reads to a random replica and writes to the primary. A write pins the current thread to the primary until
+    `reset_pinning()` is called, which `ReplicaPinningMiddleware` does at the start of every request.
+    """
+
+    def db_for_read(self, model, **hints):
+        return get_read_database(model)
+
+    def db_for_write(self, model, **hints):
+        _state.written = True
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_syncdb(self, db, model):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,292 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Background delivery of token emails.
+
+With `SKY_VISITOR_EMAIL_DELIVERY = 'background'`, `SendTokenEmailMixin.send_email` renders the message in the request
+and hands it to a small pool of threads to send, so the request doesn't wait on the mail server:
+
+    SKY_VISITOR_EMAIL_THREADS = 2        # Threads sending mail, each with its own open mail connection
+    SKY_VISITOR_EMAIL_QUEUE_SIZE = 100   # Messages waiting to be sent. When full, messages are sent in the request
+    SKY_VISITOR_EMAIL_SHUTDOWN_TIMEOUT = 10  # Seconds to keep sending queued messages when the process exits
+
+Only compiled emails (see `sky_visitor.rendering`) are sent on the threads' connections; `emailtemplates` opens a
+connection per message, so without compiled emails background delivery only takes the sending out of the request.
+`on_sent` and `on_failed` callbacks run once a message has actually been sent or has failed, wherever that happens.
+Messages still in the queue when the process is killed are lost, so this doesn't replace a real outbox.
+`get_delivery_metrics()` reports the queue depth, counts and send latency.
+"""
+import atexit
+import logging
+import smtplib
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Errors after which a message is retried on a new connection. Anything else may have come after the message was
+# accepted, so retrying could send it twice
+RETRY_ERRORS = (smtplib.SMTPServerDisconnected, socket.error)
+
+
+def use_background_delivery():
+    return getattr(settings, 'SKY_VISITOR_EMAIL_DELIVERY', 'sync') == 'background'
+
+
+def _call_now(func, on_sent=None, on_failed=None):
+    try:
+        result = func(None)
+    except Exception:
+        if on_failed is not None:
+            on_failed()
+        raise
+    if on_sent is not None:
+        on_sent()
+    return result
+
+
+class EmailDeliveryPool(object):
+    """
+    Threads that send queued `EmailMessage`s (or run queued send functions) in the order they were submitted.
+
+    Each thread opens one connection from `connection_factory` when it first needs one and keeps it open between
+    messages. If the server has dropped the connection (see `RETRY_ERRORS`), the thread reconnects and tries the message
+    once more.
+    """
+
+    def __init__(self, threads=None, queue_size=None, connection_factory=get_connection):
+        if threads is None:
+            threads = getattr(settings, 'SKY_VISITOR_EMAIL_THREADS', 2)
+        if queue_size is None:
+            queue_size = getattr(settings, 'SKY_VISITOR_EMAIL_QUEUE_SIZE', 100)
+        self.thread_count = threads
+        self.queue_size = queue_size
+        self.connection_factory = connection_factory
+        self.queue = queue.Queue(queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.counts = {'queued': 0, 'sent': 0, 'failed': 0, 'sent_synchronously': 0}
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.threads or self.closed:
+                return
+            for i in range(self.thread_count):
+                thread = threading.Thread(target=self._worker, name='sky_visitor-email-%d' % i)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, message, on_sent=None, on_failed=None):
+        """
+        Queue `message` to be sent. If the queue is full (or the pool has shut down), send it now instead.
+        """
+        return self.submit_call(lambda connection: self._send_message(message, connection), on_sent=on_sent,
+                                on_failed=on_failed)
+
+    def submit_call(self, func, needs_connection=True, on_sent=None, on_failed=None):
+        """
+        Queue `func(connection)`, which should send one email on `connection`. With `needs_connection=False`, `func`
+        sends on its own and is called with None. If the queue is full, `func(None)` is called now instead.
+
+        `on_sent()` is called once `func` has succeeded and `on_failed()` once it has failed for good, on the thread
+        that called it.
+        """
+        self.start()
+        if not self.closed:
+            try:
+                self.queue.put_nowait((time.time(), func, needs_connection, on_sent, on_failed))
+            except queue.Full:
+                pass
+            else:
+                self._count('queued')
+                return True
+        self._count('sent_synchronously')
+        return _call_now(func, on_sent, on_failed)
+
+    def flush(self):
+        """
+        Block until every queued message has been sent.
+        """
+        self.queue.join()
+
+    def shutdown(self, timeout=None):
+        """
+        Send what's queued, waiting up to `timeout` seconds, and stop the threads. Later messages are sent synchronously.
+        """
+        if timeout is None:
+            timeout = getattr(settings, 'SKY_VISITOR_EMAIL_SHUTDOWN_TIMEOUT', 10)
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            threads = self.threads
+        deadline = time.time() + timeout
+        try:
+            for thread in threads:
+                # Waits while the queue is full
+                self.queue.put((None, _STOP, False, None, None), timeout=max(deadline - time.time(), 0.001))
+        except queue.Full:
+            pass
+        for thread in threads:
+            thread.join(max(deadline - time.time(), 0))
+        if any(thread.is_alive() for thread in threads):
+            logger.warning("Email delivery threads didn't finish within %ss; %d messages may not have been sent",
+                           timeout, self.queue.qsize())
+
+    def get_metrics(self):
+        with self.lock:
+            metrics = dict(self.counts)
+            delivered = metrics['sent'] + metrics['failed']
+            metrics.update({
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue_size,
+                'threads': len(self.threads),
+                'latency_ms_avg': self.latency_total * 1000 / delivered if delivered else 0.0,
+                'latency_ms_max': self.latency_max * 1000,
+            })
+        return metrics
+
+    def _count(self, name, latency=None):
+        with self.lock:
+            self.counts[name] += 1
+            if latency is not None:
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+
+    def _send_message(self, message, connection):
+        if connection is not None:
+            message.connection = connection
+        return message.send()
+
+    def _worker(self):
+        connection = None
+        try:
+            while True:
+                queued_at, func, needs_connection, on_sent, on_failed = self.queue.get()
+                try:
+                    if func is _STOP:
+                        return
+                    if not needs_connection:
+                        func(None)
+                    else:
+                        if connection is None:
+                            connection = self._open()
+                        try:
+                            func(connection)
+                        except RETRY_ERRORS:
+                            # The server may have dropped an idle connection. Reconnect and try once more
+                            self._close(connection)
+                            connection = self._open()
+                            func(connection)
+                except Exception:
+                    logger.exception("Background email delivery failed")
+                    self._count('failed', time.time() - queued_at)
+                    connection = self._close(connection)
+                    self._run_callback(on_failed)
+                else:
+                    self._count('sent', time.time() - queued_at)
+                    self._run_callback(on_sent)
+                finally:
+                    self.queue.task_done()
+        finally:
+            self._close(connection)
+
+    def _run_callback(self, callback):
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception:
+            logger.exception("Background email delivery callback failed")
+
+    def _open(self):
+        connection = self.connection_factory()
+        connection.open()
+        return connection
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        return None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_delivery_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EmailDeliveryPool()
+        return _pool
+
+
+def shutdown_delivery_pool(**kwargs):
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+atexit.register(shutdown_delivery_pool)
+
+
+def reset_delivery_pool(**kwargs):
+    if kwargs.get('setting', '').startswith('SKY_VISITOR_EMAIL_') or kwargs.get('setting') == 'EMAIL_BACKEND':
+        shutdown_delivery_pool()
+
+
+def send_message(message, on_sent=None, on_failed=None):
+    """
+    Send `message` now, or queue it if background delivery is on. See `EmailDeliveryPool.submit_call` for the callbacks.
+    """
+    if use_background_delivery():
+        return get_delivery_pool().submit(message, on_sent, on_failed)
+    return _call_now(lambda connection: message.send(), on_sent, on_failed)
+
+
+def send_call(func, needs_connection=True, on_sent=None, on_failed=None):
+    """
+    Call `func(connection)` now with no connection, or queue it if background delivery is on. See
+    `EmailDeliveryPool.submit_call`.
+    """
+    if use_background_delivery():
+        return get_delivery_pool().submit_call(func, needs_connection, on_sent, on_failed)
+    return _call_now(func, on_sent, on_failed)
+
+
+def get_delivery_metrics():
+    """
+    `{'queue_depth', 'queue_size', 'threads', 'queued', 'sent', 'failed', 'sent_synchronously', 'latency_ms_avg',
+    'latency_ms_max'}` for the background pool. Latency is from queueing a message until it has been sent.
+    """
+    return get_delivery_pool().get_metrics()
@@ -0,0 +1,31 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from sky_visitor.views.mixins import SendTokenEmailMixin
+
+
+class TokenEmailSender(SendTokenEmailMixin):
+    """
+    Sends the same token emails as the views, from code that has no view (management commands, bulk jobs). Without a
+    request, links are built from the current Site's domain.
+
+    Usage:
+        sender = TokenEmailSender('visitor-forgot-password', 'reset_password')
+        sender.send_email(user)
+    """
+
+    def __init__(self, email_template, token_view_name, request=None):
+        self.email_template = email_template
+        self.token_view_name = token_view_name
+        if request is not None:
+            self.request = request
@@ -0,0 +1,128 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Streaming CSV export of invitations.
+
+Invitations are read in primary key order, a chunk at a time, as tuples from `values_list()` (joined to the created
+user), and written out as CSV as they are read. Nothing but the current chunk is held in memory, however large the
+table.
+"""
+import csv
+import zlib
+
+from django.contrib.auth import get_user_model
+from sky_visitor.db import get_read_database
+from sky_visitor.models import InvitedUser
+
+
+def get_export_columns():
+    """
+    Return `[(header, values_list lookup)]` for the exported columns.
+    """
+    username_field = get_user_model().USERNAME_FIELD
+    return [
+        ('id', 'pk'),
+        ('email', 'email'),
+        ('status', 'status'),
+        ('date_invited', 'date_invited'),
+        ('date_registered', 'date_registered'),
+        ('created_user_id', 'created_user'),
+        ('created_user_%s' % username_field, 'created_user__%s' % username_field),
+    ]
+
+
+def iter_invitation_rows(chunk_size=2000, using=None):
+    """
+    Yield one tuple per invitation, in primary key order, with the values of `get_export_columns()`.
+    """
+    lookups = [lookup for header, lookup in get_export_columns()]
+    queryset = InvitedUser._default_manager.using(using or get_read_database(InvitedUser)).order_by('pk')
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(page.values_list(*lookups)[:chunk_size])
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_pk = rows[-1][0]
+
+
+class _Buffer(object):
+    """
+    File-like object for `csv.writer` that keeps what was written until it is taken.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, value):
+        self.parts.append(value)
+
+    def take(self):
+        value, self.parts = ''.join(self.parts), []
+        return value
+
+
+def _to_csv(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    if bytes is str and isinstance(value, unicode):  # Python 2's csv module only handles bytes
+        return value.encode('utf-8')
+    return value
+
+
+def iter_csv(rows, headers, rows_per_chunk=500):
+    """
+    Yield the CSV for `headers` and `rows` as bytes, a few hundred rows at a time.
+    """
+    buffer = _Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow([_to_csv(h) for h in headers])
+    count = 0
+    for row in rows:
+        writer.writerow([_to_csv(value) for value in row])
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield _to_bytes(buffer.take())
+    yield _to_bytes(buffer.take())
+
+
+def _to_bytes(value):
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+def iter_gzip(chunks, level=6):
+    """
+    Gzip a stream of byte chunks as it goes.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_invitations(compress=False, chunk_size=2000, using=None):
+    """
+    Yield the invitation export as CSV bytes, gzipped if `compress`.
+    """
+    headers = [header for header, lookup in get_export_columns()]
+    stream = iter_csv(iter_invitation_rows(chunk_size, using), headers)
+    if compress:
+        stream = iter_gzip(stream)
+    return stream
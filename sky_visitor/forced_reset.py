@@ -0,0 +1,185 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Forced password resets, for after a credential leak.
+
+    from sky_visitor.emails import TokenEmailSender
+    from sky_visitor.forced_reset import ForcedPasswordReset
+    reset = ForcedPasswordReset(email_sender=TokenEmailSender('visitor-forgot-password', 'reset_password'))
+    for progress in reset.run(UserModel._default_manager.filter(is_active=True)):
+        print progress.users, progress.emails, progress.last_pk
+    reset.delete_sessions(UserModel)
+
+Users are processed in primary key order, a chunk at a time. Each chunk's passwords are replaced with a single UPDATE,
+and then each user is emailed a reset link. Tokens are made after the password has changed, so the links stay valid
+until the user sets a new password. Passing `progress.last_pk` back as `after_pk` resumes an interrupted run.
+
+Django 1.5 doesn't end a user's sessions when their password changes. Signed sessions are revoked with each chunk;
+`delete_sessions()` then ends `django.contrib.sessions` logins, which is only possible with the `db` and `cached_db`
+session engines.
+"""
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.models import Session
+from django.core.mail import get_connection
+from django.utils import timezone
+from django.utils.importlib import import_module
+from sky_visitor import signed_sessions
+from sky_visitor.rendering import use_compiled_emails
+from sky_visitor.utils import atomic, chunked, queryset_chunks
+
+# Unusable (no hasher has this prefix), but unlike Django's own unusable password it still lets the user request a
+# new reset link from the forgot password form
+FORCED_RESET_PASSWORD = '!sky_visitor-forced-reset'
+
+# Session engines whose sessions are rows in `django_session`, so they can be searched by user
+SEARCHABLE_SESSION_ENGINES = ('django.contrib.sessions.backends.db', 'django.contrib.sessions.backends.cached_db')
+
+
+def is_forced_reset(user):
+    return user.password == FORCED_RESET_PASSWORD
+
+
+class ResetProgress(object):
+
+    def __init__(self):
+        self.users = 0
+        self.emails = 0
+        self.last_pk = None
+
+
+class ForcedPasswordReset(object):
+    """
+    If `email_sender` (for example a `sky_visitor.emails.TokenEmailSender`) is given, each chunk's users are emailed
+    once their passwords have been replaced. With compiled emails, one mail connection is opened per chunk and used for
+    all of that chunk's emails.
+    """
+
+    def __init__(self, chunk_size=500, email_sender=None, connection_factory=get_connection):
+        self.chunk_size = chunk_size
+        self.email_sender = email_sender
+        self.connection_factory = connection_factory
+        if email_sender is not None:
+            # Links in emails sent before the reset no longer work, so every user must get a new one
+            email_sender.email_coalesce_seconds = 0
+
+    def run(self, queryset, after_pk=None, pks=None):
+        """
+        Reset every user in `queryset` with a primary key above `after_pk`, yielding a `ResetProgress` after each chunk.
+        If `pks` is given, only users with those primary keys are reset.
+        """
+        progress = ResetProgress()
+        progress.last_pk = after_pk
+        if after_pk is not None:
+            queryset = queryset.filter(pk__gt=after_pk)
+        for last_pk, users in self.get_chunks(queryset, after_pk, pks):
+            if users:
+                self.reset_passwords(queryset.model, users)
+                progress.users += len(users)
+                if self.email_sender is not None:
+                    progress.emails += self.send_emails(users)
+            progress.last_pk = last_pk
+            yield progress
+
+    def get_chunks(self, queryset, after_pk, pks):
+        """
+        Yield `(last_pk, users)` pairs in primary key order, where `last_pk` is where the next chunk starts.
+        """
+        if pks is None:
+            for users in queryset_chunks(queryset, self.chunk_size):
+                yield users[-1].pk, users
+            return
+        pks = sorted(pk for pk in set(pks) if after_pk is None or pk > after_pk)
+        for chunk_pks in chunked(pks, self.chunk_size):
+            yield chunk_pks[-1], list(queryset.filter(pk__in=chunk_pks).order_by('pk'))
+
+    def reset_passwords(self, UserModel, users):
+        pks = [user.pk for user in users]
+        with atomic():
+            UserModel._default_manager.filter(pk__in=pks).update(password=FORCED_RESET_PASSWORD)
+        if signed_sessions.use_signed_sessions():
+            signed_sessions.revoke_sessions(pks)
+        for user in users:
+            user.password = FORCED_RESET_PASSWORD
+
+    def delete_sessions(self, UserModel):
+        """
+        End the `django.contrib.sessions` logins of users whose password is still the forced reset one, and return how
+        many sessions were deleted. Users who have already set a new password keep their new sessions, so this can run
+        after an interrupted run has been resumed. The session table is read a chunk at a time and each session is
+        decoded, so this takes a while on large sites.
+
+        Returns None, deleting nothing, if `SESSION_ENGINE` isn't one of `SEARCHABLE_SESSION_ENGINES`.
+        """
+        if settings.SESSION_ENGINE not in SEARCHABLE_SESSION_ENGINES:
+            return None
+        store = import_module(settings.SESSION_ENGINE).SessionStore()
+        deleted = 0
+        for sessions in queryset_chunks(Session.objects.filter(expire_date__gt=timezone.now()), self.chunk_size):
+            session_keys = {}
+            for session in sessions:
+                user_pk = session.get_decoded().get(SESSION_KEY)
+                if user_pk is not None:
+                    session_keys.setdefault(user_pk, []).append(session.session_key)
+            reset_pks = UserModel._default_manager.filter(
+                pk__in=list(session_keys), password=FORCED_RESET_PASSWORD).values_list('pk', flat=True)
+            for pk in reset_pks:
+                for session_key in session_keys[pk]:
+                    # Through the session store, so cached_db's cached copy goes too
+                    store.delete(session_key)
+                    deleted += 1
+        return deleted
+
+    def send_emails(self, users):
+        # Only compiled emails can be sent on a connection of our choosing
+        connection = self.connection_factory() if use_compiled_emails() else None
+        if connection is not None:
+            connection.open()
+        self.email_sender.email_connection = connection
+        sent = 0
+        try:
+            for user in users:
+                if self.email_sender.send_email(user) is not False:
+                    sent += 1
+        finally:
+            self.email_sender.email_connection = None
+            if connection is not None:
+                connection.close()
+        return sent
+
+
+def read_checkpoint(path):
+    """
+    Return the last primary key recorded in the checkpoint file at `path`, or None if there is no checkpoint yet.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)['last_pk']
+    except IOError:
+        return None
+
+
+def write_checkpoint(path, progress):
+    """
+    Record `progress` at `path`. The file is replaced in one step, so an interrupted write can't corrupt it.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.checkpoint-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'last_pk': progress.last_pk, 'users': progress.users, 'emails': progress.emails}, f)
+    os.rename(temp_path, path)
@@ -13,13 +13,35 @@
 # limitations under the License.
 from django import forms
 from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth import forms as auth_forms, get_user_model
+from sky_visitor import signed_sessions, stats
+from sky_visitor.forced_reset import is_forced_reset
 from sky_visitor.forms.fields import PasswordRulesField
 from sky_visitor.models import InvitedUser
 
 
-class RegisterForm(auth_forms.UserCreationForm):
+class PasswordRulesFormMixin(object):
+    """
+    Lets the form's `PasswordRulesField` know which user the new password belongs to.
+    """
+    password_rules_field_name = 'new_password1'
+
+    def __init__(self, *args, **kwargs):
+        super(PasswordRulesFormMixin, self).__init__(*args, **kwargs)
+        field = self.fields.get(self.password_rules_field_name)
+        if isinstance(field, PasswordRulesField):
+            field.get_user = self.get_password_rules_user
+
+    def get_password_rules_user(self):
+        return getattr(self, 'user', None)
+
+
+class RegisterForm(PasswordRulesFormMixin, auth_forms.UserCreationForm):
+    password_rules_field_name = 'password1'
+    password1 = PasswordRulesField(label=_("Password"))
 
     class Meta:
         UserModel = get_user_model()
@@ -36,14 +58,23 @@ class RegisterForm(auth_forms.UserCreationForm):
     def clean_username(self):
         # Since User.username is unique, this check is redundant,
         # but it sets a nicer error message than the ORM. See #13147.
+        # Read from the primary: a lagging replica would let a duplicate through to an IntegrityError.
         UserModel = self.Meta.model
         username = self.cleaned_data["username"]
         try:
-            UserModel._default_manager.get(username=username)
+            UserModel._default_manager.using(DEFAULT_DB_ALIAS).get(username=username)
         except UserModel.DoesNotExist:
             return username
         raise forms.ValidationError(self.error_messages['duplicate_username'])
 
+    def get_password_rules_user(self):
+        """
+        The user doesn't exist yet, so build an unsaved one from the fields that have been cleaned so far.
+        """
+        UserModel = self.Meta.model
+        field_names = set(f.name for f in UserModel._meta.fields)
+        return UserModel(**dict((k, v) for k, v in self.cleaned_data.items() if k in field_names))
+
 
 class LoginForm(auth_forms.AuthenticationForm):
     # Note: The username field will always be called 'username' despite what UserModel.USERNAME_FIELD is
@@ -58,12 +89,51 @@ class PasswordResetForm(auth_forms.PasswordResetForm):
         """
         return
 
+    def get_users(self):
+        """
+        Active users with this email address. Copied behavior from django.contrib.auth.forms.PasswordResetForm: users
+        whose password is marked as unusable are skipped, unless it was made unusable by a forced reset.
+
+        Read from the primary, since tokens made from a replica's stale password hash wouldn't check out.
+        """
+        UserModel = get_user_model()
+        active_users = UserModel._default_manager.using(DEFAULT_DB_ALIAS).filter(
+            email__iexact=self.cleaned_data['email'], is_active=True)
+        return [user for user in active_users if user.has_usable_password() or is_forced_reset(user)]
+
+
+class MagicLinkForm(forms.Form):
+    email = forms.EmailField(label=_("Email"), max_length=254)
+
+    def get_users(self):
+        """
+        Active users with this email address. Unlike the forgot password flow, users without a usable password are
+        included, since they don't need one to log in this way.
+
+        Read from the primary, since tokens made from a replica's stale `last_login` wouldn't check out.
+        """
+        UserModel = get_user_model()
+        return UserModel._default_manager.using(DEFAULT_DB_ALIAS).filter(
+            email__iexact=self.cleaned_data['email'], is_active=True)
+
+
+class RevokeSessionsFormMixin(object):
+    """
+    Revokes the user's signed sessions when the new password is saved. See `sky_visitor.signed_sessions`.
+    """
+
+    def save(self, commit=True):
+        user = super(RevokeSessionsFormMixin, self).save(commit)
+        if commit and signed_sessions.use_signed_sessions():
+            signed_sessions.revoke_sessions([user.pk])
+        return user
+
 
-class SetPasswordForm(auth_forms.SetPasswordForm):
+class SetPasswordForm(RevokeSessionsFormMixin, PasswordRulesFormMixin, auth_forms.SetPasswordForm):
     new_password1 = PasswordRulesField(label=_("New password"))
 
 
-class PasswordChangeForm(auth_forms.PasswordChangeForm):
+class PasswordChangeForm(RevokeSessionsFormMixin, PasswordRulesFormMixin, auth_forms.PasswordChangeForm):
     new_password1 = PasswordRulesField(label=_("New password"))
 
 
@@ -76,8 +146,9 @@ class InvitationStartForm(forms.ModelForm):
     def clean_email(self):
         email = self.cleaned_data.get('email')
         # We need to verify that the user being invited doesn't already exist in the normal user table. Unique check is already done automatically for the InvitedUser table.
+        # Read from the primary, which a lagging replica may not have caught up with.
         UserModel = get_user_model()
-        if UserModel._default_manager.filter(email=email).exists():
+        if UserModel._default_manager.using(DEFAULT_DB_ALIAS).filter(email=email).exists():
             raise ValidationError(_("User with this email already exists."))
         return email
 
@@ -85,6 +156,7 @@ class InvitationStartForm(forms.ModelForm):
         user = super(InvitationStartForm, self).save(commit=False)
         if commit:
             user.save()
+            stats.record_sent(when=user.date_invited)
         return user
 
 
@@ -105,9 +177,13 @@ class InvitationCompleteForm(RegisterForm):
 
         def save_invited_user():
             invited_user = self.invited_user
+            was_pending = invited_user.status == InvitedUser.STATUS_INVITED
             invited_user.created_user = user
             invited_user.status = InvitedUser.STATUS_REGISTERED
+            invited_user.date_registered = timezone.now()
             invited_user.save()
+            if was_pending:
+                stats.record_accepted(when=invited_user.date_registered)
         if commit:
             save_invited_user()
         else:
@@ -14,6 +14,7 @@
 
 from django import forms
 from django.forms import widgets
+from sky_visitor import validators
 
 
 class Html5EmailInput(widgets.Input):
@@ -21,9 +22,14 @@ class Html5EmailInput(widgets.Input):
 
 
 class PasswordRulesField(forms.CharField):
-    DEFAULT_MIN_LENGTH = 8
+    """
+    Validates passwords with the rules in `settings.SKY_VISITOR_PASSWORD_RULES`, after a minimum length check.
 
-    # TODO: Add more validators. And move them to validators.py
+    Forms that know which user the password belongs to should set `get_user` to a callable returning that user, so
+    rules such as `UserAttributeSimilarityRule` can use it. See `PasswordRulesFormMixin`.
+    """
+    DEFAULT_MIN_LENGTH = 8
+    get_user = None
 
     def __init__(self, max_length=None, min_length=None, *args, **kwargs):
         if not min_length:
@@ -32,7 +38,11 @@ class PasswordRulesField(forms.CharField):
             kwargs['widget'] = forms.PasswordInput
         super(PasswordRulesField, self).__init__(max_length, min_length, *args, **kwargs)
 
+    def get_pipeline(self):
+        rules = [validators.MinimumLengthRule(self.min_length)] + validators.get_password_rules()
+        return validators.PasswordRulePipeline(rules, timing_hook=validators.get_password_rule_timing_hook())
+
     def clean(self, value):
-        if value is None or len(value) < self.min_length:
-            raise forms.ValidationError("Password must be at least %d characters long." % self.min_length)
+        user = self.get_user() if self.get_user else None
+        self.get_pipeline().validate(value or '', user=user)
         return super(PasswordRulesField, self).clean(value)
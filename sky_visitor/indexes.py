@@ -0,0 +1,141 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Checks that the lookups Sky Visitor makes against the user and invitation tables can use an index. Used by the
+`index_advisor` management command.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import connections, DEFAULT_DB_ALIAS, models
+from django.db.backends.util import truncate_name
+from sky_visitor.models import InvitedUser
+
+
+class IndexCheck(object):
+    """
+    A query Sky Visitor runs, and the single-column index that serves it. `case_insensitive` checks are `iexact`
+    lookups, which need an index on the upper-cased column on PostgreSQL. No index serves them on SQLite.
+    """
+
+    def __init__(self, description, queryset, field_name, case_insensitive=False):
+        self.description = description
+        self.queryset = queryset
+        self.field_name = field_name
+        self.case_insensitive = case_insensitive
+        self.plan = None
+        self.uses_scan = None
+
+    @property
+    def model(self):
+        return self.queryset.model
+
+    def explain(self, using=DEFAULT_DB_ALIAS):
+        connection = connections[using]
+        queryset = self.queryset.using(using)
+        sql, params = queryset.query.get_compiler(using=using).as_sql()
+        self.plan, self.uses_scan = explain(connection, sql, params, queryset.model._meta.db_table)
+        return self.uses_scan
+
+    def get_index_sql(self, using=DEFAULT_DB_ALIAS):
+        """
+        Return the `CREATE INDEX` statement for this lookup, or None if no index can serve it on this database.
+        """
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        table = self.model._meta.db_table
+        column = self.model._meta.get_field(self.field_name).column
+        if self.case_insensitive and connection.vendor == 'postgresql':
+            suffix, expression = 'upper', 'UPPER(%s::text)' % qn(column)
+        elif self.case_insensitive and connection.vendor == 'sqlite':
+            # Django runs iexact as LIKE ... ESCAPE '\', which SQLite answers with a table scan even
+            # with a COLLATE NOCASE index
+            return None
+        else:
+            suffix, expression = 'idx', qn(column)
+        name = truncate_name('%s_%s_%s' % (table, column, suffix), connection.ops.max_name_length())
+        return 'CREATE INDEX %s ON %s (%s);' % (qn(name), qn(table), expression)
+
+
+def explain(connection, sql, params, table):
+    """
+    Return `(plan, uses_scan)`: the backend's query plan as text, and whether it reads all of `table`.
+    """
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        # Small tables are scanned even when an index exists, so make the planner use one if it can
+        cursor.execute("SET enable_seqscan = off")
+        try:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute("RESET enable_seqscan")
+        if not isinstance(plan, list):
+            plan = json.loads(plan)
+        nodes = list(_plan_nodes(plan[0]['Plan']))
+        uses_scan = any(n['Node Type'] == 'Seq Scan' and n.get('Relation Name') == table for n in nodes)
+        return json.dumps(plan, indent=2), uses_scan
+    elif connection.vendor == 'mysql':
+        cursor.execute("EXPLAIN " + sql, params)
+        columns = [c[0] for c in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        uses_scan = any(r['table'] == table and r['type'] == 'ALL' and not r['possible_keys'] for r in rows)
+        return '\n'.join(repr(r) for r in rows), uses_scan
+    elif connection.vendor == 'sqlite':
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        details = [row[-1] for row in cursor.fetchall()]
+        uses_scan = any(d.startswith('SCAN') and 'INDEX' not in d for d in details)
+        return '\n'.join(details), uses_scan
+    raise NotImplementedError("EXPLAIN is not supported on %s." % connection.vendor)
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get('Plans', ()):
+        for n in _plan_nodes(child):
+            yield n
+
+
+def _has_field(model, name):
+    try:
+        model._meta.get_field(name)
+    except models.FieldDoesNotExist:
+        return False
+    return True
+
+
+def get_index_checks():
+    UserModel = get_user_model()
+    users = UserModel._default_manager.all()
+    username_field = UserModel.USERNAME_FIELD
+    checks = []
+    if _has_field(UserModel, 'email'):
+        active = {'is_active': True} if _has_field(UserModel, 'is_active') else {}
+        checks += [
+            IndexCheck("ForgotPasswordView, MagicLinkForm, EmailOrUsernameBackend: email__iexact",
+                       users.filter(email__iexact='someone@example.com', **active), 'email', case_insensitive=True),
+            IndexCheck("InvitationStartForm.clean_email: email", users.filter(email='someone@example.com'), 'email'),
+        ]
+    checks += [
+        IndexCheck("RegisterForm.clean_username: %s" % username_field,
+                   users.filter(**{username_field: 'someone'}), username_field),
+        IndexCheck("TokenValidateMixin: id", users.filter(id=1), UserModel._meta.pk.name),
+        IndexCheck("InvitationCompleteView: InvitedUser id",
+                   InvitedUser._default_manager.filter(id=1, status=InvitedUser.STATUS_INVITED), 'id'),
+        IndexCheck("InvitationStartForm: InvitedUser email",
+                   InvitedUser._default_manager.filter(email='someone@example.com'), 'email'),
+        IndexCheck("InvitedUserAdmin: InvitedUser status",
+                   InvitedUser._default_manager.filter(status=InvitedUser.STATUS_INVITED), 'status'),
+    ]
+    return checks
@@ -0,0 +1,52 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from sky_visitor.validators import BreachedPasswordIndex, build_breached_password_index
+
+
+class Command(BaseCommand):
+    args = '<input_file> <output_file>'
+    help = "Build a memory-mappable breached password index from a plain-text list. Use '-' to read from stdin."
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='input_format', default='sha1', choices=['sha1', 'plain'],
+                    help="Input lines are hex SHA-1 hashes, optionally followed by ':count' (sha1, default) or plain passwords (plain)."),
+        make_option('--prefix-length', dest='prefix_length', type='int', default=BreachedPasswordIndex.DEFAULT_PREFIX_LENGTH,
+                    help="Number of bytes of each SHA-1 digest to store."),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=2000000,
+                    help="Number of entries to sort in memory before spilling a run to disk."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: build_breached_password_index %s" % self.args)
+        input_path, output_path = args
+        if not 1 <= options['prefix_length'] <= 20:
+            raise CommandError("--prefix-length must be between 1 and 20.")
+
+        if input_path == '-':
+            lines = getattr(sys.stdin, 'buffer', sys.stdin)
+            count = self._build(lines, output_path, options)
+        else:
+            with open(input_path, 'rb') as lines:
+                count = self._build(lines, output_path, options)
+        self.stdout.write("Wrote %d entries to %s" % (count, output_path))
+
+    def _build(self, lines, output_path, options):
+        return build_breached_password_index(lines, output_path,
+                                             input_format=options['input_format'],
+                                             prefix_length=options['prefix_length'],
+                                             chunk_size=options['chunk_size'])
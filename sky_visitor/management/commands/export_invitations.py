@@ -0,0 +1,44 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from sky_visitor.export import export_invitations
+
+
+class Command(BaseCommand):
+    args = '[<output_file>]'
+    help = "Write every invitation, with its status, created user and dates, as CSV. Writes to stdout by default."
+    option_list = BaseCommand.option_list + (
+        make_option('--gzip', action='store_true', dest='gzip', default=False,
+                    help="Gzip the output."),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=2000,
+                    help="Invitations read per query."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError("Usage: export_invitations %s" % self.args)
+        stream = export_invitations(compress=options['gzip'], chunk_size=options['chunk_size'])
+        if not args or args[0] == '-':
+            self.write(getattr(sys.stdout, 'buffer', sys.stdout), stream)
+        else:
+            with open(args[0], 'wb') as f:
+                self.write(f, stream)
+
+    def write(self, f, stream):
+        for chunk in stream:
+            f.write(chunk)
+        f.flush()
@@ -0,0 +1,103 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from sky_visitor.emails import TokenEmailSender
+from sky_visitor.forced_reset import ForcedPasswordReset, read_checkpoint, write_checkpoint
+from sky_visitor.utils import chunked
+
+
+class Command(BaseCommand):
+    args = '--all | <identifiers_file>'
+    help = ("Replace the passwords of active users with an unusable one and email each of them a reset link. Pass "
+            "--all for every active user, or a file with one username (the user model's USERNAME_FIELD) per line; "
+            "use '-' to read from stdin. Afterwards, the reset users' logins are ended; with a SESSION_ENGINE other than "
+            "db or cached_db, only signed sessions can be ended.")
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help="Reset every active user."),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=500,
+                    help="Users updated and emailed together."),
+        make_option('--checkpoint', dest='checkpoint', default=None,
+                    help="File recording progress. If it exists, the run resumes where it left off."),
+        make_option('--no-email', action='store_false', dest='send_email', default=True,
+                    help="Only reset passwords."),
+        make_option('--email-template', dest='email_template', default='visitor-forgot-password',
+                    help="Email template of the reset email."),
+        make_option('--token-view-name', dest='token_view_name', default='reset_password',
+                    help="URL name of the view the emailed link points to."),
+    )
+
+    def handle(self, *args, **options):
+        if options['all'] == bool(args) or len(args) > 1:
+            raise CommandError("Usage: force_password_reset %s" % self.args)
+        UserModel = get_user_model()
+        queryset = UserModel._default_manager.filter(is_active=True)
+        pks = None
+        if args:
+            if args[0] == '-':
+                pks = self.get_pks(UserModel, sys.stdin, options['chunk_size'])
+            else:
+                with open(args[0]) as f:
+                    pks = self.get_pks(UserModel, f, options['chunk_size'])
+
+        after_pk = None
+        if options['checkpoint']:
+            after_pk = read_checkpoint(options['checkpoint'])
+            if after_pk is not None:
+                self.stdout.write("Resuming after user %s" % after_pk)
+
+        email_sender = None
+        if options['send_email']:
+            email_sender = TokenEmailSender(options['email_template'], options['token_view_name'])
+        reset = ForcedPasswordReset(chunk_size=options['chunk_size'], email_sender=email_sender)
+        start = time.time()
+        progress = None
+        for progress in reset.run(queryset, after_pk=after_pk, pks=pks):
+            if options['checkpoint']:
+                write_checkpoint(options['checkpoint'], progress)
+            self.report(progress, start)
+        if progress is None:
+            self.stdout.write("No users to reset")
+
+        deleted = reset.delete_sessions(UserModel)
+        if deleted is None:
+            self.stderr.write("Existing logins can't be ended with SESSION_ENGINE = %r. Clear the session store to log "
+                              "reset users out." % settings.SESSION_ENGINE)
+        else:
+            self.stdout.write("%d sessions ended" % deleted)
+
+    def get_pks(self, UserModel, f, chunk_size):
+        username_field = UserModel.USERNAME_FIELD
+        identifiers = (line.strip() for line in f)
+        pks = []
+        total = 0
+        for chunk in chunked((i for i in identifiers if i), chunk_size):
+            chunk_pks = UserModel._default_manager.filter(**{'%s__in' % username_field: chunk}).values_list('pk', flat=True)
+            pks.extend(chunk_pks)
+            total += len(chunk)
+        found = len(pks)
+        if found < total:
+            self.stderr.write("%d of %d users not found" % (total - found, total))
+        return pks
+
+    def report(self, progress, start):
+        elapsed = max(time.time() - start, 0.001)
+        self.stdout.write("%d users reset, %d emails sent, up to user %s, %.1fs (%.0f users/s)"
+                          % (progress.users, progress.emails, progress.last_pk, elapsed, progress.users / elapsed))
@@ -0,0 +1,164 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import random
+import time
+from optparse import make_option
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.utils import timezone
+from sky_visitor.models import InvitedUser
+from sky_visitor.stats import reconcile_invitation_stats
+from sky_visitor.utils import chunked, get_hashing_pool, hash_passwords
+
+
+class Command(BaseCommand):
+    help = "Stream synthetic users and invitations into the database for load testing. Do not run against production."
+    option_list = BaseCommand.option_list + (
+        make_option('--users', dest='users', type='int', default=1000,
+                    help="Number of users to create."),
+        make_option('--invitations', dest='invitations', type='int', default=0,
+                    help="Number of InvitedUser rows to create."),
+        make_option('--prefix', dest='prefix', default='load',
+                    help="Prefix for generated usernames and emails. Use a new prefix to add more data to a database."),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=1000,
+                    help="Rows per bulk_create."),
+        make_option('--password-pool', dest='password_pool', type='int', default=16,
+                    help="Number of distinct passwords to hash and share between users."),
+        make_option('--processes', dest='processes', type='int', default=None,
+                    help="Processes used to hash the password pool. Defaults to the number of CPUs."),
+        make_option('--registered-ratio', dest='registered_ratio', type='float', default=0.5,
+                    help="Fraction of invitations created with status 'registered'."),
+        make_option('--case-varied-emails', dest='case_varied_emails', type='float', default=0.0,
+                    help="Fraction of user emails with randomly varied letter case."),
+        make_option('--duplicate-emails', dest='duplicate_emails', type='float', default=0.0,
+                    help="Fraction of users that reuse an earlier user's email address."),
+        make_option('--seed', dest='seed', type='int', default=None,
+                    help="Random seed, for reproducible data sets."),
+    )
+
+    def handle(self, *args, **options):
+        self.UserModel = get_user_model()
+        self.random = random.Random(options['seed'])
+        self.prefix = options['prefix']
+        self.chunk_size = options['chunk_size']
+
+        email_field = self._get_field('email')
+        if options['duplicate_emails'] and (email_field is None or email_field.unique or self.UserModel.USERNAME_FIELD == 'email'):
+            raise CommandError("--duplicate-emails requires a user model with a non-unique email field.")
+
+        passwords = ['%s-password-%d' % (self.prefix, i) for i in range(max(options['password_pool'], 1))]
+        pool = get_hashing_pool(options['processes'])
+        try:
+            start = time.time()
+            self.password_hashes = hash_passwords(passwords, pool)
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write("Hashed %d passwords in %.2fs. User N has password '%s-password-<N %% %d>'." % (
+            len(passwords), time.time() - start, self.prefix, len(passwords)))
+
+        self._create(self.UserModel, self.generate_users(options), options['users'])
+        self._create(InvitedUser, self.generate_invitations(options), options['invitations'])
+        if options['invitations']:
+            # bulk_create bypasses the invitation counters
+            reconcile_invitation_stats(self.chunk_size)
+
+    def _get_field(self, name):
+        try:
+            return self.UserModel._meta.get_field(name)
+        except models.FieldDoesNotExist:
+            return None
+
+    def _create(self, model, objects, total):
+        if not total:
+            return
+        start = time.time()
+        created = 0
+        for chunk in chunked(objects, self.chunk_size):
+            model._default_manager.bulk_create(chunk)
+            created += len(chunk)
+            elapsed = time.time() - start
+            self.stdout.write("%s: %d/%d (%.0f rows/s)" % (model._meta.object_name, created, total, created / max(elapsed, 0.001)))
+
+    def _vary_case(self, email):
+        return ''.join(c.upper() if self.random.random() < 0.5 else c for c in email)
+
+    def _synthetic_value(self, field, i):
+        if isinstance(field, models.EmailField):
+            return '%s%d@example.com' % (self.prefix, i)
+        if isinstance(field, models.DateTimeField):
+            return timezone.now() - datetime.timedelta(minutes=i)
+        if isinstance(field, models.DateField):
+            return datetime.date(1950, 1, 1) + datetime.timedelta(days=i % 20000)
+        if isinstance(field, (models.IntegerField, models.FloatField, models.DecimalField)):
+            return i
+        if isinstance(field, models.BooleanField):
+            return False
+        if isinstance(field, models.CharField):
+            return ('%s%d' % (self.prefix, i))[-field.max_length:]
+        raise CommandError("Don't know how to generate a value for %s.%s." % (self.UserModel.__name__, field.name))
+
+    def generate_users(self, options):
+        username_field = self.UserModel.USERNAME_FIELD
+        has_email = self._get_field('email') is not None
+        for i in range(options['users']):
+            email = '%s%d@example.com' % (self.prefix, i)
+            if i and self.random.random() < options['duplicate_emails']:
+                email = '%s%d@example.com' % (self.prefix, self.random.randrange(i))
+            if self.random.random() < options['case_varied_emails']:
+                email = self._vary_case(email)
+
+            values = {
+                username_field: email if username_field == 'email' else '%s%d' % (self.prefix, i),
+                'password': self.password_hashes[i % len(self.password_hashes)],
+            }
+            if has_email:
+                values['email'] = email
+            for name in self.UserModel.REQUIRED_FIELDS:
+                if name not in values:
+                    values[name] = self._synthetic_value(self.UserModel._meta.get_field(name), i)
+            yield self.UserModel(**values)
+
+    def _registered_user_ids(self):
+        """
+        Cycle through existing user ids in primary key order, one query per chunk, so registered invitations point at
+        real users without loading every id into memory.
+        """
+        queryset = self.UserModel._default_manager.order_by('pk').values_list('pk', flat=True)
+        last_pk = None
+        while True:
+            page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            ids = list(page[:self.chunk_size])
+            if not ids:
+                if last_pk is None:
+                    raise CommandError("Registered invitations need at least one user to point to.")
+                last_pk = None
+                continue
+            for pk in ids:
+                yield pk
+            last_pk = ids[-1]
+
+    def generate_invitations(self, options):
+        user_ids = None
+        for i in range(options['invitations']):
+            invitation = InvitedUser(email='%s-invitee%d@example.com' % (self.prefix, i))
+            if self.random.random() < options['registered_ratio']:
+                if user_ids is None:
+                    user_ids = self._registered_user_ids()
+                invitation.status = InvitedUser.STATUS_REGISTERED
+                invitation.created_user_id = next(user_ids)
+            yield invitation
@@ -0,0 +1,72 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from sky_visitor.indexes import get_index_checks
+
+
+class Command(BaseCommand):
+    help = ("Run EXPLAIN on the user and invitation lookups Sky Visitor makes, flag the ones that scan the whole "
+            "table and print the indexes that would fix them.")
+    option_list = BaseCommand.option_list + (
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help="Database to EXPLAIN against."),
+        make_option('--show-plans', action='store_true', dest='show_plans', default=False,
+                    help="Print each query plan."),
+    )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        missing = []
+        for check in get_index_checks():
+            try:
+                uses_scan = check.explain(using)
+            except NotImplementedError as e:
+                raise CommandError(str(e))
+            self.stdout.write("%-4s %s" % ('SCAN' if uses_scan else 'ok', check.description))
+            if options['show_plans']:
+                self.stdout.write('\n'.join('     ' + line for line in check.plan.splitlines()))
+            if uses_scan:
+                missing.append(check)
+
+        if not missing:
+            self.stdout.write("\nEvery lookup can use an index.")
+            return
+
+        statements = []
+        unservable = []
+        for check in missing:
+            sql = check.get_index_sql(using)
+            if sql is None:
+                unservable.append(check)
+            elif sql not in statements:
+                statements.append(sql)
+        if unservable:
+            self.stdout.write("\nNo index can serve these lookups on this database:\n")
+            for check in unservable:
+                self.stdout.write("    " + check.description)
+            missing = [check for check in missing if check not in unservable]
+        if not statements:
+            return
+
+        self.stdout.write("\nSQL for the missing indexes:\n")
+        for sql in statements:
+            self.stdout.write("    " + sql)
+        apps = sorted(set(check.model._meta.app_label for check in missing))
+        self.stdout.write("\nOr, in a South migration of the %s app%s:\n" % (', '.join(apps), 's' if len(apps) > 1 else ''))
+        self.stdout.write("    def forwards(self, orm):")
+        for sql in statements:
+            self.stdout.write("        db.execute('%s')" % sql)
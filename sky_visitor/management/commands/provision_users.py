@@ -0,0 +1,85 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import csv
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from sky_visitor.emails import TokenEmailSender
+from sky_visitor.provisioning import UserProvisioner
+from sky_visitor.utils import get_hashing_pool
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class Command(BaseCommand):
+    args = '<csv_file>'
+    help = ("Create users from a CSV file whose header row names user model fields, plus an optional 'password' "
+            "column. Use '-' to read from stdin. Errors are reported per row as they happen.")
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=500,
+                    help="Rows validated, hashed and inserted together."),
+        make_option('--processes', dest='processes', type='int', default=None,
+                    help="Processes used to hash passwords. Defaults to the number of CPUs."),
+        make_option('--send-email', action='store_true', dest='send_email', default=False,
+                    help="Email each created user a link to set their password."),
+        make_option('--email-template', dest='email_template', default='visitor-forgot-password',
+                    help="Email template used with --send-email."),
+        make_option('--token-view-name', dest='token_view_name', default='reset_password',
+                    help="URL name of the view the emailed link points to."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: provision_users %s" % self.args)
+        if args[0] == '-':
+            self.provision(sys.stdin, options)
+        else:
+            with open(args[0], 'rb' if bytes is str else 'r') as f:
+                self.provision(f, options)
+
+    def provision(self, f, options):
+        rows = (dict((_decode(k), _decode(v)) for k, v in row.items()) for row in csv.DictReader(f))
+        email_sender = None
+        if options['send_email']:
+            email_sender = TokenEmailSender(options['email_template'], options['token_view_name'])
+
+        pool = get_hashing_pool(options['processes'])
+        start = time.time()
+        created = failed = 0
+        try:
+            provisioner = UserProvisioner(chunk_size=options['chunk_size'], pool=pool, email_sender=email_sender)
+            for result in provisioner.provision(rows):
+                if result.ok:
+                    created += 1
+                else:
+                    failed += 1
+                    # Header is line 1, so data rows start at line 2
+                    for field_name, messages in sorted(result.errors.items()):
+                        self.stderr.write("line %d: %s: %s" % (result.row_number + 1, field_name, ' '.join(messages)))
+                if (created + failed) % options['chunk_size'] == 0:
+                    self.report(created, failed, start)
+        finally:
+            pool.close()
+            pool.join()
+        self.report(created, failed, start)
+
+    def report(self, created, failed, start):
+        elapsed = max(time.time() - start, 0.001)
+        self.stdout.write("%d created, %d failed, %.1fs (%.0f users/s)" % (created, failed, elapsed, created / elapsed))
@@ -0,0 +1,32 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from sky_visitor.stats import reconcile_invitation_stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the invitation counters from the InvitedUser table, reading it in chunks."
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=5000,
+                    help="Invitations read per query."),
+    )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        stats = reconcile_invitation_stats(options['chunk_size'])
+        self.stdout.write("Reconciled in %.1fs: %s" % (
+            time.time() - start, ', '.join('%s=%d' % (name, stats[name]) for name in sorted(stats))))
@@ -0,0 +1,45 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from sky_visitor.campaigns import CampaignScheduler
+
+
+class Command(BaseCommand):
+    help = ("Send the due invitations and reminders of active invitation campaigns at a limited rate. Safe to stop "
+            "and restart at any time.")
+    option_list = BaseCommand.option_list + (
+        make_option('--rate', dest='rate', type='int', default=None,
+                    help="Emails per minute. Defaults to settings.SKY_VISITOR_CAMPAIGN_RATE_PER_MINUTE."),
+        make_option('--jitter', dest='jitter', type='float', default=None,
+                    help="Random variation of each interval, as a fraction of it. Defaults to settings.SKY_VISITOR_CAMPAIGN_JITTER."),
+        make_option('--limit', dest='limit', type='int', default=None,
+                    help="Send at most this many emails, then stop."),
+        make_option('--forever', action='store_true', dest='forever', default=False,
+                    help="Keep running, checking for due emails every --poll-interval seconds."),
+        make_option('--poll-interval', dest='poll_interval', type='int', default=60,
+                    help="Seconds to wait between checks with --forever."),
+    )
+
+    def handle(self, *args, **options):
+        scheduler = CampaignScheduler(rate_per_minute=options['rate'], jitter=options['jitter'])
+        while True:
+            start = time.time()
+            sent = scheduler.run(limit=options['limit'])
+            self.stdout.write("Sent %d emails in %.1fs." % (sent, time.time() - start))
+            if not options['forever']:
+                break
+            time.sleep(options['poll_interval'])
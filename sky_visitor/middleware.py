@@ -0,0 +1,111 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from sky_visitor import db, signed_sessions
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Keeps read-after-write sequences on the primary database.
+
+    Pinning is reset at the start of each request. If the request writes, a short-lived cookie is set so the same
+    client's next few requests (for example the page it is redirected to after registering) also read from the
+    primary instead of a replica that may not have caught up yet.
+
+    Place this before `SessionMiddleware` so that session writes are seen when the response is processed.
+    """
+    cookie_name = 'sky_visitor_pin'
+
+    def process_request(self, request):
+        db.reset_pinning()
+        if self.cookie_name in request.COOKIES:
+            db.pin_to_primary()
+
+    def process_response(self, request, response):
+        if db.has_written():
+            pin_seconds = getattr(settings, 'SKY_VISITOR_REPLICA_PIN_SECONDS', 15)
+            response.set_cookie(self.cookie_name, '1', max_age=pin_seconds, httponly=True)
+        db.reset_pinning()
+        return response
+
+
+class SignedSessionMiddleware(object):
+    """
+    Use in place of `django.contrib.auth.middleware.AuthenticationMiddleware` with `SKY_VISITOR_SIGNED_SESSIONS = True`.
+    `request.user` comes from sky_visitor's signed session cookie, which is set on login and deleted on logout. See
+    `sky_visitor.signed_sessions`.
+    """
+
+    def process_request(self, request):
+        request.user = SimpleLazyObject(lambda: self.get_user(request))
+
+    def get_user(self, request):
+        if not hasattr(request, '_cached_user'):
+            request._cached_user = signed_sessions.get_user(request)
+        return request._cached_user
+
+    def process_response(self, request, response):
+        signed_sessions.set_cookie(request, response)
+        return response
+
+
+class TrafficRecorderMiddleware(object):
+    """
+    Logs the shape of each request to a sky_visitor URL to the `sky_visitor.traffic` logger, one JSON object per line:
+    URL name, method, which form and query fields were sent (never their values), whether the URL's token was valid,
+    whether the user was logged in before the view ran, the response status and the time taken.
+    `python -m benchmarks.replay` replays such a log.
+
+    Place it first in `MIDDLEWARE_CLASSES` so the timing covers the other middleware. Set
+    `SKY_VISITOR_TRAFFIC_SAMPLE_RATE` (default 1.0) to record only a fraction of requests.
+    """
+    logger = logging.getLogger('sky_visitor.traffic')
+    ignored_fields = frozenset(['csrfmiddlewaretoken'])
+
+    def __init__(self):
+        from sky_visitor.urls import urlpatterns
+        self.url_names = frozenset(pattern.name for pattern in urlpatterns if getattr(pattern, 'name', None))
+
+    def process_request(self, request):
+        if random.random() < getattr(settings, 'SKY_VISITOR_TRAFFIC_SAMPLE_RATE', 1.0):
+            request._sky_visitor_traffic_start = time.time()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Before the view, which may log the user in or out
+        if hasattr(request, '_sky_visitor_traffic_start') and hasattr(request, 'user'):
+            request._sky_visitor_traffic_authenticated = request.user.is_authenticated()
+
+    def process_response(self, request, response):
+        start = getattr(request, '_sky_visitor_traffic_start', None)
+        resolver_match = getattr(request, 'resolver_match', None)
+        if start is None or resolver_match is None or resolver_match.url_name not in self.url_names:
+            return response
+        record = {
+            'route': resolver_match.url_name,
+            'method': request.method,
+            'get': sorted(set(request.GET) - self.ignored_fields),
+            'post': sorted(set(request.POST) - self.ignored_fields) if request.method == 'POST' else [],
+            'token_valid': getattr(request, '_sky_visitor_token_valid', None),
+            'authenticated': getattr(request, '_sky_visitor_traffic_authenticated', False),
+            'status': response.status_code,
+            'ms': round((time.time() - start) * 1000, 2),
+        }
+        self.logger.info(json.dumps(record, sort_keys=True))
+        return response
@@ -14,18 +14,24 @@
 import datetime
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
+from django.utils.crypto import get_random_string
 
 
 class InvitedUser(models.Model):
     STATUS_INVITED = 'invited'
     STATUS_REGISTERED = 'registered'
+    STATUS_EXPIRED = 'expired'
     STATUS_CHOICES = (
         (STATUS_INVITED, "Invited"),
         (STATUS_REGISTERED, "Registered"),
+        (STATUS_EXPIRED, "Expired"),
     )
     email = models.EmailField(max_length=254, unique=True)
-    status = models.CharField(max_length=32, default=STATUS_INVITED, choices=STATUS_CHOICES)
+    status = models.CharField(max_length=32, default=STATUS_INVITED, choices=STATUS_CHOICES, db_index=True)
     created_user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True)
+    date_invited = models.DateTimeField(default=timezone.now, blank=True, null=True)
+    date_registered = models.DateTimeField(blank=True, null=True)
 
     # We need to fake a few properties so we can use the default token generation code
     @property
@@ -38,3 +44,101 @@ class InvitedUser(models.Model):
     @property
     def password(self):
         return ''
+
+
+def generate_invitation_link_code():
+    return get_random_string(24)
+
+
+class InvitationLink(models.Model):
+    """
+    One link that `seats` people can use to register. Share `get_absolute_url()` instead of inviting each person.
+    """
+    name = models.CharField(max_length=200, blank=True)
+    code = models.CharField(max_length=32, unique=True, default=generate_invitation_link_code)
+    seats = models.PositiveIntegerField()
+    used = models.PositiveIntegerField(default=0)
+    is_active = models.BooleanField(default=True)
+    expires_at = models.DateTimeField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return self.name or self.code
+
+    @models.permalink
+    def get_absolute_url(self):
+        return ('invitation_link', (), {'code': self.code})
+
+    @property
+    def seats_left(self):
+        return max(self.seats - self.used, 0)
+
+    def is_usable(self):
+        return self.is_active and self.seats_left > 0 and (self.expires_at is None or self.expires_at > timezone.now())
+
+    def claim_seat(self):
+        """
+        Take a seat, unless they're all used or the link has been deactivated or has expired. This is a single
+        conditional UPDATE, so concurrent claims never oversell and don't wait on each other's transactions.
+        """
+        now = timezone.now()
+        claimed = InvitationLink.objects.filter(
+            models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=now),
+            pk=self.pk, is_active=True, used__lt=models.F('seats'),
+        ).update(used=models.F('used') + 1)
+        if claimed:
+            self.used += 1
+        return bool(claimed)
+
+    def release_seat(self):
+        """
+        Give back a seat claimed by a registration that then failed.
+        """
+        if InvitationLink.objects.filter(pk=self.pk, used__gt=0).update(used=models.F('used') - 1):
+            self.used -= 1
+
+
+class InvitationCounter(models.Model):
+    """
+    Running invitation totals, maintained by `sky_visitor.stats`. `period` is '' for all time or a day as YYYY-MM-DD.
+    """
+    name = models.CharField(max_length=32)
+    period = models.CharField(max_length=10, blank=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('name', 'period')
+
+
+class InvitationCampaign(models.Model):
+    """
+    A batch of invitations sent gradually by the `run_invitation_campaigns` command. See `sky_visitor.campaigns`.
+    """
+    name = models.CharField(max_length=200)
+    is_active = models.BooleanField(default=True)
+    reminder_delay = models.PositiveIntegerField(default=0, help_text="Seconds after the last send before a pending invitation is reminded. 0 disables reminders.")
+    max_reminders = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return self.name
+
+
+class CampaignInvitation(models.Model):
+    campaign = models.ForeignKey(InvitationCampaign, related_name='invitations')
+    invited_user = models.ForeignKey(InvitedUser)
+    # Progress checkpoint: updated right after each send
+    send_count = models.PositiveIntegerField(default=0, db_index=True)
+    last_sent_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    class Meta:
+        unique_together = ('campaign', 'invited_user')
+
+
+class SessionVersion(models.Model):
+    """
+    Signed session cookies carry the user's version from when they were issued. Bumping it (on logout or a password
+    change) revokes every cookie issued before. Users without a row are at version 0. See `sky_visitor.signed_sessions`.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True, related_name='+')
+    version = models.PositiveIntegerField(default=0)
@@ -0,0 +1,175 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Bulk user provisioning.
+
+    from sky_visitor.provisioning import provision_users
+    for result in provision_users(rows):
+        if not result.ok:
+            print result.row_number, result.errors
+
+Rows are dicts keyed by user model field name. A row may include a 'password'; rows without one get an unusable
+password (pair them with a reset email so the user can choose one).
+"""
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.mail import get_connection
+from django.db import IntegrityError, models
+from sky_visitor import validators
+from sky_visitor.rendering import use_compiled_emails
+from sky_visitor.utils import atomic, chunked, hash_passwords
+
+
+class ProvisioningResult(object):
+
+    def __init__(self, row_number, row):
+        self.row_number = row_number
+        self.row = row
+        self.user = None
+        self.password = None
+        self.errors = {}
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def add_error(self, field_name, messages):
+        self.errors.setdefault(field_name, []).extend(messages)
+
+
+class UserProvisioner(object):
+    """
+    Validates, hashes and inserts users a chunk at a time.
+
+    Each chunk is validated in memory plus one query per unique field, its passwords are hashed across `pool` (see
+    `sky_visitor.utils.get_hashing_pool`) and it is inserted with a single `bulk_create`. If `email_sender` (for example
+    a `sky_visitor.emails.TokenEmailSender`) is given, the chunk's users are emailed once it has been committed. With
+    compiled emails, one mail connection is opened per chunk and used for all of that chunk's emails.
+    """
+
+    def __init__(self, chunk_size=500, pool=None, email_sender=None, connection_factory=get_connection):
+        self.UserModel = get_user_model()
+        self.chunk_size = chunk_size
+        self.pool = pool
+        self.email_sender = email_sender
+        self.connection_factory = connection_factory
+        self.seen = {}
+        self.password_pipeline = validators.PasswordRulePipeline(
+            [validators.MinimumLengthRule()] + validators.get_password_rules())
+
+    @property
+    def field_names(self):
+        return [self.UserModel.USERNAME_FIELD] + list(self.UserModel.REQUIRED_FIELDS)
+
+    def provision(self, rows):
+        """
+        Yield a `ProvisioningResult` for every row, in order, as each chunk is committed.
+        """
+        for chunk in chunked(enumerate(rows, 1), self.chunk_size):
+            results = [self.validate_row(row_number, row) for row_number, row in chunk]
+            self.check_unique(results)
+            self.create(results)
+            for result in results:
+                yield result
+
+    def validate_row(self, row_number, row):
+        result = ProvisioningResult(row_number, row)
+        values = {}
+        for name, raw_value in row.items():
+            if name == 'password' or (raw_value in ('', None) and name not in self.field_names):
+                continue
+            try:
+                field = self.UserModel._meta.get_field(name)
+            except models.FieldDoesNotExist:
+                result.add_error(name, ["Unknown field."])
+                continue
+            try:
+                values[name] = field.clean(raw_value, None)
+            except ValidationError as e:
+                result.add_error(name, e.messages)
+        for name in self.field_names:
+            if not row.get(name) and name not in result.errors:
+                result.add_error(name, ["This field is required."])
+        if result.errors:
+            return result
+
+        result.user = self.UserModel(**values)
+        result.password = row.get('password') or None
+        if result.password is not None:
+            try:
+                self.password_pipeline.validate(result.password, user=result.user)
+            except ValidationError as e:
+                result.add_error('password', e.messages)
+        return result
+
+    def check_unique(self, results):
+        """
+        Reject values of unique fields that appear earlier in this run or already exist, with one query per field.
+        """
+        for field in self.UserModel._meta.fields:
+            if not field.unique or field.primary_key:
+                continue
+            candidates = [r for r in results if r.ok and getattr(r.user, field.attname, None) is not None]
+            if not candidates:
+                continue
+            seen = self.seen.setdefault(field.name, set())
+            values = [getattr(r.user, field.attname) for r in candidates]
+            existing = set(self.UserModel._default_manager.filter(**{'%s__in' % field.name: values}).values_list(field.name, flat=True))
+            for result, value in zip(candidates, values):
+                if value in existing or value in seen:
+                    result.add_error(field.name, ["A user with this %s already exists." % field.verbose_name])
+                else:
+                    seen.add(value)
+
+    def create(self, results):
+        valid = [r for r in results if r.ok]
+        if not valid:
+            return
+        for result, encoded in zip(valid, hash_passwords([r.password for r in valid], self.pool)):
+            result.user.password = encoded
+        try:
+            with atomic():
+                self.UserModel._default_manager.bulk_create([r.user for r in valid])
+        except IntegrityError:
+            for result in valid:
+                result.add_error('__all__', ["Conflicted with a user created at the same time. Retry this row."])
+            return
+
+        if self.email_sender is not None:
+            self.send_emails([r.user for r in valid])
+
+    def send_emails(self, users):
+        # bulk_create doesn't set primary keys, and tokens need them
+        username_field = self.UserModel.USERNAME_FIELD
+        pks = dict(self.UserModel._default_manager.filter(
+            **{'%s__in' % username_field: [getattr(u, username_field) for u in users]}
+        ).values_list(username_field, 'pk'))
+        # Only compiled emails can be sent on a connection of our choosing
+        connection = self.connection_factory() if use_compiled_emails() else None
+        if connection is not None:
+            connection.open()
+        self.email_sender.email_connection = connection
+        try:
+            for user in users:
+                user.pk = pks.get(getattr(user, username_field))
+                if user.pk is not None:
+                    self.email_sender.send_email(user)
+        finally:
+            self.email_sender.email_connection = None
+            if connection is not None:
+                connection.close()
+
+
+def provision_users(rows, **kwargs):
+    return UserProvisioner(**kwargs).provision(rows)
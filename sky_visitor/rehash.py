@@ -0,0 +1,93 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Deferred password rehashing, used by `sky_visitor.backends.DeferredRehashBackend`.
+
+When the password hasher changes, Django re-hashes a user's password with the new hasher and saves it during the login
+request. Here the re-hash is queued instead and run once the response has been sent (the default,
+`SKY_VISITOR_DEFERRED_REHASH = 'response'`) or on a background thread (`'thread'`).
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.signals import request_finished
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+_pending = threading.local()
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def rehash_password(model, pk, old_encoded, raw_password):
+    """
+    Store a new hash of `raw_password`, unless the password changed since `old_encoded` was read.
+    """
+    new_encoded = make_password(raw_password)
+    model._default_manager.filter(pk=pk, password=old_encoded).update(password=new_encoded)
+
+
+def _run(job):
+    try:
+        rehash_password(*job)
+    except Exception:
+        logger.exception("Deferred password rehash failed")
+
+
+def _worker():
+    while True:
+        _run(_queue.get())
+        _queue.task_done()
+
+
+def _get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = queue.Queue()
+            thread = threading.Thread(target=_worker, name='sky_visitor-rehash')
+            thread.daemon = True
+            thread.start()
+    return _queue
+
+
+def schedule_rehash(user, raw_password):
+    job = (type(user), user.pk, user.password, raw_password)
+    if getattr(settings, 'SKY_VISITOR_DEFERRED_REHASH', 'response') == 'thread':
+        _get_queue().put(job)
+    else:
+        if not hasattr(_pending, 'jobs'):
+            _pending.jobs = []
+        _pending.jobs.append(job)
+
+
+def run_pending_rehashes(**kwargs):
+    """
+    Run the re-hashes queued by this thread. Connected to `request_finished`, which fires after the response body
+    has been sent to the client.
+    """
+    jobs = getattr(_pending, 'jobs', None)
+    if not jobs:
+        return
+    _pending.jobs = []
+    for job in jobs:
+        _run(job)
+request_finished.connect(run_pending_rehashes, dispatch_uid='sky_visitor.rehash')
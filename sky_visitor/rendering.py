@@ -0,0 +1,126 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compiled rendering of token emails, enabled with `SKY_VISITOR_COMPILED_EMAILS = True`.
+
+Normally every token email is looked up and rendered by `emailtemplates` and its context is rebuilt from scratch: the
+current Site, the absolute static URL and a `reverse()` of the token view. With compiled emails, templates are loaded
+and compiled once per template and language, site-wide context is built once per host (see `sky_visitor.sites`), and the token URL
+is reversed once per view. Sending a message then only renders the compiled templates with the recipient's values.
+
+Templates are plain Django templates, listed per email template name in `SKY_VISITOR_EMAIL_TEMPLATE_FILES` as
+`(subject_template, body_template)`. A `<language>/` prefixed copy (`sky_visitor/fr/invitation_email.html`) is used
+for that language if it exists. Overriding `get_email_context_data()` has no effect on compiled emails.
+"""
+import posixpath
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.urlresolvers import reverse
+from django.template import Context
+from django.template.loader import select_template
+from django.utils import translation
+from django.utils.http import int_to_base36
+from sky_visitor.sites import site_cache
+
+DEFAULT_EMAIL_TEMPLATE_FILES = {
+    'visitor-forgot-password': ('sky_visitor/forgot_password_subject.txt', 'sky_visitor/forgot_password_email.html'),
+    'visitor-magic-link': ('sky_visitor/magic_link_subject.txt', 'sky_visitor/magic_link_email.html'),
+    'invitation_complete': ('sky_visitor/invitation_subject.txt', 'sky_visitor/invitation_email.html'),
+}
+
+# Placeholders that match TOKEN_REGEX, so a token URL can be reversed once and filled in per message
+UID_PLACEHOLDER = 'UIDPLACEHOLDR'
+TOKEN_PLACEHOLDER = 'TOKENPLACEHOL-DER'
+
+
+def use_compiled_emails():
+    return getattr(settings, 'SKY_VISITOR_COMPILED_EMAILS', False)
+
+
+def get_email_template_files():
+    files = dict(DEFAULT_EMAIL_TEMPLATE_FILES)
+    files.update(getattr(settings, 'SKY_VISITOR_EMAIL_TEMPLATE_FILES', {}))
+    return files
+
+
+class CompiledEmailRenderer(object):
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._templates = {}
+        self._token_paths = {}
+
+    def get_template_names(self, name, language):
+        if not language:
+            return [name]
+        directory, filename = posixpath.split(name)
+        return [posixpath.join(directory, language, filename), name]
+
+    def get_templates(self, template_name, language):
+        key = (template_name, language)
+        templates = self._templates.get(key)
+        if templates is None:
+            try:
+                files = get_email_template_files()[template_name]
+            except KeyError:
+                raise ValueError("No template files for email %r. Add them to SKY_VISITOR_EMAIL_TEMPLATE_FILES." % template_name)
+            templates = tuple(select_template(self.get_template_names(name, language)) for name in files)
+            self._templates[key] = templates
+        return templates
+
+    def get_site_context(self, request=None):
+        return site_cache.get_site_context(request)
+
+    def get_token_url(self, url_prefix, token_view_name, uid, token):
+        path = self._token_paths.get(token_view_name)
+        if path is None:
+            path = reverse(token_view_name, kwargs={'uidb36': UID_PLACEHOLDER, 'token': TOKEN_PLACEHOLDER})
+            self._token_paths[token_view_name] = path
+        return url_prefix + path.replace(UID_PLACEHOLDER, uid).replace(TOKEN_PLACEHOLDER, token)
+
+    def render(self, template_name, user, token, token_view_name, request=None, language=None):
+        """
+        Return `(subject, body)` for a token email to `user`.
+        """
+        if language is None:
+            language = translation.get_language()
+        subject_template, body_template = self.get_templates(template_name, language)
+        site_context = self.get_site_context(request)
+        uid = int_to_base36(user.id)
+        context = dict(site_context)
+        context.update({
+            'user': user,
+            'uid': uid,
+            'token': token,
+            'token_url': self.get_token_url(site_context['url_prefix'], token_view_name, uid, token),
+        })
+        context = Context(context, autoescape=False)
+        with translation.override(language):
+            subject = ' '.join(subject_template.render(context).split())
+            body = body_template.render(context)
+        return subject, body
+
+    def get_message(self, template_name, user, token, token_view_name, request=None, language=None, **kwargs):
+        subject, body = self.render(template_name, user, token, token_view_name, request=request, language=language)
+        return EmailMessage(subject, body, to=[user.email], **kwargs)
+
+
+email_renderer = CompiledEmailRenderer()
+
+
+def clear_email_renderer(**kwargs):
+    email_renderer.clear()
@@ -0,0 +1,205 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Stateless login sessions, enabled with `SKY_VISITOR_SIGNED_SESSIONS = True` and
+`sky_visitor.middleware.SignedSessionMiddleware` in place of `AuthenticationMiddleware`.
+
+Logging in through sky_visitor sets a signed, expiring cookie holding the user's id, auth backend and session version
+instead of writing to the session store. Each request checks the signature and compares the version with the user's
+current one, which is cached in-process for `SKY_VISITOR_SESSION_VERSION_CACHE_SECONDS` (5 by default) and in Django's
+cache, so authenticated requests don't read or write the session store.
+
+Logging out, changing or resetting a password and `force_password_reset` bump the user's version, which revokes all of
+their cookies. Other processes notice within `SKY_VISITOR_SESSION_VERSION_CACHE_SECONDS`. Code that changes passwords
+by other means should call `revoke_sessions([user.pk])`.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError
+from django.db.models import F
+from django.middleware.csrf import rotate_token
+from sky_visitor.models import SessionVersion
+from sky_visitor.utils import atomic
+
+SALT = 'sky_visitor.signed_sessions'
+CACHE_TIMEOUT = 60 * 60 * 24
+# The backend `sky_visitor.backends.auto_login` logs users in with, whether or not it's in AUTHENTICATION_BACKENDS
+AUTO_LOGIN_BACKEND = 'sky_visitor.backends.BaseBackend'
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def use_signed_sessions():
+    return getattr(settings, 'SKY_VISITOR_SIGNED_SESSIONS', False)
+
+
+def get_cookie_name():
+    return getattr(settings, 'SKY_VISITOR_SESSION_COOKIE_NAME', 'sky_visitor_auth')
+
+
+def get_cookie_age():
+    return getattr(settings, 'SKY_VISITOR_SESSION_COOKIE_AGE', settings.SESSION_COOKIE_AGE)
+
+
+def _cache_key(user_id):
+    return 'sky_visitor:session_version:%s' % user_id
+
+
+def _remember(versions):
+    expires = time.time() + getattr(settings, 'SKY_VISITOR_SESSION_VERSION_CACHE_SECONDS', 5)
+    with _versions_lock:
+        if len(_versions) >= getattr(settings, 'SKY_VISITOR_SESSION_VERSION_CACHE_SIZE', 10000):
+            _versions.clear()
+        for user_id, version in versions.items():
+            _versions[user_id] = (version, expires)
+
+
+def clear_version_cache():
+    with _versions_lock:
+        _versions.clear()
+
+
+def get_session_version(user_id):
+    entry = _versions.get(user_id)
+    if entry is not None and entry[1] > time.time():
+        return entry[0]
+    version = cache.get(_cache_key(user_id))
+    if version is None:
+        versions = list(SessionVersion.objects.filter(user=user_id).values_list('version', flat=True)[:1])
+        version = versions[0] if versions else 0
+        # add(), not set(): if revoke_sessions() cached a newer version meanwhile, keep it
+        cache.add(_cache_key(user_id), version, CACHE_TIMEOUT)
+    _remember({user_id: version})
+    return version
+
+
+def revoke_sessions(user_ids):
+    """
+    Invalidate every signed session cookie issued so far to these users.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    SessionVersion.objects.filter(user__in=user_ids).update(version=F('version') + 1)
+    existing = set(SessionVersion.objects.filter(user__in=user_ids).values_list('user', flat=True))
+    missing = user_ids - existing
+    if missing:
+        try:
+            with atomic():
+                SessionVersion.objects.bulk_create([SessionVersion(user_id=user_id, version=1) for user_id in missing])
+        except IntegrityError:
+            # Created concurrently, so bump those instead
+            SessionVersion.objects.filter(user__in=missing).update(version=F('version') + 1)
+    versions = dict(SessionVersion.objects.filter(user__in=user_ids).values_list('user', 'version'))
+    cache.set_many(dict((_cache_key(user_id), version) for user_id, version in versions.items()), CACHE_TIMEOUT)
+    _remember(versions)
+
+
+def _set_session(request, user, backend):
+    request._signed_session = (user.pk, get_session_version(user.pk), backend)
+
+
+def login(request, user):
+    """
+    Same as `django.contrib.auth.login`, but with a signed cookie when signed sessions are on.
+    """
+    if not use_signed_sessions():
+        return auth.login(request, user)
+    if user is None:
+        user = request.user
+    _set_session(request, user, user.backend)
+    request.user = user
+    rotate_token(request)
+    user_logged_in.send(sender=user.__class__, request=request, user=user)
+
+
+def logout(request):
+    """
+    Same as `django.contrib.auth.logout`. With signed sessions the user's cookies are revoked everywhere, since a
+    cookie can't be revoked on its own.
+    """
+    if not use_signed_sessions():
+        return auth.logout(request)
+    user = getattr(request, 'user', None)
+    if hasattr(user, 'is_authenticated') and not user.is_authenticated():
+        user = None
+    user_logged_out.send(sender=user.__class__, request=request, user=user)
+    if user is not None:
+        revoke_sessions([user.pk])
+    if hasattr(request, 'session') and auth.SESSION_KEY in request.session:
+        request.session.flush()
+    request._signed_session = None
+    request.user = AnonymousUser()
+
+
+def update_session(request, user):
+    """
+    Keep `request`'s user logged in after their password has changed (which revokes their other sessions).
+    """
+    if use_signed_sessions() and getattr(request, '_signed_session_backend', None):
+        _set_session(request, user, request._signed_session_backend)
+
+
+def get_user(request):
+    """
+    Return the user of `request`'s signed session cookie, or an `AnonymousUser` if it's missing, expired or revoked.
+    Without a cookie, a session made by `django.contrib.auth.login` (in the admin, for example) is used.
+    """
+    value = request.COOKIES.get(get_cookie_name())
+    if not value:
+        if hasattr(request, 'session'):
+            return auth.get_user(request)
+        return AnonymousUser()
+    try:
+        user_id, version, backend_path = signing.loads(value, salt=SALT, max_age=get_cookie_age())
+    except (signing.BadSignature, ValueError, TypeError):
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS and backend_path != AUTO_LOGIN_BACKEND:
+        # The backend has been removed since the cookie was issued
+        return AnonymousUser()
+    if version != get_session_version(user_id):
+        return AnonymousUser()
+    try:
+        user = auth.load_backend(backend_path).get_user(user_id)
+    except ImproperlyConfigured:
+        return AnonymousUser()
+    if user is None:
+        return AnonymousUser()
+    user.backend = backend_path
+    request._signed_session_backend = backend_path
+    return user
+
+
+def set_cookie(request, response):
+    """
+    Set or delete the cookie for a login or logout during `request`.
+    """
+    if not hasattr(request, '_signed_session'):
+        return
+    if request._signed_session is None:
+        response.delete_cookie(get_cookie_name(), path=settings.SESSION_COOKIE_PATH, domain=settings.SESSION_COOKIE_DOMAIN)
+        return
+    value = signing.dumps(list(request._signed_session), salt=SALT, compress=True)
+    response.set_cookie(get_cookie_name(), value, max_age=get_cookie_age(), path=settings.SESSION_COOKIE_PATH,
+                        domain=settings.SESSION_COOKIE_DOMAIN, secure=settings.SESSION_COOKIE_SECURE or None,
+                        httponly=True)
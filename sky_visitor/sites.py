@@ -0,0 +1,88 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Per-host Site resolution for token emails.
+
+`Site.objects.get_current()` always returns `SITE_ID`, whatever host the request came in on. `site_cache` instead finds
+the Site whose domain matches the request host (with or without its port), falling back to the current Site. Emailed
+URLs are always built from the Site's domain, never from the Host header, which the client controls. The result and
+the absolute URL prefixes built from it are cached in-process per host, so building an email's site context costs no
+queries after the first request on each host. The cache is cleared when a Site is saved or deleted in
+this process; other processes keep their cached Sites until they restart.
+"""
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_save, post_delete
+
+
+class SiteCache(object):
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._contexts = {}
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'SKY_VISITOR_SITE_CACHE_SIZE', 1000)
+
+    def get_site_for_host(self, host):
+        host = host.lower()
+        hostname = host.rsplit(':', 1)[0] if not host.endswith(']') else host
+        sites = dict((site.domain.lower(), site) for site in Site.objects.filter(domain__in=set([host, hostname])))
+        return sites.get(host) or sites.get(hostname) or Site.objects.get_current()
+
+    def get_site_context(self, request=None):
+        """
+        Return `{'site', 'site_name', 'domain', 'url_prefix', 'static_url'}` for emails sent while handling `request`.
+
+        `domain` and `url_prefix` use the Site's domain, with the request's scheme (http without a request), so a forged
+        Host header can't point emailed links elsewhere. `static_url` is always absolute.
+        """
+        if request is not None:
+            host = request.get_host()
+            key = (host, request.is_secure())
+        else:
+            host = None
+            key = None
+        context = self._contexts.get(key)
+        if context is None:
+            site = self.get_site_for_host(host) if host is not None else Site.objects.get_current()
+            domain = site.domain
+            url_prefix = '%s://%s' % ('https' if key and key[1] else 'http', domain)
+            static_url = settings.STATIC_URL
+            if '://' not in static_url:
+                static_url = url_prefix + static_url
+            context = {
+                'site': site,
+                'site_name': site.name,
+                'domain': domain,
+                'url_prefix': url_prefix,
+                'static_url': static_url,
+            }
+            if len(self._contexts) >= self.max_size:
+                # Hosts come from requests, so don't let a flood of them grow the cache forever
+                self._contexts.clear()
+            self._contexts[key] = context
+        return context
+
+
+site_cache = SiteCache()
+
+
+def clear_site_cache(**kwargs):
+    site_cache.clear()
+post_save.connect(clear_site_cache, sender=Site)
+post_delete.connect(clear_site_cache, sender=Site)
@@ -0,0 +1,147 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Invitation statistics without `COUNT(*)` over `InvitedUser`.
+
+`InvitationCounter` rows are incremented with `F()` updates as invitations are sent, accepted and expired: one
+all-time row per counter, plus one per day for sent and accepted unless `SKY_VISITOR_INVITATION_STATS_BY_DAY = False`.
+Invitations don't record when they expired, so expirations are only counted all-time. Reading the totals is
+a single query on a handful of rows. If the counters drift (rows created with `bulk_create` or edited by hand, for
+example), rebuild them with the `reconcile_invitation_stats` command.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from sky_visitor.models import InvitedUser, InvitationCounter
+from sky_visitor.utils import atomic, queryset_chunks
+
+SENT = 'sent'
+ACCEPTED = 'accepted'
+EXPIRED = 'expired'
+COUNTERS = (SENT, ACCEPTED, EXPIRED)
+DAILY_COUNTERS = (SENT, ACCEPTED)
+ALL_TIME = ''
+
+
+def by_day_enabled():
+    return getattr(settings, 'SKY_VISITOR_INVITATION_STATS_BY_DAY', True)
+
+
+def get_period(value):
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        value = value.date()
+    return value.isoformat()
+
+
+def increment(name, amount=1, when=None):
+    """
+    Add `amount` to counter `name`, all-time and, for `DAILY_COUNTERS`, for the day of `when` (default now).
+    """
+    if not amount:
+        return
+    periods = [ALL_TIME]
+    if by_day_enabled() and name in DAILY_COUNTERS:
+        periods.append(get_period(when or timezone.now()))
+    for period in periods:
+        counters = InvitationCounter._default_manager.filter(name=name, period=period)
+        if counters.update(value=F('value') + amount):
+            continue
+        try:
+            with atomic():
+                InvitationCounter._default_manager.create(name=name, period=period, value=amount)
+        except IntegrityError:
+            # Created by someone else in the meantime
+            counters.update(value=F('value') + amount)
+
+
+def record_sent(amount=1, when=None):
+    increment(SENT, amount, when)
+
+
+def record_accepted(amount=1, when=None):
+    increment(ACCEPTED, amount, when)
+
+
+def record_expired(amount=1, when=None):
+    increment(EXPIRED, amount, when)
+
+
+def _stats(values):
+    stats = dict((name, values.get(name, 0)) for name in COUNTERS)
+    stats['pending'] = stats[SENT] - stats[ACCEPTED] - stats[EXPIRED]
+    return stats
+
+
+def get_invitation_stats():
+    """
+    Return all-time `{'sent', 'accepted', 'expired', 'pending'}` counts.
+    """
+    rows = InvitationCounter._default_manager.filter(period=ALL_TIME).values_list('name', 'value')
+    return _stats(dict(rows))
+
+
+def get_daily_invitation_stats(start, end):
+    """
+    Return `[(date, {'sent', 'accepted'})]` for each day from `start` to `end` inclusive. 'expired' and 'pending' are
+    not available per day. Needs `SKY_VISITOR_INVITATION_STATS_BY_DAY`.
+    """
+    rows = InvitationCounter._default_manager.filter(name__in=DAILY_COUNTERS, period__gte=get_period(start),
+                                                     period__lte=get_period(end))
+    values = {}
+    for name, period, value in rows.values_list('name', 'period', 'value'):
+        values.setdefault(period, {})[name] = value
+    days = []
+    day = start
+    while day <= end:
+        counts = values.get(get_period(day), {})
+        days.append((day, dict((name, counts.get(name, 0)) for name in DAILY_COUNTERS)))
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def reconcile_invitation_stats(chunk_size=5000):
+    """
+    Recount every counter from `InvitedUser`, reading it in primary key chunks, and replace the stored counters.
+    Returns the all-time stats.
+    """
+    totals = {}
+    by_day = by_day_enabled()
+
+    def add(name, when=None):
+        periods = [ALL_TIME]
+        if by_day and name in DAILY_COUNTERS and when is not None:
+            periods.append(get_period(when))
+        for period in periods:
+            totals[(name, period)] = totals.get((name, period), 0) + 1
+
+    queryset = InvitedUser._default_manager.only('status', 'date_invited', 'date_registered')
+    for chunk in queryset_chunks(queryset, chunk_size):
+        for invited_user in chunk:
+            add(SENT, invited_user.date_invited)
+            if invited_user.status == InvitedUser.STATUS_REGISTERED:
+                add(ACCEPTED, invited_user.date_registered)
+            elif invited_user.status == InvitedUser.STATUS_EXPIRED:
+                add(EXPIRED)
+
+    with atomic():
+        InvitationCounter._default_manager.all().delete()
+        InvitationCounter._default_manager.bulk_create([
+            InvitationCounter(name=name, period=period, value=value) for (name, period), value in totals.items()
+        ])
+    return get_invitation_stats()
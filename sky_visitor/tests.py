@@ -13,6 +13,15 @@
 # limitations under the License.
 
 from django.test import TestCase
+from django.test.signals import setting_changed
+from sky_visitor import delivery, rendering, sites, validators
+
+# Sky Visitor keeps some settings-derived state in process. Reset it whenever `override_settings` changes a setting.
+# Connected here rather than in each module so that runtime code never imports django.test
+setting_changed.connect(validators.reset_password_rules)
+setting_changed.connect(rendering.clear_email_renderer)
+setting_changed.connect(sites.clear_site_cache)
+setting_changed.connect(delivery.reset_delivery_pool)
 
 
 class SkyVisitorTestCase(TestCase):
@@ -0,0 +1,63 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import base36_to_int, int_to_base36
+
+
+class MagicLinkTokenGenerator(object):
+    """
+    Short-lived, single-use login tokens. Same interface as django.contrib.auth.tokens.PasswordResetTokenGenerator, so
+    it can be used as the `token_generator` of `SendTokenEmailMixin` and `TokenValidateMixin`.
+
+    Tokens are a timestamp plus an HMAC of the user's id, last login and that timestamp. They don't depend on the
+    password hash, are checked with a single HMAC, expire after `SKY_VISITOR_MAGIC_LINK_TIMEOUT` seconds and stop
+    working as soon as the user logs in (which updates `last_login`).
+    """
+    key_salt = 'sky_visitor.tokens.MagicLinkTokenGenerator'
+    epoch = 1356998400  # 2013-01-01 UTC, keeps timestamps short
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'SKY_VISITOR_MAGIC_LINK_TIMEOUT', 15 * 60)
+
+    def make_token(self, user):
+        return self._make_token_with_timestamp(user, self._now())
+
+    def check_token(self, user, token):
+        try:
+            ts_b36, hash = token.split('-')
+            timestamp = base36_to_int(ts_b36)
+        except ValueError:
+            return False
+        if not constant_time_compare(self._make_token_with_timestamp(user, timestamp), token):
+            return False
+        return self._now() - timestamp <= self.timeout
+
+    def _make_token_with_timestamp(self, user, timestamp):
+        ts_b36 = int_to_base36(timestamp)
+        last_login = getattr(user, 'last_login', None)
+        # Some databases drop microseconds, so leave them out
+        login_timestamp = '' if last_login is None else last_login.replace(microsecond=0, tzinfo=None)
+        value = u'%s%s%s' % (user.pk, login_timestamp, timestamp)
+        hash = salted_hmac(self.key_salt, value).hexdigest()[::2]
+        return '%s-%s' % (ts_b36, hash)
+
+    def _now(self):
+        return int(time.time()) - self.epoch
+
+
+magic_link_token_generator = MagicLinkTokenGenerator()
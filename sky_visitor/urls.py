@@ -13,18 +13,38 @@
 # limitations under the License.
 from django.conf.urls import *
 from sky_visitor.views import *
+from sky_visitor.views import api
+from sky_visitor.utils import non_atomic_requests
 
 TOKEN_REGEX = '(?P<uidb36>[0-9A-Za-z]{1,13})-(?P<token>[0-9A-Za-z]{1,13}-[0-9A-Za-z]{1,20})'
 
 urlpatterns = patterns('',
     url(r'^register/$', RegisterView.as_view(), name='register'),
+    url(r'^availability/$', AvailabilityView.as_view(), name='availability'),
     url(r'^login/$', LoginView.as_view(), name='login'),
     url(r'^logout/$', LogoutView.as_view(), name='logout'),
     url(r'^forgot_password/$', ForgotPasswordView.as_view(), name='forgot_password'),
     url(r'^forgot_password/check_email/$', ForgotPasswordCheckEmailView.as_view(), name='forgot_password_check_email'),
     url(r'^reset_password/%s/$' % TOKEN_REGEX, ResetPasswordView.as_view(), name='reset_password'),
+    url(r'^magic_link/$', MagicLinkStartView.as_view(), name='magic_link_start'),
+    url(r'^magic_link/check_email/$', MagicLinkCheckEmailView.as_view(), name='magic_link_check_email'),
+    url(r'^magic_link/%s/$' % TOKEN_REGEX, MagicLinkLoginView.as_view(), name='magic_link_login'),
     url(r'^change_password/$', ChangePasswordView.as_view(), name='change_password'),
     url(r'invitation/$', InvitationStartView.as_view(), name='invitation_start'),
+    url(r'invitation/export/$', InvitationExportView.as_view(), name='invitation_export'),
     url(r'invitation/%s/$' % TOKEN_REGEX, InvitationCompleteView.as_view(), name='invitation_complete'),
+    # Outside of any request transaction, so a claimed seat's row is only locked for its UPDATE
+    url(r'^invitation_link/(?P<code>[0-9A-Za-z]{1,32})/$', non_atomic_requests(InvitationLinkView.as_view()), name='invitation_link'),
 #     url(r'invitation/done/$',   InvitationDoneView.as_view(),   name='invitation_done'),
+
+    url(r'^api/register/$', api.RegisterView.as_view(), name='api_register'),
+    url(r'^api/login/$', api.LoginView.as_view(), name='api_login'),
+    url(r'^api/logout/$', api.LogoutView.as_view(), name='api_logout'),
+    url(r'^api/forgot_password/$', api.ForgotPasswordView.as_view(), name='api_forgot_password'),
+    url(r'^api/reset_password/%s/$' % TOKEN_REGEX, api.ResetPasswordView.as_view(), name='api_reset_password'),
+    url(r'^api/magic_link/$', api.MagicLinkStartView.as_view(), name='api_magic_link_start'),
+    url(r'^api/magic_link/%s/$' % TOKEN_REGEX, api.MagicLinkLoginView.as_view(), name='api_magic_link_login'),
+    url(r'^api/change_password/$', api.ChangePasswordView.as_view(), name='api_change_password'),
+    url(r'^api/invitation_start/$', api.InvitationStartView.as_view(), name='api_invitation_start'),
+    url(r'^api/invitation_complete/%s/$' % TOKEN_REGEX, api.InvitationCompleteView.as_view(), name='api_invitation_complete'),
 )
@@ -0,0 +1,156 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import itertools
+import json
+import multiprocessing
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+
+
+def chunked(iterable, size):
+    """
+    Yield lists of at most `size` items from `iterable` without materializing it.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def _savepoint(using):
+    sid = transaction.savepoint(using=using)
+    try:
+        yield
+    except Exception:
+        transaction.savepoint_rollback(sid, using=using)
+        raise
+    transaction.savepoint_commit(sid, using=using)
+
+
+def atomic(using=None):
+    """
+    `transaction.atomic()` where it exists. On Django 1.5, a savepoint inside a managed transaction, so that an error
+    only rolls back the block and success doesn't commit the caller's work early; otherwise `commit_on_success()`.
+    """
+    if hasattr(transaction, 'atomic'):
+        return transaction.atomic(using=using)
+    if transaction.is_managed(using=using):
+        return _savepoint(using)
+    return transaction.commit_on_success(using=using)
+
+
+def non_atomic_requests(view):
+    """
+    Run `view` in autocommit mode even when `ATOMIC_REQUESTS` (or `TransactionMiddleware` on Django 1.5) wraps
+    requests in a transaction, so each query is committed as soon as it runs. Wrap the URLconf callback (the result
+    of `as_view()`): from Django 1.6 the request handler only looks for this on the callback, not on `dispatch`.
+    """
+    if hasattr(transaction, 'non_atomic_requests'):
+        return transaction.non_atomic_requests(view)
+    return transaction.autocommit(view)
+
+
+# Connections each hashing worker inherited from its parent. Kept referenced so they're never garbage collected: that
+# would close the socket the parent is still using
+_inherited_connections = []
+
+
+def _detach_connections():
+    for connection in connections.all():
+        if connection.connection is not None:
+            _inherited_connections.append(connection.connection)
+            connection.connection = None
+
+
+def get_hashing_pool(processes=None):
+    """
+    Return a process pool for hashing passwords on every core. The forked workers detach the database connections they
+    inherit, so they never share a socket with the parent. The parent's connections, and any transaction open on them,
+    are left alone, so a pool can be created inside `atomic()`.
+    """
+    return multiprocessing.Pool(processes, initializer=_detach_connections)
+
+
+def hash_passwords(passwords, pool=None):
+    """
+    Return `make_password()` of each password, in order, spread across `pool` if given.
+    """
+    if pool is None:
+        return [make_password(password) for password in passwords]
+    return pool.map(make_password, passwords)
+
+
+def queryset_chunks(queryset, size):
+    """
+    Yield lists of at most `size` objects from `queryset` in primary key order. Each chunk is fetched with
+    `pk > last_pk` rather than an OFFSET, so late chunks cost the same as early ones.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        objects = list(chunk[:size])
+        if not objects:
+            return
+        yield objects
+        last_pk = objects[-1].pk
+
+
+def estimate_count(queryset):
+    """
+    Return the query planner's estimate of how many rows `queryset` matches, or None if the database can't say
+    cheaply. Supported on PostgreSQL (table statistics, or EXPLAIN for filtered querysets) and MySQL (table
+    statistics for unfiltered querysets only).
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        if not queryset.query.where:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [connection.ops.quote_name(table)])
+            row = cursor.fetchone()
+            estimate = row[0] if row else None
+        else:
+            sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+            if not isinstance(plan, list):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+    elif connection.vendor == 'mysql' and not queryset.query.where:
+        cursor.execute("SELECT TABLE_ROWS FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", [table])
+        row = cursor.fetchone()
+        estimate = row[0] if row else None
+    else:
+        return None
+    # Tables that have never been analyzed report 0 (or -1)
+    if estimate is None or estimate <= 0:
+        return None
+    return int(estimate)
+
+
+def approximate_count(queryset, threshold):
+    """
+    Return `estimate_count(queryset)` if it is at least `threshold`, otherwise an exact `count()`.
+    """
+    estimate = estimate_count(queryset)
+    if estimate is not None and estimate >= threshold:
+        return estimate
+    return queryset.count()
@@ -0,0 +1,400 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import binascii
+import difflib
+import hashlib
+import heapq
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.utils.importlib import import_module
+from django.utils.translation import ugettext_lazy as _
+
+
+class BreachedPasswordIndex(object):
+    """
+    Read-only lookup of known-compromised passwords.
+
+    The index is a binary file made of a small header followed by sorted, de-duplicated, fixed-width SHA-1 prefixes.
+    It is memory-mapped on first use and binary-searched, so every worker process on a host shares the same pages
+    through the OS page cache instead of loading the list into memory. Build it with `build_breached_password_index()`
+    or the `build_breached_password_index` management command.
+
+    At most every `check_interval` seconds, a lookup checks whether the file has been replaced (its inode, size or
+    mtime changed) and if so maps the new one, so a rebuilt index is picked up without restarting.
+    """
+    MAGIC = b'SVBPI\x01'
+    HEADER = struct.Struct('>6sBx')
+    DEFAULT_PREFIX_LENGTH = 8  # 64 bits of SHA-1 keeps false positives negligible for lists of hundreds of millions
+
+    def __init__(self, path, check_interval=1):
+        self.path = path
+        self.check_interval = check_interval
+        # (map, prefix_length, count), replaced as a whole so lookups never mix two versions of the file
+        self._state = None
+        self._file_id = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        now = time.time()
+        if self._state is not None and now - self._checked_at < self.check_interval:
+            return self._state
+        with self._lock:
+            self._checked_at = now
+            stat = os.stat(self.path)
+            file_id = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+            if self._state is None or file_id != self._file_id:
+                with open(self.path, 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, prefix_length = self.HEADER.unpack(data[:self.HEADER.size])
+                if magic != self.MAGIC or not prefix_length:
+                    data.close()
+                    raise ValueError("%s is not a breached password index." % self.path)
+                # The old map isn't closed here, since other threads may still be searching it; it is unmapped once
+                # they're done with it
+                self._state = (data, prefix_length, (len(data) - self.HEADER.size) // prefix_length)
+                self._file_id = file_id
+            return self._state
+
+    def __len__(self):
+        return self._load()[2]
+
+    def __contains__(self, password):
+        if not isinstance(password, bytes):
+            password = password.encode('utf-8')
+        return self.contains_digest(hashlib.sha1(password).digest())
+
+    def contains_digest(self, digest):
+        data, width, count = self._load()
+        prefix = digest[:width]
+        offset = self.HEADER.size
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = offset + mid * width
+            record = data[start:start + width]
+            if record < prefix:
+                lo = mid + 1
+            elif record > prefix:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def close(self):
+        with self._lock:
+            if self._state is not None:
+                self._state[0].close()
+                self._state = None
+                self._file_id = None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_breached_password_index(path=None):
+    """
+    Return the shared index for `path`, defaulting to `settings.SKY_VISITOR_BREACHED_PASSWORD_INDEX`. Returns None if no
+    index is configured.
+    """
+    if path is None:
+        path = getattr(settings, 'SKY_VISITOR_BREACHED_PASSWORD_INDEX', None)
+    if not path:
+        return None
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = BreachedPasswordIndex(path)
+        return _indexes[path]
+
+
+def _digest_from_line(line, input_format):
+    line = line.strip()
+    if not line:
+        return None
+    if input_format == 'sha1':
+        # Accepts both bare hex hashes and the "HASH:COUNT" format used by public breach corpora
+        try:
+            digest = binascii.unhexlify(line.split(b':', 1)[0][:40])
+        except (TypeError, ValueError, binascii.Error):
+            return None
+        # Anything shorter than a full SHA-1 would be written as a short record and misalign the index
+        return digest if len(digest) == 20 else None
+    return hashlib.sha1(line).digest()
+
+
+def _write_run(prefixes, directory):
+    prefixes.sort()
+    fd, path = tempfile.mkstemp(prefix='bpi-run-', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        previous = None
+        for prefix in prefixes:
+            if prefix != previous:
+                f.write(prefix)
+                previous = prefix
+    return path
+
+
+def _read_run(path, width):
+    with open(path, 'rb') as f:
+        while True:
+            record = f.read(width)
+            if len(record) < width:
+                return
+            yield record
+
+
+def build_breached_password_index(lines, output_path, input_format='sha1', prefix_length=BreachedPasswordIndex.DEFAULT_PREFIX_LENGTH, chunk_size=2000000):
+    """
+    Build an index file from an iterable of byte strings, one password (`input_format='plain'`) or hex SHA-1 hash
+    (`input_format='sha1'`) per line.
+
+    Lines are processed as an external merge sort: at most `chunk_size` prefixes are held in memory at a time, sorted
+    runs are spilled to temporary files next to `output_path` and merged at the end. The finished file is moved into
+    place atomically, so running workers keep reading the old index until their next check for a new file (see
+    `BreachedPasswordIndex.check_interval`). Returns the number of distinct prefixes written.
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    runs = []
+    count = 0
+    try:
+        prefixes = []
+        for line in lines:
+            digest = _digest_from_line(line, input_format)
+            if digest is None:
+                continue
+            prefixes.append(digest[:prefix_length])
+            if len(prefixes) >= chunk_size:
+                runs.append(_write_run(prefixes, directory))
+                prefixes = []
+        if prefixes:
+            runs.append(_write_run(prefixes, directory))
+        del prefixes
+
+        fd, tmp_path = tempfile.mkstemp(prefix='bpi-', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(BreachedPasswordIndex.HEADER.pack(BreachedPasswordIndex.MAGIC, prefix_length))
+            previous = None
+            for prefix in heapq.merge(*[_read_run(path, prefix_length) for path in runs]):
+                if prefix != previous:
+                    f.write(prefix)
+                    previous = prefix
+                    count += 1
+        os.rename(tmp_path, output_path)
+    finally:
+        for path in runs:
+            os.remove(path)
+    return count
+
+
+class PasswordRule(object):
+    """
+    A single password check. Subclasses raise `ValidationError` from `__call__` when the password is not acceptable.
+
+    `cost` is a relative estimate of how expensive the check is. `PasswordRulePipeline` runs rules from cheapest to
+    most expensive and stops at the first failure, so a weak password never reaches the slow checks.
+    """
+    cost = 10
+
+    def __call__(self, password, user=None):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '<%s>' % self.__class__.__name__
+
+
+class MinimumLengthRule(PasswordRule):
+    cost = 1
+
+    def __init__(self, min_length=8):
+        self.min_length = min_length
+
+    def __call__(self, password, user=None):
+        if len(password) < self.min_length:
+            raise ValidationError("Password must be at least %d characters long." % self.min_length)
+
+
+class CharacterClassesRule(PasswordRule):
+    cost = 2
+    CLASSES = (
+        ('lowercase', lambda c: c.islower()),
+        ('uppercase', lambda c: c.isupper()),
+        ('digits', lambda c: c.isdigit()),
+        ('symbols', lambda c: not c.isalnum()),
+    )
+
+    def __init__(self, min_classes=2):
+        self.min_classes = min_classes
+
+    def __call__(self, password, user=None):
+        found = 0
+        for name, test in self.CLASSES:
+            if any(test(c) for c in password):
+                found += 1
+                if found >= self.min_classes:
+                    return
+        raise ValidationError(_("Password must contain at least %d of: lowercase letters, uppercase letters, digits and symbols.") % self.min_classes)
+
+
+class RegexRule(PasswordRule):
+    """
+    Rejects passwords matching `pattern` (or not matching it, if `inverse_match` is False). The pattern is compiled
+    once, when the rule is created.
+    """
+    cost = 3
+
+    def __init__(self, pattern, message, inverse_match=True, flags=0):
+        self.regex = re.compile(pattern, flags)
+        self.message = message
+        self.inverse_match = inverse_match
+
+    def __call__(self, password, user=None):
+        if bool(self.regex.search(password)) == self.inverse_match:
+            raise ValidationError(self.message)
+
+
+class BreachedPasswordRule(PasswordRule):
+    cost = 50
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def __call__(self, password, user=None):
+        index = get_breached_password_index(self.path)
+        if index is not None and password in index:
+            raise ValidationError(_("This password has appeared in a data breach. Please choose a different password."))
+
+
+class DictionaryRule(PasswordRule):
+    """
+    Rejects passwords found in a word list file (one word per line, compared case-insensitively). The file is read
+    the first time the rule runs. For very large lists, use `BreachedPasswordRule` instead.
+    """
+    cost = 60
+
+    def __init__(self, path):
+        self.path = path
+        self._words = None
+
+    @property
+    def words(self):
+        if self._words is None:
+            with open(self.path, 'rb') as f:
+                self._words = frozenset(line.strip().decode('utf-8', 'ignore').lower() for line in f)
+        return self._words
+
+    def __call__(self, password, user=None):
+        if password.lower() in self.words:
+            raise ValidationError(_("This password is too common."))
+
+
+class UserAttributeSimilarityRule(PasswordRule):
+    cost = 100
+    DEFAULT_ATTRIBUTES = ('username', 'first_name', 'last_name', 'email')
+
+    def __init__(self, attributes=DEFAULT_ATTRIBUTES, max_similarity=0.7):
+        self.attributes = attributes
+        self.max_similarity = max_similarity
+
+    def __call__(self, password, user=None):
+        if user is None:
+            return
+        password = password.lower()
+        for attribute in self.attributes:
+            value = getattr(user, attribute, None)
+            if not value:
+                continue
+            value = value.lower()
+            parts = [value] + re.split(r'\W+', value)
+            for part in parts:
+                matcher = difflib.SequenceMatcher(a=password, b=part)
+                # quick_ratio() is an upper bound for ratio(), so most passwords skip the full comparison
+                if matcher.quick_ratio() >= self.max_similarity and matcher.ratio() >= self.max_similarity:
+                    raise ValidationError(_("The password is too similar to your %s.") % attribute.replace('_', ' '))
+
+
+class PasswordRulePipeline(object):
+    """
+    Runs `rules` in order of increasing cost and stops at the first failure. If `timing_hook` is given, it is called
+    as `timing_hook(rule, seconds, passed)` after each rule that runs.
+    """
+
+    def __init__(self, rules, timing_hook=None):
+        self.rules = sorted(rules, key=lambda rule: rule.cost)
+        self.timing_hook = timing_hook
+
+    def validate(self, password, user=None):
+        for rule in self.rules:
+            start = time.time()
+            passed = False
+            try:
+                rule(password, user)
+                passed = True
+            finally:
+                if self.timing_hook is not None:
+                    self.timing_hook(rule, time.time() - start, passed)
+
+
+DEFAULT_PASSWORD_RULES = (
+    'sky_visitor.validators.BreachedPasswordRule',
+)
+
+_password_rules = None
+
+
+def _import_by_path(path):
+    module_name, attr = path.rsplit('.', 1)
+    try:
+        return getattr(import_module(module_name), attr)
+    except (ImportError, AttributeError) as e:
+        raise ImproperlyConfigured("Error importing %s: %s" % (path, e))
+
+
+def get_password_rules():
+    """
+    Return the rules configured in `settings.SKY_VISITOR_PASSWORD_RULES`. Each entry is either a dotted path to a
+    `PasswordRule` class or a `(dotted_path, kwargs)` pair. Rules are instantiated once and reused.
+    """
+    global _password_rules
+    if _password_rules is None:
+        rules = []
+        for entry in getattr(settings, 'SKY_VISITOR_PASSWORD_RULES', DEFAULT_PASSWORD_RULES):
+            if isinstance(entry, (list, tuple)):
+                path, kwargs = entry
+            else:
+                path, kwargs = entry, {}
+            rules.append(_import_by_path(path)(**kwargs))
+        _password_rules = rules
+    return _password_rules
+
+
+def get_password_rule_timing_hook():
+    path = getattr(settings, 'SKY_VISITOR_PASSWORD_RULE_TIMING_HOOK', None)
+    if not path:
+        return None
+    return _import_by_path(path)
+
+
+def reset_password_rules(**kwargs):
+    global _password_rules
+    if kwargs.get('setting', 'SKY_VISITOR_PASSWORD_RULES') == 'SKY_VISITOR_PASSWORD_RULES':
+        _password_rules = None
@@ -14,20 +14,25 @@
 from django.contrib import auth
 from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import get_user_model
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import NON_FIELD_ERRORS
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import resolve_url
 from django.utils.decorators import method_decorator
 from django.utils.http import is_safe_url
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_protect
-from django.views.generic import CreateView, FormView, RedirectView, TemplateView
+from django.views.generic import CreateView, FormView, RedirectView, TemplateView, View
 from django.utils.translation import ugettext_lazy as _
-from sky_visitor.models import InvitedUser
+from sky_visitor.availability import availability_index
+from sky_visitor import signed_sessions
 from sky_visitor.backends import auto_login
-from sky_visitor.forms import RegisterForm, LoginForm, PasswordResetForm, SetPasswordForm, PasswordChangeForm, InvitationStartForm, InvitationCompleteForm
-from sky_visitor.views.mixins import SendTokenEmailMixin, TokenValidateMixin, LoginRequiredMixin
+from sky_visitor.export import export_invitations
+from sky_visitor.models import InvitationLink
+from sky_visitor.forms import RegisterForm, LoginForm, PasswordResetForm, SetPasswordForm, PasswordChangeForm, InvitationStartForm, InvitationCompleteForm, MagicLinkForm
+from sky_visitor.tokens import magic_link_token_generator
+from sky_visitor.views.mixins import SendTokenEmailMixin, TokenValidateMixin, InvitationTokenMixin, LoginRequiredMixin, JSONResponseMixin
 
 
 class RegisterView(CreateView):
@@ -49,6 +54,32 @@ class RegisterView(CreateView):
         return settings.LOGIN_REDIRECT_URL
 
 
+class AvailabilityView(JSONResponseMixin, View):
+    """
+    Answers "is this username/email still available?" for signup forms, e.g. `?username=jane&email=jane@example.com`.
+
+    Values that are definitely available are answered from an in-process Bloom filter without a database query. See
+    `sky_visitor.availability.AvailabilityIndex`.
+    """
+    index = availability_index
+
+    @method_decorator(never_cache)
+    def dispatch(self, *args, **kwargs):
+        return super(AvailabilityView, self).dispatch(*args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        data = {}
+        username = request.GET.get('username', '').strip()
+        if username:
+            data['username'] = {'value': username, 'available': self.index.is_username_available(username)}
+        email = request.GET.get('email', '').strip()
+        if email:
+            data['email'] = {'value': email, 'available': self.index.is_email_available(email)}
+        if not data:
+            return self.render_json_response({'error': "Provide a username or email parameter."}, status=400)
+        return self.render_json_response(data)
+
+
 # Originally from: https://github.com/stefanfoulis/django-class-based-auth-views/blob/develop/class_based_auth_views/views.py
 class LoginView(FormView):
     """
@@ -78,7 +109,7 @@ class LoginView(FormView):
         The user has provided valid credentials (this was checked in AuthenticationForm.is_valid()). So now we
         can log them in.
         """
-        auth.login(self.request, form.get_user())
+        signed_sessions.login(self.request, form.get_user())
         return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
@@ -133,7 +164,7 @@ class LogoutView(RedirectView):
     success_message = _("Successfully logged out.")
 
     def get(self, request, *args, **kwargs):
-        auth.logout(request)
+        signed_sessions.logout(request)
         messages.success(request, self.success_message, fail_silently=True)
         return super(LogoutView, self).get(request, *args, **kwargs)
 
@@ -165,19 +196,8 @@ class ForgotPasswordView(SendTokenEmailMixin, FormView):
     token_view_name = 'reset_password'
 
     def form_valid(self, form):
-        # Copied behavior from django.contrib.auth.forms.PasswordResetForm
-        UserModel = get_user_model()
-        email = form.cleaned_data["email"]
-        active_users = UserModel._default_manager.filter(
-            email__iexact=email, is_active=True)
-        for user in active_users:
-            # Make sure that no email is sent to a user that actually has
-            # a password marked as unusable
-            if not user.has_usable_password():
-                continue
-
+        for user in form.get_users():
             self.send_email(user)
-
         return super(ForgotPasswordView, self).form_valid(form)  # Do redirect
 
     def get_success_url(self):
@@ -188,6 +208,54 @@ class ForgotPasswordCheckEmailView(TemplateView):
     template_name = 'sky_visitor/forgot_password_check_email.html'
 
 
+class MagicLinkStartView(SendTokenEmailMixin, FormView):
+    """
+    Emails a one-time login link, so users can log in without a password (or the cost of hashing one).
+    """
+    form_class = MagicLinkForm
+    template_name = 'sky_visitor/magic_link_start.html'
+    email_template = 'visitor-magic-link'
+    token_view_name = 'magic_link_login'
+    token_generator = magic_link_token_generator
+
+    def form_valid(self, form):
+        for user in form.get_users():
+            self.send_email(user)
+        return super(MagicLinkStartView, self).form_valid(form)  # Do redirect
+
+    def get_success_url(self):
+        return reverse('magic_link_check_email')
+
+
+class MagicLinkCheckEmailView(TemplateView):
+    template_name = 'sky_visitor/magic_link_check_email.html'
+
+
+class MagicLinkLoginView(TokenValidateMixin, TemplateView):
+    """
+    Shows a confirmation page for a valid link, and logs in when it's submitted. Logging in on GET would let mail
+    scanners and link prefetchers use up the link (and get the session) before the user clicks it.
+    """
+    template_name = 'sky_visitor/magic_link_login.html'
+    redirect_field_name = auth.REDIRECT_FIELD_NAME
+    token_generator = magic_link_token_generator
+    invalid_token_message = _("This login link has expired or has already been used. Please request a new one.")
+    success_message = _("Successfully logged in.")
+
+    def post(self, request, *args, **kwargs):
+        if not getattr(self.token_user, 'is_active', True):
+            return self.token_invalid(request, *args, **kwargs)
+        auto_login(request, self.token_user)
+        messages.success(request, self.success_message, fail_silently=True)
+        return HttpResponseRedirect(self.get_success_url())
+
+    def get_success_url(self):
+        redirect_to = self.request.GET.get(self.redirect_field_name, '')
+        if not is_safe_url(url=redirect_to, host=self.request.get_host()):
+            redirect_to = resolve_url(settings.LOGIN_REDIRECT_URL)
+        return redirect_to
+
+
 class ResetPasswordView(TokenValidateMixin, FormView):
     form_class = SetPasswordForm
     template_name = 'sky_visitor/reset_password.html'
@@ -230,6 +298,7 @@ class ChangePasswordView(LoginRequiredMixin, FormView):
 
     def form_valid(self, form):
         form.save()
+        signed_sessions.update_session(self.request, form.user)
         messages.success(self.request, self.success_message, fail_silently=True)
         return super(ChangePasswordView, self).form_valid(form)
 
@@ -246,6 +315,7 @@ class InvitationStartView(SendTokenEmailMixin, CreateView):
     template_name = 'sky_visitor/invitation_start.html'
     success_message = _("Invitation successfully delivered.")
     email_template = 'invitation_complete'
+    token_view_name = 'invitation_complete'
 
     def get_user_object(self):
         """
@@ -267,7 +337,7 @@ class InvitationStartView(SendTokenEmailMixin, CreateView):
         return self.request.path
 
 
-class InvitationCompleteView(TokenValidateMixin, CreateView):
+class InvitationCompleteView(InvitationTokenMixin, CreateView):
     """
     Invitations create an InviteUser. Once an invitation is completed, a standard user object is created.
 
@@ -281,15 +351,6 @@ class InvitationCompleteView(TokenValidateMixin, CreateView):
     success_message = _("Account successfully created.")
     # Since this is an UpdateView, the default success_url will be the user's get_absolute_url(). Override if you'd like different behavior
 
-    def get_user_model_class(self):
-        """
-        Used for token validation. We're faking a real user with the InvitedUser so we can use django core's token validation code.
-        """
-        return InvitedUser
-
-    def get_invited_user(self):
-        return self.token_user
-
     def get_form_kwargs(self):
         kwargs = super(InvitationCompleteView, self).get_form_kwargs()
         kwargs['invited_user'] = self.get_invited_user()
@@ -307,3 +368,73 @@ class InvitationCompleteView(TokenValidateMixin, CreateView):
         context_data['invited_user'] = self.get_invited_user()
         context_data['is_token_valid'] = self.is_token_valid
         return context_data
+
+
+class InvitationLinkView(CreateView):
+    """
+    Registration through a shared `InvitationLink`. Each registration claims one of the link's seats; once they're all
+    used (or the link is deactivated or expires) visitors get `invalid_link_message` and are redirected to the login page.
+
+    Route it as `sky_visitor.utils.non_atomic_requests(InvitationLinkView.as_view())`, as `sky_visitor.urls` does.
+    """
+    model = auth.get_user_model()
+    form_class = RegisterForm
+    auto_login_on_success = True
+    template_name = 'sky_visitor/invitation_link.html'
+    invalid_link_message = _("This invitation link is no longer valid. Ask the person who shared it for a new one.")
+    no_seats_message = _("Sorry, every place on this invitation has just been taken.")
+    success_message = _("Account successfully created.")
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            self.link = InvitationLink.objects.get(code=kwargs['code'])
+        except InvitationLink.DoesNotExist:
+            return self.link_invalid(request)
+        if not self.link.is_usable():
+            return self.link_invalid(request)
+        return super(InvitationLinkView, self).dispatch(request, *args, **kwargs)
+
+    def link_invalid(self, request):
+        messages.error(request, self.invalid_link_message, fail_silently=True)
+        return HttpResponseRedirect(resolve_url(settings.LOGIN_URL))
+
+    def form_valid(self, form):
+        if not self.link.claim_seat():
+            form.errors[NON_FIELD_ERRORS] = form.error_class([self.no_seats_message])
+            return self.form_invalid(form)
+        try:
+            response = super(InvitationLinkView, self).form_valid(form)
+        except Exception:
+            self.link.release_seat()
+            raise
+        if self.auto_login_on_success:
+            auto_login(self.request, self.object)
+        messages.success(self.request, self.success_message, fail_silently=True)
+        return response
+
+    def get_success_url(self):
+        return resolve_url(settings.LOGIN_REDIRECT_URL)
+
+    def get_context_data(self, **kwargs):
+        context_data = super(InvitationLinkView, self).get_context_data(**kwargs)
+        context_data['invitation_link'] = self.link
+        return context_data
+
+
+class InvitationExportView(View):
+    """
+    Staff-only CSV download of every invitation, streamed as it is read. Add `?gzip=1` for a gzipped file.
+    """
+    filename = 'invitations.csv'
+
+    @method_decorator(staff_member_required)
+    def dispatch(self, *args, **kwargs):
+        return super(InvitationExportView, self).dispatch(*args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        compress = bool(request.GET.get('gzip'))
+        filename = self.filename + ('.gz' if compress else '')
+        response = StreamingHttpResponse(export_invitations(compress=compress),
+                                         content_type='application/gzip' if compress else 'text/csv')
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
@@ -0,0 +1,186 @@
+# Copyright 2013 Concentric Sky, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+JSON versions of the sky_visitor flows, for single-page frontends and mobile apps.
+
+Each view takes the same POST data and uses the same form as its HTML counterpart in `sky_visitor.views`, but answers
+`{"ok": true, ...}` on success and `{"errors": {...}}` with a 400 otherwise, instead of rendering a template or
+redirecting. CSRF protection still applies, so send the `csrftoken` cookie back in an `X-CSRFToken` header.
+
+Emailed links still point at the HTML views (`reset_password`, `magic_link_login`, `invitation_complete`). Apps that
+handle those links themselves can post the `uidb36` and `token` from the link to the token views here.
+"""
+from django.utils.decorators import method_decorator
+from django.utils.encoding import force_text
+from django.utils.translation import ugettext_lazy as _
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import csrf_protect
+from django.views.generic import FormView, View
+from sky_visitor import signed_sessions
+from sky_visitor.backends import auto_login
+from sky_visitor.forms import RegisterForm, LoginForm, PasswordResetForm, SetPasswordForm, PasswordChangeForm, InvitationStartForm, InvitationCompleteForm, MagicLinkForm
+from sky_visitor.tokens import magic_link_token_generator
+from sky_visitor.views.mixins import SendTokenEmailMixin, TokenValidateMixin, InvitationTokenMixin, JSONResponseMixin, JSONFormMixin
+
+
+def get_user_data(user):
+    UserModel = type(user)
+    return {'id': user.pk, UserModel.USERNAME_FIELD: force_text(user.get_username())}
+
+
+class JSONTokenValidateMixin(JSONFormMixin):
+    """
+    Answers an invalid token with a 400 and `{"errors": {"token": [...]}}` instead of a message and a redirect.
+    """
+
+    def token_invalid(self, request, *args, **kwargs):
+        return self.render_json_errors({'token': [self.invalid_token_message]})
+
+
+class APIFormView(JSONFormMixin, FormView):
+
+    @method_decorator(csrf_protect)
+    @method_decorator(never_cache)
+    def dispatch(self, *args, **kwargs):
+        return super(APIFormView, self).dispatch(*args, **kwargs)
+
+
+class RegisterView(APIFormView):
+    form_class = RegisterForm
+    auto_login_on_success = True
+
+    def form_valid(self, form):
+        user = form.save()
+        if self.auto_login_on_success:
+            auto_login(self.request, user)
+        return self.render_json_success(user=get_user_data(user))
+
+
+class LoginView(APIFormView):
+    """
+    Unlike `sky_visitor.views.LoginView` there is no test cookie: API clients are expected to keep cookies.
+    """
+    form_class = LoginForm
+
+    def form_valid(self, form):
+        user = form.get_user()
+        signed_sessions.login(self.request, user)
+        return self.render_json_success(user=get_user_data(user))
+
+
+class LogoutView(JSONResponseMixin, View):
+    http_method_names = ['post', 'options']
+
+    def post(self, request, *args, **kwargs):
+        signed_sessions.logout(request)
+        return self.render_json_response({'ok': True})
+
+
+class ForgotPasswordView(SendTokenEmailMixin, APIFormView):
+    form_class = PasswordResetForm
+    email_template = 'visitor-forgot-password'
+    token_view_name = 'reset_password'
+
+    def form_valid(self, form):
+        for user in form.get_users():
+            self.send_email(user)
+        return self.render_json_success()
+
+
+class ResetPasswordView(JSONTokenValidateMixin, TokenValidateMixin, APIFormView):
+    form_class = SetPasswordForm
+    invalid_token_message = _("Invalid reset password link. Please reset your password again.")
+    auto_login_on_success = True
+
+    def get_form_kwargs(self):
+        kwargs = super(ResetPasswordView, self).get_form_kwargs()
+        kwargs['user'] = self.token_user  # Form expects this
+        return kwargs
+
+    def form_valid(self, form):
+        form.save()
+        if self.auto_login_on_success:
+            auto_login(self.request, self.token_user)
+        return self.render_json_success()
+
+
+class ChangePasswordView(APIFormView):
+    form_class = PasswordChangeForm
+    not_authenticated_message = _("Log in to change your password.")
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated():
+            return self.render_json_errors({'__all__': [self.not_authenticated_message]}, status=401)
+        return super(ChangePasswordView, self).dispatch(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super(ChangePasswordView, self).get_form_kwargs()
+        kwargs['user'] = self.request.user  # Form expects this
+        return kwargs
+
+    def form_valid(self, form):
+        form.save()
+        signed_sessions.update_session(self.request, form.user)
+        return self.render_json_success()
+
+
+class MagicLinkStartView(SendTokenEmailMixin, APIFormView):
+    form_class = MagicLinkForm
+    email_template = 'visitor-magic-link'
+    token_view_name = 'magic_link_login'
+    token_generator = magic_link_token_generator
+
+    def form_valid(self, form):
+        for user in form.get_users():
+            self.send_email(user)
+        return self.render_json_success()
+
+
+class MagicLinkLoginView(JSONTokenValidateMixin, TokenValidateMixin, View):
+    token_generator = magic_link_token_generator
+    invalid_token_message = _("This login link has expired or has already been used. Please request a new one.")
+
+    def post(self, request, *args, **kwargs):
+        if not getattr(self.token_user, 'is_active', True):
+            return self.token_invalid(request, *args, **kwargs)
+        auto_login(request, self.token_user)
+        return self.render_json_success(user=get_user_data(self.token_user))
+
+
+class InvitationStartView(SendTokenEmailMixin, APIFormView):
+    form_class = InvitationStartForm
+    email_template = 'invitation_complete'
+    token_view_name = 'invitation_complete'
+
+    def form_valid(self, form):
+        invited_user = form.save()
+        self.send_email(invited_user)
+        return self.render_json_success()
+
+
+class InvitationCompleteView(JSONTokenValidateMixin, InvitationTokenMixin, APIFormView):
+    form_class = InvitationCompleteForm
+    auto_login_on_success = True
+    invalid_token_message = _("This one-time use invitation URL has already been used. This means you have likely already created an account. Please try to login or use the forgot password form.")
+
+    def get_form_kwargs(self):
+        kwargs = super(InvitationCompleteView, self).get_form_kwargs()
+        kwargs['invited_user'] = self.get_invited_user()
+        return kwargs
+
+    def form_valid(self, form):
+        user = form.save()
+        if self.auto_login_on_success:
+            auto_login(self.request, user)
+        return self.render_json_success(user=get_user_data(user))
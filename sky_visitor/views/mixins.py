@@ -11,21 +11,28 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import json
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.tokens import default_token_generator
-from django.contrib.sites.models import Site
-from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import resolve_url
 from django.utils.decorators import method_decorator
+from django.utils.encoding import force_text
 from django.utils.functional import cached_property
 from django.utils.http import base36_to_int, int_to_base36
 from django.utils.translation import ugettext_lazy as _
 
 from emailtemplates.utils import send_email_template
+from sky_visitor.coalescing import claim_email_send, increment_counter, release_email_send
+from sky_visitor.db import get_read_database
+from sky_visitor.delivery import send_call, send_message
+from sky_visitor.models import InvitedUser
+from sky_visitor.rendering import email_renderer, use_compiled_emails
+from sky_visitor.sites import site_cache
 
 
 class LoginRequiredMixin(object):
@@ -36,36 +43,59 @@ class LoginRequiredMixin(object):
         return super(LoginRequiredMixin, self).dispatch(*args, **kwargs)
 
 
+class JSONResponseMixin(object):
+    json_content_type = 'application/json'
+
+    def render_json_response(self, data, status=200):
+        return HttpResponse(json.dumps(data, separators=(',', ':')), content_type=self.json_content_type, status=status)
+
+
+class JSONFormMixin(JSONResponseMixin):
+    """
+    For form views that answer with JSON instead of rendering a template or redirecting. Only POST is allowed. An invalid
+    form gets a 400 with `{"errors": {"field": ["message", ...]}}`; `form_valid()` should return `render_json_success()`.
+    """
+    http_method_names = ['post', 'options']
+
+    def form_invalid(self, form):
+        return self.render_json_errors(form.errors)
+
+    def render_json_errors(self, errors, status=400):
+        errors = dict((name, [force_text(message) for message in messages]) for name, messages in errors.items())
+        return self.render_json_response({'errors': errors}, status=status)
+
+    def render_json_success(self, **data):
+        data['ok'] = True
+        return self.render_json_response(data)
+
+
 class SendTokenEmailMixin(object):
     email_template = None
     token_view_name = None
+    token_generator = default_token_generator
+    email_coalesce_seconds = None  # Defaults to settings.SKY_VISITOR_EMAIL_COALESCE_SECONDS. See sky_visitor.coalescing
+    email_connection = None  # Compiled emails only: reuse this mail connection. See sky_visitor.rendering
+    # With settings.SKY_VISITOR_EMAIL_DELIVERY = 'background', emails are sent by a thread pool. See sky_visitor.delivery
+
+    def get_token_generator(self):
+        return self.token_generator
 
     def get_email_context_data(self, user, **kwargs):
         token_view_name = kwargs.get('token_view_name', self.token_view_name)
         if not token_view_name:
             raise ImproperlyConfigured("No token_view_name defined.")
 
-        site = Site.objects.get_current()
-        token = default_token_generator.make_token(user)
+        site_context = site_cache.get_site_context(getattr(self, 'request', None))
+        token = self.get_token_generator().make_token(user)
         uidb36 = int_to_base36(user.id)
 
-        static_url = settings.STATIC_URL
-
-        token_url = reverse(token_view_name, kwargs={'uidb36': uidb36, 'token': token})
-        if hasattr(self, 'request'):
-            token_url = self.request.build_absolute_uri(token_url)
-            if '://' not in static_url:
-                static_url = self.request.build_absolute_uri(static_url)
-        else:
-            token_url = 'http://%s%s' % (site.domain, token_url)
-
         return {
             'user': user,
             'uid': uidb36,
             'token': token,
-            'token_url': token_url,
-            'site': site,
-            'static_url': static_url,
+            'token_url': email_renderer.get_token_url(site_context['url_prefix'], token_view_name, uidb36, token),
+            'site': site_context['site'],
+            'static_url': site_context['static_url'],
         }
 
     def send_email(self, user, **kwargs):
@@ -75,12 +105,53 @@ class SendTokenEmailMixin(object):
         template_name = kwargs.get('template_name', self.email_template)
         if not template_name:
             raise ImproperlyConfigured("No email_template defined.")
+        if not claim_email_send(template_name, to_address, self.email_coalesce_seconds, user.pk):
+            return False
 
-        context = self.get_email_context_data(user, **kwargs)
-        return send_email_template(template_name, [to_address], 
-            context=context, 
-            attachments=kwargs.get('attachments',None),
-            headers=kwargs.get('headers',None))
+        # With background delivery these run on the delivery thread, once the message has been sent or has failed
+        def on_sent():
+            increment_counter(template_name, 'sent')
+
+        def on_failed():
+            # Don't suppress a retry for a message that never went out
+            release_email_send(template_name, to_address, user.pk)
+
+        try:
+            if use_compiled_emails():
+                result = self.send_compiled_email(user, template_name, on_sent=on_sent, on_failed=on_failed, **kwargs)
+            else:
+                context = self.get_email_context_data(user, **kwargs)
+                # emailtemplates opens its own connection, so don't have a delivery thread open one
+                result = send_call(lambda connection: send_email_template(template_name, [to_address],
+                    context=context, 
+                    attachments=kwargs.get('attachments',None),
+                    headers=kwargs.get('headers',None)), needs_connection=False, on_sent=on_sent, on_failed=on_failed)
+        except Exception:
+            # Also covers errors before the message was handed over, such as rendering
+            on_failed()
+            raise
+        return result
+
+    def send_compiled_email(self, user, template_name, on_sent=None, on_failed=None, **kwargs):
+        """
+        Send with `sky_visitor.rendering.email_renderer` instead of `emailtemplates`. Templates and site-wide context
+        are cached, so only the recipient's values are rendered per message. `on_sent()` or `on_failed()` is called once
+        the message has been sent or has failed.
+        """
+        token_view_name = kwargs.get('token_view_name', self.token_view_name)
+        if not token_view_name:
+            raise ImproperlyConfigured("No token_view_name defined.")
+        message = email_renderer.get_message(template_name, user, self.get_token_generator().make_token(user),
+                                             token_view_name, request=getattr(self, 'request', None),
+                                             headers=kwargs.get('headers', None), connection=self.email_connection)
+        for attachment in kwargs.get('attachments', None) or ():
+            message.attach(*attachment)
+        if self.email_connection is not None:
+            result = message.send()
+            if on_sent is not None:
+                on_sent()
+            return result
+        return send_message(message, on_sent, on_failed)
 
 
 class TokenValidateMixin(object):
@@ -98,6 +169,14 @@ class TokenValidateMixin(object):
     def get_user_model_class(self):
         return get_user_model()
 
+    def get_token_user_queryset(self):
+        """
+        On safe requests the user is only displayed, so it may be read from a replica. Otherwise it is about to be
+        written, so it is read from the primary.
+        """
+        UserModel = self.get_user_model_class()
+        return UserModel._default_manager.using(get_read_database(UserModel, self.request))
+
     @cached_property
     def token_user(self):
         uidb36 = self.kwargs.get('uidb36')
@@ -106,7 +185,7 @@ class TokenValidateMixin(object):
         if not hasattr(self, '_token_user'):
             try:
                 uid_int = base36_to_int(uidb36)
-                self._token_user = UserModel._default_manager.get(id=uid_int)
+                self._token_user = self.get_token_user_queryset().get(id=uid_int)
             except (ValueError, OverflowError, UserModel.DoesNotExist):
                 self._token_user = None
         return self._token_user
@@ -115,6 +194,7 @@ class TokenValidateMixin(object):
         token = kwargs['token']
         assert token is not None  # checked by URLconf
         self.is_token_valid = (self.token_user is not None and self.get_token_generator().check_token(self.token_user, token))
+        request._sky_visitor_token_valid = self.is_token_valid  # For TrafficRecorderMiddleware
         if not self.is_token_valid:
             return self.token_invalid(request, *args, **kwargs)
         return super(TokenValidateMixin, self).dispatch(request, *args, **kwargs)
@@ -129,3 +209,22 @@ class TokenValidateMixin(object):
         Redirecting away from this page is recommended, so the user doesn't have any opportunity to see the invitation completion form if their token is invalid.
         """
         return resolve_url(settings.LOGIN_URL)
+
+
+class InvitationTokenMixin(TokenValidateMixin):
+    """
+    Validates invitation tokens, which belong to an `InvitedUser` that hasn't registered or expired yet.
+    """
+
+    def get_user_model_class(self):
+        """
+        Used for token validation. We're faking a real user with the InvitedUser so we can use django core's token validation code.
+        """
+        return InvitedUser
+
+    def get_token_user_queryset(self):
+        # Expired (and already completed) invitations can't be used
+        return super(InvitationTokenMixin, self).get_token_user_queryset().filter(status=InvitedUser.STATUS_INVITED)
+
+    def get_invited_user(self):
+        return self.token_user